@@ -0,0 +1,85 @@
+"""Recall@k and query latency of IVFIndex against exact search.
+
+Builds an index over clustered synthetic embeddings (real chunk embeddings
+cluster by topic; uniform random vectors are the worst case for any IVF
+index), then sweeps nprobe. Needs about 3.5 GB of RAM at the default size.
+
+Run from the repository root:
+    python benchmarks/bench_ann.py [--n 1000000] [--dim 384] [--queries 200] [--uniform]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.ann import IVFIndex  # noqa: E402
+
+BATCH = 100_000
+NPROBES = [1, 4, 8, 16, 32, 64]
+
+
+def clustered(rng, centers, n, noise):
+    which = rng.integers(0, len(centers), n)
+    return (centers[which] + rng.standard_normal((n, centers.shape[1]), dtype=np.float32) * noise).astype(np.float32)
+
+
+def percentile_ms(latencies, q):
+    return np.percentile(np.array(latencies) * 1000, q)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--uniform", action="store_true", help="unclustered Gaussian vectors (worst case)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((max(1, args.n // 500), args.dim), dtype=np.float32)
+    noise = 1.0  # same-topic chunks land around cosine 0.5
+    if args.uniform:
+        centers, noise = np.zeros((1, args.dim), dtype=np.float32), 1.0
+
+    # Defer training until everything is added, as a rebuild from document_contexts would
+    index = IVFIndex(args.dim, nlist=args.nlist, min_train=args.n + 1)
+    index.reserve(args.n)
+    start = time.perf_counter()
+    for offset in range(0, args.n, BATCH):
+        size = min(BATCH, args.n - offset)
+        index.add([str(i) for i in range(offset, offset + size)], clustered(rng, centers, size, noise))
+    added = time.perf_counter() - start
+    start = time.perf_counter()
+    index.train()
+    trained = time.perf_counter() - start
+    print(f"{args.n} x {args.dim}: add {added:.1f}s, train + assign {trained:.1f}s, {len(index.centroids)} lists")
+
+    queries = clustered(rng, centers, args.queries, noise)
+    matrix = index._vectors[:len(index)]
+    exact, exact_latency = [], []
+    for q in queries:
+        start = time.perf_counter()
+        scores = matrix @ (q / np.linalg.norm(q))
+        top = np.argpartition(-scores, args.k)[:args.k]
+        exact_latency.append(time.perf_counter() - start)
+        exact.append({index.texts[i] for i in top})
+    print(f"{'exact':>10} recall@{args.k}=1.000  p50={percentile_ms(exact_latency, 50):7.2f}ms "
+          f"p99={percentile_ms(exact_latency, 99):7.2f}ms")
+
+    for nprobe in NPROBES:
+        hits, latency = 0, []
+        for q, truth in zip(queries, exact):
+            start = time.perf_counter()
+            found = index.search(q, k=args.k, threshold=None, nprobe=nprobe)
+            latency.append(time.perf_counter() - start)
+            hits += len(truth & {text for _, text in found})
+        print(f"nprobe={nprobe:>3} recall@{args.k}={hits / (args.k * len(queries)):.3f}  "
+              f"p50={percentile_ms(latency, 50):7.2f}ms p99={percentile_ms(latency, 99):7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
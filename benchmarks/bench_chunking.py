@@ -0,0 +1,94 @@
+"""Chunking throughput on ~5 MB of policy-like text.
+
+Compares the original concatenating chunk_text, the streaming line packer
+(ingest.iter_chunks) and TokenChunker with the regex tokenizer. Pass
+--real to also time TokenChunker with all-MiniLM-L6-v2's fast tokenizer
+(requires sentence-transformers and the model in the local cache).
+
+    python benchmarks/bench_chunking.py [--real] [--megabytes 5]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.ingest import iter_chunks  # noqa: E402
+from src.chunking import TokenChunker  # noqa: E402
+
+WORDS = ("the tenant shall pay rent monthly in advance and must not sublet the premises without written consent "
+         "of the landlord personal data is retained for no longer than necessary under applicable law").split()
+
+
+def legacy_chunk_text(text, max_length=2000):
+    # Copy of chunk_text before it delegated to iter_chunks
+    paragraphs = text.split('\n')
+    chunks = []
+    current = ''
+    for para in paragraphs:
+        if len(current) + len(para) < max_length:
+            current += para + '\n'
+        else:
+            if current:
+                chunks.append(current.strip())
+            current = para + '\n'
+    if current:
+        chunks.append(current.strip())
+    return chunks
+
+
+def make_pages(megabytes, rng):
+    # Pages of paragraphs of sentences, with the odd very long unpunctuated run (tables, scanned text)
+    pages, size = [], 0
+    while size < megabytes * 1024 * 1024:
+        paragraphs = []
+        for _ in range(rng.integers(3, 12)):
+            sentences = [" ".join(rng.choice(WORDS, rng.integers(4, 40))).capitalize() + "." for _ in range(rng.integers(1, 8))]
+            if rng.random() < 0.02:
+                sentences.append(" ".join(rng.choice(WORDS, 3000)))
+            paragraphs.append(" ".join(sentences))
+        page = "\n".join(paragraphs)
+        pages.append(page)
+        size += len(page) + 1
+    return pages
+
+
+def report(name, seconds, chunks, nbytes):
+    sizes = [len(c) for c in chunks]
+    print(f"{name:<28} {seconds * 1000:>8.0f}ms {nbytes / seconds / 1e6:>8.1f} MB/s {len(chunks):>7} chunks "
+          f"{int(np.mean(sizes)):>6} avg / {max(sizes):>7} max chars")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--megabytes", type=float, default=5)
+    parser.add_argument("--real", action="store_true")
+    args = parser.parse_args()
+
+    pages = make_pages(args.megabytes, np.random.default_rng(0))
+    text = "\n".join(pages)
+    print(f"{len(text) / 1e6:.1f} MB in {len(pages)} pages")
+
+    start = time.perf_counter()
+    chunks = legacy_chunk_text(text)
+    report("chunk_text (legacy)", time.perf_counter() - start, chunks, len(text))
+
+    start = time.perf_counter()
+    chunks = list(iter_chunks(pages))
+    report("iter_chunks", time.perf_counter() - start, chunks, len(text))
+
+    chunkers = [("TokenChunker regex", TokenChunker())]
+    if args.real:
+        from sentence_transformers import SentenceTransformer
+        chunkers.append(("TokenChunker MiniLM", TokenChunker.for_model(SentenceTransformer("all-MiniLM-L6-v2"))))
+    for name, chunker in chunkers:
+        start = time.perf_counter()
+        chunks = list(chunker.iter_chunks(pages))
+        report(name, time.perf_counter() - start, chunks, len(text))
+        assert all(text[c.start:c.end] == c for c in chunks)
+        print(f"{'':<28} max {max(c.tokens for c in chunks)} tokens (budget {chunker.max_tokens})")
+
+
+if __name__ == "__main__":
+    main()
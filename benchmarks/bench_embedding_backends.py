@@ -0,0 +1,141 @@
+"""Embedding throughput vs retrieval agreement for each backend and output dtype.
+
+The reference is the current setup: full-precision torch, float32. Each
+other combination encodes the same corpus chunks and questions.
+- Throughput is chunks/s on the upload path (embed_texts), median of --repeat.
+- Cosine is the mean similarity of each chunk vector to the reference vector.
+- overlap@k is the mean share of each question's top-k chunks (RAG_TOP_K by
+  default) that match the reference's top-k.
+- top-1 is how often the best chunk matches.
+- The "mixed" columns score the variant's question vectors against the
+  reference chunk vectors. That is the situation right after switching
+  backends, when already stored document_contexts rows were embedded
+  with the old model.
+
+The corpus is the chunks of the given policy documents (pdf, docx, pptx,
+txt), cut by the upload TokenChunker. Without --corpus, synthetic policy
+clauses are used. Loads EMBEDDING_MODEL_NAME (honouring
+EMBEDDING_MODEL_CACHE_DIR) once per backend.
+
+    python benchmarks/bench_embedding_backends.py [--corpus docs/*.pdf] [--queries questions.txt]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.embedding_backends import BACKENDS  # noqa: E402
+from src.chunking import TokenChunker  # noqa: E402
+from src.parsers import iter_pages  # noqa: E402
+from src.retrieval import normalize_rows, RAG_TOP_K  # noqa: E402
+
+QUESTIONS = [
+    "What does the policy cover?", "Is flood damage excluded?", "How do I cancel my subscription?",
+    "When are premiums due?", "How long is personal data retained?", "Who can I contact about a claim?",
+    "What happens if I miss a payment?", "Can the insurer change the terms?", "Is there a waiting period?",
+    "How are disputes resolved?", "Do you share my data with third parties?", "What is the refund policy?",
+    "How much notice must I give before cancelling?", "Are pre-existing conditions covered?",
+    "What is the deductible for a claim?", "Which law governs this agreement?",
+]
+SUBJECTS = ["The insured", "The policyholder", "The company", "You", "The provider", "Either party", "The insurer"]
+CLAUSES = [
+    "must notify the insurer within thirty days of any event that may give rise to a claim",
+    "may cancel this agreement at renewal by giving written notice",
+    "shall pay the premium monthly in advance by direct debit",
+    "will process personal data lawfully and retain it no longer than necessary",
+    "is not liable for damage caused by flood, earthquake or wear and tear",
+    "may amend these terms on sixty days notice published on the website",
+    "can request a refund of unused fees within fourteen days of purchase",
+    "agrees that disputes are settled by arbitration under the laws of England",
+    "must pay a deductible of 250 euros for each claim",
+    "will not share customer data with third parties except processors acting on its behalf",
+    "shall have no cover for pre-existing conditions during the first twelve months",
+]
+
+
+def synthetic_corpus(n, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(f"{rng.choice(SUBJECTS)} {rng.choice(CLAUSES)}." for _ in range(rng.randint(2, 6)))
+            for _ in range(n)]
+
+
+def load_corpus(paths, chunker):
+    chunks = []
+    for path in paths:
+        ext = os.path.splitext(path)[1].lower()
+        if ext == ".txt":
+            with open(path, encoding="utf-8", errors="replace") as f:
+                pages = [f.read()]
+        else:
+            pages = iter_pages(path, ext)
+        chunks.extend(str(c) for c in chunker.iter_chunks(pages))
+    return chunks
+
+
+def top_k(queries, chunks, k):
+    scores = normalize_rows(queries) @ normalize_rows(chunks).T
+    return np.argsort(-scores, axis=1, kind="stable")[:, :k]
+
+
+def agreement(found, reference):
+    k = reference.shape[1]
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(found, reference)])
+    return overlap, np.mean(found[:, 0] == reference[:, 0])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", nargs="*", default=[])
+    parser.add_argument("--queries")
+    parser.add_argument("--synthetic-chunks", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=RAG_TOP_K)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dtypes", default="float32,float16")
+    args = parser.parse_args()
+
+    backends = {}
+    for name, cls in BACKENDS.items():
+        for dtype in args.dtypes.split(","):
+            backends[(name, dtype)] = cls(dtype=dtype)
+    reference_key = ("torch", "float32")
+    reference = backends[reference_key]
+
+    chunker = TokenChunker.for_model(reference.model.load())
+    chunks = load_corpus(args.corpus, chunker) if args.corpus else synthetic_corpus(args.synthetic_chunks)
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        questions = QUESTIONS
+    k = min(args.k, len(chunks))
+    print(f"{len(chunks)} chunks, {len(questions)} questions, k={k}, "
+          f"{'corpus ' + ', '.join(args.corpus) if args.corpus else 'synthetic corpus'}")
+
+    results = {}
+    for key, backend in backends.items():
+        backend.model.warm()
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            vectors = backend.encode(chunks)
+            samples.append(time.perf_counter() - start)
+        results[key] = (statistics.median(samples), vectors, backend.encode(questions))
+
+    ref_seconds, ref_chunks, ref_questions = results[reference_key]
+    ref_top = top_k(ref_questions, ref_chunks, k)
+    print(f"\n{'backend':<8} {'dtype':<8} {'chunks/s':>9} {'speedup':>8} {'cosine':>7} "
+          f"{'overlap@k':>10} {'top-1':>6} {'mixed@k':>8} {'mixed top-1':>12}")
+    for (name, dtype), (seconds, vectors, questions_vectors) in results.items():
+        cosine = np.mean(np.sum(normalize_rows(vectors) * normalize_rows(ref_chunks), axis=1))
+        overlap, top1 = agreement(top_k(questions_vectors, vectors, k), ref_top)
+        mixed_overlap, mixed_top1 = agreement(top_k(questions_vectors, ref_chunks, k), ref_top)
+        print(f"{name:<8} {dtype:<8} {len(chunks) / seconds:>9.1f} {ref_seconds / seconds:>7.2f}x {cosine:>7.4f} "
+              f"{overlap:>10.3f} {top1:>6.2f} {mixed_overlap:>8.3f} {mixed_top1:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Load test: one-at-a-time blocking encodes vs EmbeddingService micro-batching.
+
+Uses a simulated encoder whose cost is a fixed per-call overhead plus a
+small per-text cost, which is how SentenceTransformer.encode behaves on CPU.
+Pass --real to use all-MiniLM-L6-v2 instead (requires sentence-transformers).
+
+    python benchmarks/bench_embedding_service.py [--real] [--concurrency 64]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.embedding_service import EmbeddingService  # noqa: E402
+
+CALL_OVERHEAD_S = 0.008
+PER_TEXT_S = 0.0005
+
+
+def simulated_encode(texts):
+    time.sleep(CALL_OVERHEAD_S + PER_TEXT_S * len(texts))
+    return np.random.default_rng(len(texts)).standard_normal((len(texts), 384)).astype(np.float32)
+
+
+def percentiles(latencies):
+    lat = np.array(latencies) * 1000
+    return f"p50={np.percentile(lat, 50):7.1f}ms p99={np.percentile(lat, 99):7.1f}ms"
+
+
+async def blocking_handler(encode, text, arrived, latencies):
+    # What /ask did before: encode synchronously inside the async handler
+    encode([text])
+    latencies.append(time.perf_counter() - arrived)
+
+
+async def service_handler(service, text, arrived, latencies):
+    await service.embed(text)
+    latencies.append(time.perf_counter() - arrived)
+
+
+async def run(encode, concurrency, rounds, repeat_ratio):
+    texts = [f"what is the cancellation policy? variant {i}" for i in range(concurrency * rounds)]
+    # A share of queries repeat an earlier one, which the memo absorbs
+    if repeat_ratio:
+        for i in range(0, len(texts), max(1, int(1 / repeat_ratio))):
+            texts[i] = texts[0]
+    service = EmbeddingService(encode)
+
+    for name, make in (("blocking", lambda t, a, lat: blocking_handler(encode, t, a, lat)),
+                       ("batched ", lambda t, a, lat: service_handler(service, t, a, lat))):
+        latencies = []
+        start = time.perf_counter()
+        for r in range(rounds):
+            # Every request in a round arrives at the same instant
+            arrived = time.perf_counter()
+            batch = texts[r * concurrency:(r + 1) * concurrency]
+            await asyncio.gather(*(make(t, arrived, latencies) for t in batch))
+        total = time.perf_counter() - start
+        print(f"{name}: {percentiles(latencies)} total={total:.2f}s")
+    print(f"service stats: {service.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--real", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--repeat-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+    encode = simulated_encode
+    if args.real:
+        from sentence_transformers import SentenceTransformer
+        encode = SentenceTransformer('all-MiniLM-L6-v2').encode
+    asyncio.run(run(encode, args.concurrency, args.rounds, args.repeat_ratio))
+
+
+if __name__ == "__main__":
+    main()
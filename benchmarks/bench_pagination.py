@@ -0,0 +1,139 @@
+"""Response size and server-side cost of GET /messages at 10k messages.
+
+Compares the old full-history response (every column of every message)
+with one keyset page, a projected page (fields=sender,content) and a 304
+revalidation. Rows are synthetic, with context/metadata JSON of the size
+the /ask path stores, and are encoded the way the endpoint does
+(JSONResponse + ETag); database time is not included. Pass --url (and
+--conversation) to time the live endpoint end to end instead.
+
+    python benchmarks/bench_pagination.py [--messages 10000] [--limit 50]
+    python benchmarks/bench_pagination.py --url http://localhost:8080 --conversation <uuid>
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi import Request  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from src.pagination import etag_response, split_page  # noqa: E402
+
+REPEAT = 20
+
+
+def make_messages(n):
+    start = datetime(2026, 1, 1)
+    conversation_id = str(uuid.uuid4())
+    rows = []
+    for i in range(n):
+        ai = i % 2 == 1
+        rows.append({
+            "id": str(uuid.uuid4()),
+            "conversation_id": conversation_id,
+            "sender": "ai" if ai else "user",
+            "content": ("The policy states that " * (40 if ai else 4)).strip(),
+            "created_at": (start + timedelta(seconds=30 * i)).isoformat() + "+00:00",
+            "content_type": "text",
+            "context": {"rag_context": "Relevant clause text. " * 60} if ai else {},
+            "metadata": {"model_used": "gemini-1.5-flash", "timestamp": start.isoformat()},
+        })
+    return rows
+
+
+def fake_request(headers=None):
+    raw = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw, "query_string": b""})
+
+
+def timed(fn):
+    samples = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), result
+
+
+def report(name, seconds, response):
+    print(f"{name:<32} {response.status_code:>4} {len(response.body):>12,} bytes {seconds * 1000:>9.2f}ms")
+
+
+def local(args):
+    rows = make_messages(args.messages)
+    newest_first = rows[::-1]
+    print(f"{args.messages} messages, page size {args.limit}")
+
+    def legacy():
+        return JSONResponse(content={"messages": newest_first[::-1], "total": len(rows)})
+
+    def page(fields=None):
+        fetched = newest_first[:args.limit + 1]
+        if fields:
+            fetched = [{k: r[k] for k in ("created_at", "id") + fields} for r in fetched]
+        messages, cursor = split_page(fetched, args.limit)
+        return etag_response(fake_request(), {"messages": messages[::-1], "total": len(messages), "next_cursor": cursor})
+
+    report("full history (before)", *timed(legacy))
+    seconds, first = timed(page)
+    report("first page", seconds, first)
+    report("first page, sender,content", *timed(lambda: page(("sender", "content"))))
+    etag = first.headers["etag"]
+
+    def revalidate():
+        fetched = newest_first[:args.limit + 1]
+        messages, cursor = split_page(fetched, args.limit)
+        return etag_response(fake_request({"If-None-Match": etag}),
+                             {"messages": messages[::-1], "total": len(messages), "next_cursor": cursor})
+    report("first page, If-None-Match", *timed(revalidate))
+
+
+def live(args):
+    import httpx
+    path = f"{args.url.rstrip('/')}/messages/{args.conversation}"
+    with httpx.Client(timeout=60) as client:
+        def get(params=None, headers=None):
+            samples, response = [], None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                response = client.get(path, params=params, headers=headers)
+                samples.append(time.perf_counter() - start)
+            return statistics.median(samples), response
+
+        def show(name, seconds, response):
+            print(f"{name:<32} {response.status_code:>4} {len(response.content):>12,} bytes {seconds * 1000:>9.2f}ms")
+
+        seconds, first = get({"limit": args.limit})
+        show("first page", seconds, first)
+        show("first page, sender,content", *get({"limit": args.limit, "fields": "sender,content"}))
+        show("first page, If-None-Match", *get({"limit": args.limit}, {"If-None-Match": first.headers.get("etag", "")}))
+        start, pages, size, cursor = time.perf_counter(), 0, 0, None
+        while True:
+            response = client.get(path, params={"limit": 200, **({"cursor": cursor} if cursor else {})})
+            pages, size = pages + 1, size + len(response.content)
+            cursor = response.json().get("next_cursor")
+            if not cursor:
+                break
+        print(f"{'whole history, 200 per page':<32} {pages:>4} {size:>12,} bytes {(time.perf_counter() - start) * 1000:>9.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--url")
+    parser.add_argument("--conversation")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    if args.url:
+        live(args)
+    else:
+        local(args)
+
+
+if __name__ == "__main__":
+    main()
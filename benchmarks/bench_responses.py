@@ -0,0 +1,125 @@
+"""Serialization time and bytes on the wire for /upload, /messages and /ask payloads.
+
+"before" is the old path: serialize_response's json.dumps(cls=UUIDEncoder)
++ json.loads round trip, then JSONResponse rendering it again. "after" is
+FastJSONResponse (orjson when installed, else the stdlib fallback, which
+is also timed). Sizes are reported raw and gzip/brotli compressed at the
+levels CompressionMiddleware uses, plus /upload with echo_text truncation.
+
+    python benchmarks/bench_responses.py [--upload-chars 1000000]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi.responses import JSONResponse  # noqa: E402
+from src import responses  # noqa: E402
+from src.responses import FastJSONResponse, compress, brotli, orjson  # noqa: E402
+
+REPEAT = 30
+WORDS = ("the insured must notify insurer within thirty days of any claim coverage excludes damage caused by "
+         "flood earthquake or wear and tear premiums are payable monthly policyholder may cancel at renewal "
+         "personal data processed lawfully retained no longer than necessary").split()
+
+
+class UUIDEncoder(json.JSONEncoder):
+    # Copy of the encoder app.py used before FastJSONResponse
+    def default(self, obj):
+        if isinstance(obj, uuid.UUID):
+            return str(obj)
+        return super().default(obj)
+
+
+def before(content):
+    return JSONResponse(content=json.loads(json.dumps(content, cls=UUIDEncoder))).body
+
+
+def after(content):
+    return FastJSONResponse(content=content).body
+
+
+def after_stdlib(content):
+    saved, responses.orjson = responses.orjson, None
+    try:
+        return FastJSONResponse(content=content).body
+    finally:
+        responses.orjson = saved
+
+
+def prose(rng, chars):
+    # Random sentences, so compression ratios are closer to real documents than a repeated string
+    parts, size = [], 0
+    while size < chars:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 30))).capitalize() + ". "
+        parts.append(sentence)
+        size += len(sentence)
+    return "".join(parts)[:chars]
+
+
+def payloads(upload_chars):
+    rng = random.Random(0)
+    text = prose(rng, upload_chars)
+    upload = {
+        "text": text, "text_truncated": False, "filename": "policy.pdf", "chunks": 412,
+        "conversation_id": uuid.uuid4(), "stored": 412, "pages": 180,
+        "timings": {"parse": 1.2, "chunk": 0.3, "embed": 8.1, "select": 0.2, "store": 0.9},
+        "insert": {"rows": 412, "batches": 5, "seconds": 0.9}, "cache_hit": False,
+    }
+    start = datetime(2026, 1, 1)
+    messages = {"messages": [{
+        "id": uuid.uuid4(), "conversation_id": uuid.uuid4(), "sender": "ai" if i % 2 else "user",
+        "content": prose(rng, 2000 if i % 2 else 150), "created_at": (start + timedelta(minutes=i)).isoformat(),
+        "content_type": "text", "context": {}, "metadata": {"model_used": "gemini-1.5-flash"},
+    } for i in range(50)], "total": 50, "next_cursor": "WyIyMDI2LTAxLTAxVDAwOjAwOjAwIiwiYWJjIl0"}
+    ask = {"answer": prose(rng, 800), "context": "\n---\n".join(prose(rng, 1500) for _ in range(3))}
+    return [("/upload", upload), ("/messages page", messages), ("/ask", ask)]
+
+
+def timed(fn, content):
+    samples = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        body = fn(content)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000, body
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--upload-chars", type=int, default=1_000_000)
+    args = parser.parse_args()
+    print(f"orjson: {'yes' if orjson else 'no'}, brotli: {'yes' if brotli else 'no'}")
+
+    print(f"\n{'payload':<16} {'before':>10} {'after':>10} {'stdlib':>10}")
+    bodies = {}
+    for name, content in payloads(args.upload_chars):
+        old_ms, _ = timed(before, content)
+        new_ms, body = timed(after, content)
+        std_ms, _ = timed(after_stdlib, content)
+        bodies[name] = body
+        print(f"{name:<16} {old_ms:>8.2f}ms {new_ms:>8.2f}ms {std_ms:>8.2f}ms")
+
+    upload = payloads(args.upload_chars)[0][1]
+    for echo in (10_000, 0):
+        truncated = dict(upload, text=upload["text"][:echo] if echo else None, text_truncated=True)
+        bodies[f"/upload echo={echo}"] = after(truncated)
+
+    encodings = ["gzip"] + (["br"] if brotli else [])
+    print(f"\n{'payload':<20} {'raw bytes':>12}" + "".join(f" {e:>12} {e + ' ms':>9}" for e in encodings))
+    for name, body in bodies.items():
+        row = f"{name:<20} {len(body):>12,}"
+        for encoding in encodings:
+            ms, compressed = timed(lambda b: compress(b, encoding), body)
+            row += f" {len(compressed):>12,} {ms:>8.2f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
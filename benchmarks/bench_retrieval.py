@@ -0,0 +1,63 @@
+"""Compare the legacy per-chunk cosine loop from /ask with EmbeddingIndex.
+
+Run from the repository root:
+    python benchmarks/bench_retrieval.py
+"""
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.retrieval import EmbeddingIndex  # noqa: E402
+
+DIM = 384  # all-MiniLM-L6-v2
+SIZES = [100, 10_000, 100_000]
+QUERIES = 20
+
+
+def legacy_top_k(rows, question_embedding, k=3):
+    # Copy of the loop /ask used before EmbeddingIndex
+    def cosine(a, b):
+        a = np.array(a)
+        b = np.array(b)
+        norm_a = np.linalg.norm(a)
+        norm_b = np.linalg.norm(b)
+        if norm_a == 0 or norm_b == 0:
+            return 0.0
+        return float(np.dot(a, b) / (norm_a * norm_b))
+    scored = [(cosine(row["embedding"], question_embedding), row["content"]) for row in rows if row.get("embedding")]
+    scored.sort(reverse=True)
+    return scored[:k]
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f"{'chunks':>8} {'legacy/query':>14} {'index build':>12} {'index/query':>12} {'speedup':>9}")
+    for n in SIZES:
+        vectors = rng.standard_normal((n, DIM)).astype(np.float32)
+        rows = [{"content": f"chunk {i}", "embedding": v} for i, v in enumerate(vectors.tolist())]
+        queries = rng.standard_normal((QUERIES, DIM)).tolist()
+
+        legacy_runs = queries[:max(1, QUERIES // (1 + n // 10_000))]
+        start = time.perf_counter()
+        for q in legacy_runs:
+            expected = legacy_top_k(rows, q)
+        legacy = (time.perf_counter() - start) / len(legacy_runs)
+
+        start = time.perf_counter()
+        index = EmbeddingIndex.from_rows(rows)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for q in queries:
+            result = index.search(q, k=3)
+        vectorized = (time.perf_counter() - start) / len(queries)
+
+        assert [c for _, c in result] == [c for _, c in legacy_top_k(rows, queries[-1])]
+        assert expected
+        print(f"{n:>8} {legacy * 1000:>12.2f}ms {build * 1000:>10.2f}ms {vectorized * 1000:>10.3f}ms {legacy / vectorized:>8.0f}x")
+
+
+if __name__ == "__main__":
+    main()
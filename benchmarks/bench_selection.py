@@ -0,0 +1,84 @@
+"""Compare the legacy SMART CHUNK SELECTION loop from /upload with ChunkSelector.
+
+Run from the repository root:
+    python benchmarks/bench_selection.py
+"""
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.selection import ChunkSelector  # noqa: E402
+
+DIM = 384  # all-MiniLM-L6-v2
+SIZES = [1_000, 10_000, 30_000]
+LEGACY_MAX_SIZE = 2_000  # the uncapped legacy loop is quadratic in Python; skip it above this
+BATCH = 64  # INGEST_EMBED_BATCH_SIZE
+
+
+def legacy_select(chunks, embeddings, max_chunks, sim_threshold=0.85):
+    # Copy of the loop /upload used before ChunkSelector
+    scored = sorted([(len(c), i, c, e) for i, (c, e) in enumerate(zip(chunks, embeddings)) if len(c.strip()) > 50], reverse=True)
+    selected = []
+    selected_embeds = []
+    for _, _, chunk, embed in scored:
+        if len(selected) >= max_chunks:
+            break
+        is_duplicate = False
+        for e2 in selected_embeds:
+            sim = float(np.dot(embed, e2) / (np.linalg.norm(embed) * np.linalg.norm(e2)))
+            if sim > sim_threshold:
+                is_duplicate = True
+                break
+        if not is_duplicate:
+            selected.append((chunk, embed))
+            selected_embeds.append(embed)
+    return selected
+
+
+def make_document(n, rng):
+    # Topic clusters plus repeated boilerplate, roughly what policy documents look like
+    topics = rng.standard_normal((max(1, n // 4), DIM))
+    which = rng.integers(0, len(topics), n)
+    noise = rng.choice([0.1, 0.6, 1.5], n)[:, None]
+    embeddings = (topics[which] + rng.standard_normal((n, DIM)) * noise).astype(np.float32)
+    chunks = [f"chunk {i} " + "x" * int(length) for i, length in enumerate(rng.integers(20, 2000, n))]
+    return chunks, embeddings
+
+
+def run_selector(chunks, embeddings, **kwargs):
+    selector = ChunkSelector(**kwargs)
+    selected = []
+    for start in range(0, len(chunks), BATCH):
+        selected += selector.offer(chunks[start:start + BATCH], embeddings[start:start + BATCH])
+    return selected + selector.finish()
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f"{'chunks':>8} {'mode':>10} {'legacy':>10} {'selector':>10} {'kept':>7}")
+    for n in SIZES:
+        chunks, embeddings = make_document(n, rng)
+        as_lists = embeddings.tolist()
+        for mode, max_chunks in (("capped 10", 10), ("uncapped", 0)):
+            legacy = "skipped"
+            if max_chunks or n <= LEGACY_MAX_SIZE:
+                seconds, expected = timed(legacy_select, chunks, as_lists, max_chunks or n)
+                legacy = f"{seconds * 1000:.0f}ms"
+            seconds, selected = timed(run_selector, chunks, embeddings, max_chunks=max_chunks)
+            note = ""
+            if max_chunks:
+                # Identical unless near-duplicates chain (A~B, B~C, not A~C); see ChunkSelector
+                note = f"  ({len({c for c, _ in selected} & {c for c, _ in expected})}/{len(expected)} same as legacy)"
+            print(f"{n:>8} {mode:>10} {legacy:>10} {seconds * 1000:>8.0f}ms {len(selected):>7}{note}")
+
+
+if __name__ == "__main__":
+    main()
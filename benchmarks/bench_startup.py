@@ -0,0 +1,104 @@
+"""Cold-start cost: import time of src.app and time to first /health and /ready response.
+
+Each measurement runs in a fresh interpreter. "import" times
+`import src.app` alone. "serve" starts uvicorn and polls until /health,
+then /ready, answer 200, timed from process start. For comparison,
+the eager imports the app used to pay before serving anything are
+timed on their own: the parser libraries, google-generativeai, and
+sentence_transformers plus loading the embedding model.
+
+Needs the usual environment (SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, and
+GEMINI_API_KEY or LLM_BACKEND=fake); nothing is requested from Supabase.
+Set EMBEDDING_MODEL_CACHE_DIR to measure loading a pre-serialized model.
+
+    python benchmarks/bench_startup.py [--runs 3] [--port 8765]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import urllib.request
+import urllib.error
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EAGER = {
+    "parsers (fitz, docx, pptx, PIL, pytesseract)": "import fitz, docx, pptx, PIL.Image, pytesseract",
+    "google.generativeai": "import google.generativeai",
+    "sentence_transformers import": "import sentence_transformers",
+    # Same loading path as the app, so EMBEDDING_MODEL_CACHE_DIR applies
+    "sentence_transformers + model load": "from src.startup import LazyModel; LazyModel().load()",
+    "import src.app": "import src.app",
+}
+
+
+def timed_import(code):
+    script = f"import time; t = time.perf_counter(); {code}; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode:
+        return None, result.stderr.strip().splitlines()[-1]
+    return float(result.stdout.strip().splitlines()[-1]), None
+
+
+def wait_for(url, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter()
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.02)
+    return None
+
+
+def serve(port, timeout):
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = start + timeout
+        health = wait_for(f"http://127.0.0.1:{port}/health", deadline)
+        ready = wait_for(f"http://127.0.0.1:{port}/ready", deadline) if health else None
+        return (health - start if health else None), (ready - start if ready else None)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def summary(samples):
+    values = [s for s in samples if s is not None]
+    if not values:
+        return "failed"
+    return f"{statistics.median(values):.2f}s" + ("" if len(values) == len(samples) else f" ({len(samples) - len(values)} failed)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=180)
+    args = parser.parse_args()
+
+    print(f"{'import (median of ' + str(args.runs) + ')':<48} {'time':>10}")
+    for name, code in EAGER.items():
+        samples, error = [], None
+        for _ in range(args.runs):
+            seconds, error = timed_import(code)
+            samples.append(seconds)
+        print(f"{name:<48} {summary(samples):>10}" + (f"  {error}" if error else ""))
+
+    health, ready = [], []
+    for _ in range(args.runs):
+        h, r = serve(args.port, args.timeout)
+        health.append(h)
+        ready.append(r)
+    print(f"{'first /health 200 after process start':<48} {summary(health):>10}")
+    print(f"{'first /ready 200 after process start':<48} {summary(ready):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Load test: /health and /messages latency while uploads are running.
+
+Point it at a running backend (uvicorn src.app:app) and a real document:
+
+    python benchmarks/load_event_loop.py --url http://localhost:8080 \
+        --file contract.pdf --conversation-id <uuid> --uploaders 4
+
+It first samples /health and /messages on an idle server, then again while
+--uploaders clients upload --file back to back, and prints p50/p99 for
+both phases. With blocking work kept off the event loop the two phases
+should look the same.
+"""
+import time
+import asyncio
+import argparse
+import statistics
+import httpx
+
+
+def summarize(name, latencies):
+    lat = sorted(x * 1000 for x in latencies)
+    p99 = lat[min(len(lat) - 1, int(len(lat) * 0.99))]
+    return f"{name:<10} n={len(lat):<5} p50={statistics.median(lat):8.1f}ms p99={p99:8.1f}ms max={lat[-1]:8.1f}ms"
+
+
+async def probe(client, path, duration, interval, latencies):
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        await client.get(path)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+
+
+async def uploader(client, file_path, conversation_id, stop, counts):
+    content = open(file_path, "rb").read()
+    name = file_path.rsplit("/", 1)[-1]
+    while not stop.is_set():
+        response = await client.post("/upload", files={"file": (name, content)}, data={"conversation_id": conversation_id})
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+
+
+async def phase(client, args, with_uploads):
+    health, messages, counts = [], [], {}
+    stop = asyncio.Event()
+    uploads = []
+    if with_uploads:
+        uploads = [asyncio.create_task(uploader(client, args.file, args.conversation_id, stop, counts)) for _ in range(args.uploaders)]
+        await asyncio.sleep(1)  # let the first uploads reach parsing
+    await asyncio.gather(
+        probe(client, "/health", args.duration, args.interval, health),
+        probe(client, f"/messages/{args.conversation_id}", args.duration, args.interval, messages),
+    )
+    stop.set()
+    await asyncio.gather(*uploads)
+    label = "uploading" if with_uploads else "idle"
+    print(f"--- {label} ---")
+    print(summarize("/health", health))
+    print(summarize("/messages", messages))
+    if with_uploads:
+        print(f"upload responses: {counts}")
+
+
+async def main(args):
+    async with httpx.AsyncClient(base_url=args.url, timeout=300) as client:
+        await phase(client, args, with_uploads=False)
+        await phase(client, args, with_uploads=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--file", required=True)
+    parser.add_argument("--conversation-id", required=True)
+    parser.add_argument("--uploaders", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--interval", type=float, default=0.05)
+    asyncio.run(main(parser.parse_args()))
@@ -76,6 +76,8 @@ gcloud run deploy $BACKEND_SERVICE \
     --set-env-vars GEMINI_API_KEY=$GEMINI_API_KEY,SUPABASE_URL=$SUPABASE_URL,SUPABASE_SERVICE_ROLE_KEY=$SUPABASE_SERVICE_ROLE_KEY,ALLOWED_ORIGINS=$ALLOWED_ORIGINS \
     --memory 2Gi \
     --cpu 2 \
+    --no-cpu-throttling \
+    --session-affinity \
     --max-instances 10
 
 # Step 7: Build and deploy frontend
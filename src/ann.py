@@ -0,0 +1,420 @@
+import os
+import json
+import time
+import hashlib
+import shutil
+import logging
+import tempfile
+import threading
+from collections import Counter
+import numpy as np
+from .retrieval import normalize_rows, parse_embedding, texts_fingerprint, RAG_TOP_K, RAG_SCORE_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+# Approximate retrieval settings (override via environment)
+ANN_INDEX_ENABLED = os.getenv("ANN_INDEX_ENABLED", "true").lower() == "true"
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", os.path.join(tempfile.gettempdir(), "policy-agent-ann"))
+# Saved indexes are dropped after this long unused, and least-recently-used first past ANN_INDEX_MAX_BYTES
+# (the default directory is RAM-backed on Cloud Run)
+ANN_INDEX_TTL_SECONDS = float(os.getenv("ANN_INDEX_TTL_SECONDS", 24 * 3600))
+ANN_INDEX_MAX_BYTES = int(os.getenv("ANN_INDEX_MAX_BYTES", 256 * 1024 * 1024))
+ANN_MIN_TRAIN = int(os.getenv("ANN_MIN_TRAIN", 4096))  # below this many chunks every query is an exact scan
+ANN_NLIST = int(os.getenv("ANN_NLIST", 0))  # inverted lists; 0 picks about sqrt(n), at most 1024
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", 16))  # lists scanned per query: higher is better recall, slower
+ANN_RETRAIN_GROWTH = float(os.getenv("ANN_RETRAIN_GROWTH", 4.0))  # retrain once the index grows this much
+ANN_KMEANS_ITERATIONS = 10
+ANN_TRAIN_SAMPLES_PER_LIST = 64
+_BLOCK_ROWS = 65536
+
+
+def _top_k(scores, k):
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def spherical_kmeans(sample, nlist, iterations=ANN_KMEANS_ITERATIONS, seed=0):
+    """Unit-length centroids for unit-length rows of sample (Lloyd iterations on cosine)."""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = assign_lists(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        # Re-seed empty lists from random rows so every list stays usable
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def assign_lists(vectors, centroids):
+    assign = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _BLOCK_ROWS):
+        block = vectors[start:start + _BLOCK_ROWS]
+        assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assign
+
+
+class IVFIndex:
+    """Inverted-file cosine index over one conversation's document chunks.
+
+    Below min_train vectors it is a flat exact scan. Past that, spherical
+    k-means splits the vectors into nlist lists and a query only scans the
+    nprobe lists whose centroids are closest, trading recall for latency.
+    Vectors are kept grouped by list in one contiguous matrix, so probing
+    a list is a slice, not a gather; vectors added since the last
+    compaction sit in a tail that is filtered by list. The index retrains
+    when it has grown retrain_growth times since the last training.
+    Deleted chunks are tombstoned and dropped at the next compaction.
+    """
+
+    def __init__(self, dim, nlist=ANN_NLIST, nprobe=ANN_NPROBE, min_train=ANN_MIN_TRAIN,
+                 retrain_growth=ANN_RETRAIN_GROWTH):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train = min_train
+        self.retrain_growth = retrain_growth
+        self.texts = []
+        self.documents = []  # document_id per row, for document-level deletes
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._assign = np.zeros(0, dtype=np.int32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._count = 0
+        self._dead = 0
+        self.centroids = None
+        self._bounds = None  # list boundaries within the compacted prefix
+        self._compacted = 0
+        self._trained_at = 0
+        self.version = 0  # bumped whenever the set of live chunks changes
+        self._fingerprint = (-1, None)
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_rows(cls, rows, **kwargs):
+        """Build from document_contexts rows ({"content", "embedding", "metadata"})."""
+        texts, vectors, documents = [], [], []
+        for row in rows or []:
+            vector = parse_embedding(row.get("embedding"))
+            if not vector or (vectors and len(vector) != len(vectors[0])):
+                continue
+            texts.append(row.get("content", ""))
+            vectors.append(vector)
+            documents.append((row.get("metadata") or {}).get("document_id"))
+        index = cls(len(vectors[0]) if vectors else 0, **kwargs)
+        if vectors:
+            index.add(texts, np.asarray(vectors, dtype=np.float32), documents)
+        return index
+
+    def __len__(self):
+        return self._count - self._dead
+
+    @property
+    def nbytes(self):
+        return self._vectors[:self._count].nbytes + sum(len(t) for t in self.texts)
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    @property
+    def fingerprint(self):
+        """texts_fingerprint of the live chunks, recomputed only after they change."""
+        with self._lock:
+            version, fingerprint = self._fingerprint
+            if version != self.version:
+                alive = self._alive[:self._count]
+                fingerprint = texts_fingerprint(t for t, live in zip(self.texts, alive) if live)
+                self._fingerprint = (self.version, fingerprint)
+            return fingerprint
+
+    def reserve(self, rows):
+        """Make room for rows vectors in total, so bulk adds do not re-grow the matrix."""
+        with self._lock:
+            if rows > len(self._vectors) or not self._vectors.flags.writeable:
+                vectors = np.empty((max(rows, self._count), self.dim), dtype=np.float32)
+                vectors[:self._count] = self._vectors[:self._count]
+                self._vectors = vectors
+                self._assign = np.resize(self._assign, len(vectors))
+                self._alive = np.resize(self._alive, len(vectors))
+
+    def add(self, texts, vectors, documents=None):
+        """Append chunks; documents (one id per chunk, or a single id for all) enables remove_document."""
+        vectors = normalize_rows(vectors)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Vector dimension {vectors.shape[1]} does not match index dimension {self.dim}")
+        if documents is None or isinstance(documents, str):
+            documents = [documents] * len(vectors)
+        with self._lock:
+            start, end = self._count, self._count + len(vectors)
+            if end > len(self._vectors) or not self._vectors.flags.writeable:
+                self.reserve(max(end, int(len(self._vectors) * 1.5), 1024))
+            self._vectors[start:end] = vectors
+            self._alive[start:end] = True
+            self.texts.extend(texts)
+            self.documents.extend(documents)
+            self._count = end
+            self.version += 1
+            if self.trained:
+                self._assign[start:end] = assign_lists(vectors, self.centroids)
+            if len(self) >= self.min_train and (not self.trained or len(self) >= self._trained_at * self.retrain_growth):
+                self.train()
+            elif self.trained and self._count - self._compacted > max(self.min_train, self._compacted // 10):
+                self._compact()
+
+    def document_counts(self):
+        """Live chunks per document_id."""
+        with self._lock:
+            return Counter(d for d, alive in zip(self.documents, self._alive[:self._count]) if alive)
+
+    def remove_document(self, document_id):
+        """Tombstone every chunk of one uploaded document; returns how many were removed."""
+        with self._lock:
+            rows = np.fromiter((i for i, d in enumerate(self.documents) if d == document_id and self._alive[i]), dtype=np.int64)
+            self._alive[rows] = False
+            self._dead += len(rows)
+            if len(rows):
+                self.version += 1
+            if self._dead > self._count // 5:
+                self._compact()
+            return len(rows)
+
+    def train(self):
+        """(Re)build the inverted lists from the live vectors."""
+        with self._lock:
+            self._compact(assign=False)
+            if not self._count:
+                return
+            nlist = self.nlist or int(np.sqrt(self._count))
+            nlist = max(1, min(nlist, 1024, self._count))
+            rng = np.random.default_rng(self._count)
+            sample_size = min(self._count, nlist * ANN_TRAIN_SAMPLES_PER_LIST)
+            sample = self._vectors[np.sort(rng.choice(self._count, sample_size, replace=False))]
+            self.centroids = spherical_kmeans(sample, nlist)
+            self._assign[:self._count] = assign_lists(self._vectors[:self._count], self.centroids)
+            self._trained_at = self._count
+            self._compact()
+            logger.info(f"Trained IVF index: {self._count} vectors in {nlist} lists")
+
+    def _compact(self, assign=True):
+        """Drop tombstones and regroup rows by list so each list is one contiguous slice."""
+        keep = np.nonzero(self._alive[:self._count])[0]
+        if assign and self.trained:
+            keep = keep[np.argsort(self._assign[keep], kind="stable")]
+        if len(keep) != self._count or assign:
+            vectors = np.empty((max(len(keep), 1024), self.dim), dtype=np.float32)
+            for start in range(0, len(keep), _BLOCK_ROWS):
+                rows = keep[start:start + _BLOCK_ROWS]
+                vectors[start:start + len(rows)] = self._vectors[rows]
+            self._vectors = vectors
+            self._assign = np.resize(self._assign[keep], len(vectors))
+            self._alive = np.ones(len(vectors), dtype=bool)
+            self.texts = [self.texts[i] for i in keep]
+            self.documents = [self.documents[i] for i in keep]
+            self._count = len(keep)
+            self._dead = 0
+        if assign and self.trained:
+            self._bounds = np.searchsorted(self._assign[:self._count], np.arange(len(self.centroids) + 1))
+            self._compacted = self._count
+        else:
+            self._compacted = 0
+
+    def search(self, query_embedding, k=RAG_TOP_K, threshold=RAG_SCORE_THRESHOLD, nprobe=None):
+        """Return up to k (score, text) pairs, best first, optionally dropping scores below threshold."""
+        if not len(self) or k <= 0:
+            return []
+        query = normalize_rows(query_embedding)[0]
+        if query.shape[0] != self.dim:
+            raise ValueError(f"Query dimension {query.shape[0]} does not match index dimension {self.dim}")
+        with self._lock:
+            if not self.trained:
+                candidates = [np.arange(self._count)]
+                scores = [self._vectors[:self._count] @ query]
+            else:
+                probes = _top_k(self.centroids @ query, min(nprobe or self.nprobe, len(self.centroids)))
+                candidates, scores = [], []
+                for lst in probes:
+                    start, stop = self._bounds[lst], self._bounds[lst + 1]
+                    if stop > start:
+                        candidates.append(np.arange(start, stop))
+                        scores.append(self._vectors[start:stop] @ query)
+                if self._count > self._compacted:
+                    tail = self._compacted + np.nonzero(np.isin(self._assign[self._compacted:self._count], probes))[0]
+                    candidates.append(tail)
+                    scores.append(self._vectors[tail] @ query)
+            if not candidates:
+                return []
+            candidates = np.concatenate(candidates)
+            scores = np.concatenate(scores)
+            if self._dead:
+                scores[~self._alive[candidates]] = -np.inf
+            top = _top_k(scores, k)
+            top = top[np.isfinite(scores[top])]
+            if threshold is not None:
+                top = top[scores[top] >= threshold]
+            return [(float(scores[i]), self.texts[candidates[i]]) for i in top]
+
+    def save(self, directory):
+        """Write the index to directory, replacing any previous copy atomically."""
+        parent, name = os.path.split(directory)
+        with self._lock:
+            tmp = tempfile.mkdtemp(prefix=f"{name}.tmp", dir=parent)
+            np.save(os.path.join(tmp, "vectors.npy"), self._vectors[:self._count])
+            np.save(os.path.join(tmp, "assign.npy"), self._assign[:self._count])
+            np.save(os.path.join(tmp, "alive.npy"), self._alive[:self._count])
+            if self.trained:
+                np.save(os.path.join(tmp, "centroids.npy"), self.centroids)
+            with open(os.path.join(tmp, "texts.jsonl"), "w", encoding="utf-8") as f:
+                for text, document in zip(self.texts, self.documents):
+                    f.write(json.dumps([text, document]) + "\n")
+            with open(os.path.join(tmp, "meta.json"), "w") as f:
+                json.dump({"dim": self.dim, "nlist": self.nlist, "nprobe": self.nprobe, "min_train": self.min_train,
+                           "retrain_growth": self.retrain_growth, "compacted": self._compacted,
+                           "trained_at": self._trained_at}, f)
+            old = tempfile.mkdtemp(prefix=f"{name}.old", dir=parent)
+            if os.path.exists(directory):
+                os.replace(directory, os.path.join(old, name))
+            os.rename(tmp, directory)
+            shutil.rmtree(old, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory, nprobe=None):
+        """Open a saved index; vectors are memory-mapped until the next add."""
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        index = cls(meta["dim"], nlist=meta["nlist"], nprobe=nprobe or meta["nprobe"], min_train=meta["min_train"],
+                    retrain_growth=meta["retrain_growth"])
+        index._vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        index._assign = np.load(os.path.join(directory, "assign.npy"))
+        index._alive = np.load(os.path.join(directory, "alive.npy"))
+        index._count = len(index._vectors)
+        index._dead = int(index._count - index._alive.sum())
+        with open(os.path.join(directory, "texts.jsonl"), encoding="utf-8") as f:
+            for line in f:
+                text, document = json.loads(line)
+                index.texts.append(text)
+                index.documents.append(document)
+        centroids = os.path.join(directory, "centroids.npy")
+        if os.path.exists(centroids):
+            index.centroids = np.load(centroids)
+            index._compacted = meta["compacted"]
+            index._trained_at = meta["trained_at"]
+            index._bounds = np.searchsorted(index._assign[:index._compacted], np.arange(len(index.centroids) + 1))
+        return index
+
+
+class ConversationIndexStore:
+    """On-disk IVFIndex per conversation under one directory.
+
+    Local to this instance, like the other in-process caches: a conversation
+    without a saved index is rebuilt from document_contexts on first use,
+    and callers check a loaded index's documents against document_contexts
+    before trusting it, since another instance may have changed the rows. Indexes
+    unused for ttl_seconds are dropped, and the least recently used ones go
+    once the directory holds more than max_bytes.
+    """
+
+    def __init__(self, directory=ANN_INDEX_DIR, max_bytes=ANN_INDEX_MAX_BYTES, ttl_seconds=ANN_INDEX_TTL_SECONDS,
+                 clock=time.time):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, conversation_id):
+        # Conversation ids are UUIDs; anything else is hashed so it cannot escape the directory
+        name = str(conversation_id)
+        if not name.replace("-", "").isalnum():
+            name = hashlib.sha256(name.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def load(self, conversation_id):
+        path = self._path(conversation_id)
+        meta = os.path.join(path, "meta.json")
+        try:
+            last_used = os.path.getmtime(meta)
+        except OSError:
+            return None
+        if self._clock() - last_used > self.ttl_seconds:
+            self.drop(conversation_id)
+            self.expirations += 1
+            return None
+        try:
+            index = IVFIndex.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Dropping unreadable ANN index for conversation {conversation_id}: {e}")
+            self.drop(conversation_id)
+            return None
+        self._touch(path)
+        return index
+
+    def save(self, conversation_id, index):
+        path = self._path(conversation_id)
+        index.save(path)
+        self._touch(path)
+        self._enforce_limits()
+
+    def drop(self, conversation_id):
+        shutil.rmtree(self._path(conversation_id), ignore_errors=True)
+
+    def _touch(self, path):
+        # meta.json's mtime is the last use, for expiry and eviction
+        now = self._clock()
+        try:
+            os.utime(os.path.join(path, "meta.json"), (now, now))
+        except OSError:
+            pass
+
+    def _entries(self):
+        """(last used, bytes, path) per saved index; IVFIndex.save's temp directories have a dot in the name."""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if "." in name:
+                continue
+            try:
+                last_used = os.path.getmtime(os.path.join(path, "meta.json"))
+                size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+            except OSError:
+                continue
+            entries.append((last_used, size, path))
+        return entries
+
+    def _enforce_limits(self):
+        with self._lock:
+            now = self._clock()
+            total = 0
+            kept = []
+            for last_used, size, path in sorted(self._entries()):
+                if now - last_used > self.ttl_seconds:
+                    shutil.rmtree(path, ignore_errors=True)
+                    self.expirations += 1
+                else:
+                    kept.append((size, path))
+                    total += size
+            for size, path in kept:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                self.evictions += 1
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
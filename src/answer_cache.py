@@ -0,0 +1,149 @@
+import os
+import time
+import itertools
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+from .retrieval import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+# Semantic answer cache settings (override via environment)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Cosine similarity between question embeddings above which a stored answer is reused
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 2000))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", 24 * 3600))
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "vector", "answer", "question", "stored_at")
+
+    def __init__(self, fingerprint, vector, answer, question, stored_at):
+        self.fingerprint = fingerprint
+        self.vector = vector
+        self.answer = answer
+        self.question = question
+        self.stored_at = stored_at
+
+
+class AnswerCache:
+    """In-process LRU of generated answers keyed by fingerprint and question embedding.
+
+    fingerprint identifies everything besides the question an answer was
+    grounded in: the app combines the model, the user, the documents
+    (retrieval.texts_fingerprint of the conversation's chunks) and the
+    earlier turns sent with the prompt, so a user's first question over the
+    same uploads hits from any of their conversations, while a follow-up
+    only matches the same conversation state and a changed document set
+    never does. Within a fingerprint, get() returns the stored answer whose
+    question embedding is most similar to the new one, if that cosine
+    similarity reaches threshold. Entries expire ttl_seconds after they were
+    stored; the least recently used go first beyond max_entries.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                 ttl_seconds=ANSWER_CACHE_TTL_SECONDS, clock=time.monotonic):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries = OrderedDict()  # entry id -> _Entry, least recently used first
+        self._buckets = {}  # fingerprint -> [entry id, ...]
+        self._matrices = {}  # fingerprint -> stacked vectors of its bucket, rebuilt after changes
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.replacements = 0
+        self.expirations = 0
+        self.evictions = 0
+        self._hit_score_total = 0.0
+
+    def get(self, fingerprint, vector):
+        """(answer, similarity) of the closest stored question at or above threshold, else None."""
+        query = normalize_rows(vector)[0]
+        with self._lock:
+            best = self._closest(fingerprint, query)
+            if best is None or best[1] < self.threshold:
+                self.misses += 1
+                return None
+            entry_id, score = best
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            self._hit_score_total += score
+            return self._entries[entry_id].answer, score
+
+    def put(self, fingerprint, vector, answer, question=None):
+        """Store an answer; one for a question within threshold of an existing entry replaces it."""
+        query = normalize_rows(vector)[0]
+        with self._lock:
+            best = self._closest(fingerprint, query)
+            if best is not None and best[1] >= self.threshold:
+                entry = self._entries[best[0]]
+                entry.answer, entry.question, entry.stored_at = answer, question, self._clock()
+                self._entries.move_to_end(best[0])
+                self.replacements += 1
+                return
+            entry_id = next(self._ids)
+            self._entries[entry_id] = _Entry(fingerprint, query, answer, question, self._clock())
+            self._buckets.setdefault(fingerprint, []).append(entry_id)
+            self._matrices.pop(fingerprint, None)
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._matrices.clear()
+
+    def _closest(self, fingerprint, query):
+        ids = self._buckets.get(fingerprint)
+        if not ids:
+            return None
+        now = self._clock()
+        for entry_id in [i for i in ids if now - self._entries[i].stored_at > self.ttl_seconds]:
+            self._remove(entry_id)
+            self.expirations += 1
+        ids = self._buckets.get(fingerprint)
+        if not ids:
+            return None
+        matrix = self._matrices.get(fingerprint)
+        if matrix is None:
+            matrix = self._matrices[fingerprint] = np.stack([self._entries[i].vector for i in ids])
+        if matrix.shape[1] != query.shape[0]:
+            return None
+        scores = matrix @ query
+        best = int(np.argmax(scores))
+        return ids[best], float(scores[best])
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        ids = self._buckets[entry.fingerprint]
+        ids.remove(entry_id)
+        if not ids:
+            del self._buckets[entry.fingerprint]
+        self._matrices.pop(entry.fingerprint, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "document_sets": len(self._buckets),
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "avg_hit_similarity": self._hit_score_total / self.hits if self.hits else 0.0,
+                "stores": self.stores,
+                "replacements": self.replacements,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+            }
@@ -1,40 +1,93 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse, Response
+from starlette.concurrency import iterate_in_threadpool
+import anyio
 from pydantic import BaseModel, UUID4, validator
 from dotenv import load_dotenv
 from typing import List, Optional
-import shutil
 import os
 import uuid
-import google.generativeai as genai
-from supabase import create_client
-from .parsers import parse_file
+import hmac
+import hashlib
+import asyncio
+from collections import Counter
+from .parsers import iter_pages, ParseError, DocumentTooLarge, ParseTimeout
+from .ingest import ingest_document, ingest_cached, IngestResult, IngestMemoryExceeded, CollectingStore
+from .selection import MAX_CHUNKS, SIM_THRESHOLD
+from .chunking import TokenChunker
+from .retrieval import EmbeddingIndex, texts_fingerprint, RAG_TOP_K, RAG_SCORE_THRESHOLD
+from .embedding_cache import ConversationEmbeddingCache
+from .ann import IVFIndex, ConversationIndexStore, ANN_INDEX_ENABLED
+from .embedding_service import EmbeddingService
+from .llm import get_backend, LLM_BACKEND
+from .concurrency import run_io, embed_pool, parse_pool, pool_stats, shutdown_pools
+from .staging import StagedUpload
+from .db import Database, BatchWriter, BatchInsertError, bulk_stats
+from .doc_cache import DocumentCache, DOC_CACHE_ENABLED
+from .counters import UserCounters, CounterLimitExceeded
+from .profile_cache import UserProfileCache, PROFILE_COLUMNS
+from .pagination import page_size, select_fields, keyset_page, split_page, etag_response
+from .responses import FastJSONResponse, CompressionMiddleware, dumps
+from .prompt import PromptBudget, RAG_SEPARATOR
+from .startup import MODEL_WARMUP_ENABLED
+from .embedding_backends import get_embedding_backend
+from .metrics import (REGISTRY, CONTENT_TYPE, REQUEST_SECONDS, REQUESTS_IN_PROGRESS, STAGE_SECONDS, TOKENS, CHUNKS,
+                      EMBEDDED_TEXTS)
+from .profiling import SamplingProfiler, should_profile
+from .answer_cache import AnswerCache, ANSWER_CACHE_ENABLED
+from .jobs import JobQueue, JobError, QueueFull, SUCCEEDED, FAILED, INGEST_RETRY_AFTER_SECONDS, INGEST_RESULT_TEXT_MAX_CHARS
+from contextlib import asynccontextmanager
 import logging
-import json
+import logging.handlers
+import queue
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 import time
 from datetime import datetime
 import re
-from sentence_transformers import SentenceTransformer
-import numpy as np
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
-)
+
+# Configure logging. Records go through a queue to a listener thread that owns the file and
+# stream handlers, so a slow disk or terminal never blocks the event loop
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_handlers = [logging.FileHandler('app.log'), logging.StreamHandler()]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+log_listener.start()
+# The listener's handlers do the formatting; the queue carries just the message (and any traceback)
+queue_handler = logging.handlers.QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One shared Supabase client (keep-alive connection pool) for the whole process
+    app.state.db = Database(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    ingest_jobs.start()
+    # Load the embedding model on the embed pool while the server already answers /health;
+    # /ready turns 200 once it is in, and requests that need it earlier wait for it there
+    if MODEL_WARMUP_ENABLED:
+        embed_pool.submit(warm_embedding_model)
+    try:
+        yield
+    finally:
+        # Cancels queued and running uploads (rolling back what they stored) before the client closes
+        await ingest_jobs.stop()
+        app.state.db.close()
+        shutdown_pools(wait=False)
+        # Flushes queued log records
+        log_listener.stop()
+
+def get_db() -> Database:
+    return app.state.db
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 limiter = Limiter(key_func=get_remote_address)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
@@ -46,12 +99,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
+# gzip/brotli for complete responses above COMPRESSION_MIN_BYTES (SSE streams are left alone)
+app.add_middleware(CompressionMiddleware)
+
 # Request validation middleware
 @app.middleware("http")
 async def validate_request(request: Request, call_next):
     start_time = time.time()
+    status = 500
+    profiler = SamplingProfiler().start() if should_profile(request) else None
+    REQUESTS_IN_PROGRESS.inc()
     try:
         # Log request
         logger.info(f"Request: {request.method} {request.url}")
@@ -64,24 +124,41 @@ async def validate_request(request: Request, call_next):
                 raise HTTPException(status_code=400, detail="Invalid content type")
         
         response = await call_next(request)
+        status = response.status_code
         
         # Log response time
         process_time = time.time() - start_time
         logger.info(f"Response time: {process_time:.2f}s")
         
+        if profiler:
+            try:
+                # Just the file name: PROFILE_DIR, and where it lives on the server, stays server-side
+                path = await run_io(profiler.stop().write, f"{request.method} {request.url.path}")
+                response.headers["X-Profile"] = os.path.basename(path)
+            except OSError as e:
+                logger.warning(f"Failed to write profile: {e}")
         return response
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=500,
             content={"error": str(e)}
         )
+    finally:
+        REQUESTS_IN_PROGRESS.dec()
+        # The route template, not the raw path, so IDs do not explode the label set
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(time.time() - start_time, method=request.method,
+                                route=getattr(route, "path", "unmatched"), status=status)
+        if profiler:
+            profiler.stop()
 
 class MessageIn(BaseModel):
     user_id: str
     conversation_id: UUID4
     messages: List[dict] # This list now contains user and AI messages
     email: Optional[str] = None  # Accept email from frontend if provided
+    use_answer_cache: bool = True  # False always generates a fresh answer (and does not cache it)
 
     @validator('messages')
     def validate_messages(cls, v):
@@ -93,6 +170,8 @@ class MessageIn(BaseModel):
                 raise ValueError('Each message must have sender and content')
             if msg['sender'] not in ['user', 'ai', 'system']:
                 raise ValueError('Message sender must be user, ai, or system')
+            if not isinstance(msg['content'], str):
+                raise ValueError('Message content must be a string')
         return v
 
 class NewConversation(BaseModel):
@@ -102,22 +181,15 @@ class NewConversation(BaseModel):
 class RenameConversation(BaseModel):
     title: str
 
-# Custom JSON encoder to handle UUID serialization
-class UUIDEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, uuid.UUID):
-            return str(obj)
-        return super().default(obj)
-
 GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
-if not all([GOOGLE_API_KEY, SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY]):
+# The fake backend runs offline, so it does not need a Gemini key
+if not all([GOOGLE_API_KEY or LLM_BACKEND == "fake", SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY]):
     raise EnvironmentError("One or more required environment variables are missing.")
 
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel("gemini-1.5-flash")
+llm = get_backend()
 
 SYSTEM_PROMPT = """
 You're a helpful assistant specialized in understanding and explaining documents such as policies, terms, agreements, contracts, and more. Your goal is to provide accurate, clear, and polite responses based on the content provided or general legal understanding.
@@ -128,6 +200,13 @@ You're a helpful assistant specialized in understanding and explaining documents
 Please maintain a humble and friendly tone. If a question is out of scope or unclear, kindly ask for clarification or explain politely why it's difficult to answer.
 """
 
+# Columns the list endpoints return by default and accept in fields=
+CONVERSATION_FIELDS = ("id", "title", "created_at", "updated_at", "summary", "metadata")
+MESSAGE_FIELDS = ("id", "conversation_id", "sender", "content", "created_at", "content_type", "context", "metadata")
+
+# Fits history, RAG context and the question into PROMPT_TOKEN_BUDGET for every Gemini call
+prompt_budget = PromptBudget(SYSTEM_PROMPT)
+
 FREE_USER_CONVERSATION_LIMIT = 1 # Define the limit here as well
 FREE_USER_AI_MESSAGE_LIMIT = 10 # Define the limit here as well
 
@@ -138,54 +217,284 @@ def validate_uuid(uuid_str: str) -> bool:
     except ValueError:
         return False
 
-def serialize_response(data):
-    """Helper function to serialize response data with UUID handling"""
-    return json.loads(json.dumps(data, cls=UUIDEncoder))
-
-# Utility functions to keep user counters up to date
-
-def update_user_conversation_count(supabase, user_id):
-    # Use direct SQL for accurate count
-    sql = f"SELECT COUNT(*) AS count FROM conversations WHERE user_id = '{user_id}'"
-    result = supabase.rpc('execute_sql', {'sql': sql}).execute()
-    count = 0
-    if result.data and isinstance(result.data, list) and len(result.data) > 0:
-        count = result.data[0].get('count', 0)
-    logger.info(f"Updating conversation_count for user_id={user_id}: {count}")
-    supabase.table("users").update({"conversation_count": count}).eq("id", user_id).execute()
-
-def update_user_message_count(supabase, user_id):
-    # Use direct SQL for accurate count
-    sql = f"SELECT COUNT(*) AS count FROM messages WHERE conversation_id IN (SELECT id FROM conversations WHERE user_id = '{user_id}')"
-    result = supabase.rpc('execute_sql', {'sql': sql}).execute()
-    count = 0
-    if result.data and isinstance(result.data, list) and len(result.data) > 0:
-        count = result.data[0].get('count', 0)
-    logger.info(f"Updating message_count for user_id={user_id}: {count}")
-    supabase.table("users").update({"message_count": count}).eq("id", user_id).execute()
-
-# Load embedding model (use a small, fast one for demo; replace with production model as needed)
-EMBEDDING_MODEL = SentenceTransformer('all-MiniLM-L6-v2')
-
-# Helper: chunk text into ~500 token chunks (approx 2000 chars)
-def chunk_text(text, max_length=2000):
-    paragraphs = text.split('\n')
-    chunks = []
-    current = ''
-    for para in paragraphs:
-        if len(current) + len(para) < max_length:
-            current += para + '\n'
-        else:
-            if current:
-                chunks.append(current.strip())
-            current = para + '\n'
-    if current:
-        chunks.append(current.strip())
-    return chunks
-
-# Helper: embed a list of texts
+def limit_exceeded(e: CounterLimitExceeded) -> HTTPException:
+    if e.counter == "conversations":
+        return HTTPException(status_code=403, detail=f"As a free user, you are limited to {FREE_USER_CONVERSATION_LIMIT} conversation. Please upgrade to premium.")
+    return HTTPException(status_code=403, detail=f"As a free user, you are limited to {FREE_USER_AI_MESSAGE_LIMIT} messages. Please upgrade to premium.")
+
+# Short-TTL cache of users rows, so /ask does not read the profile on every question
+profile_cache = UserProfileCache()
+
+# Per-user conversation/message counters, kept current with atomic +1/-1 deltas on every write
+user_counters = UserCounters(FREE_USER_CONVERSATION_LIMIT, FREE_USER_AI_MESSAGE_LIMIT, profile_cache=profile_cache)
+
+async def user_profile(db, user_id):
+    """membership_status and counters for a user, from profile_cache when fresh"""
+    profile = profile_cache.get(user_id)
+    if profile is None:
+        response = await db.execute(db.table("users").select(PROFILE_COLUMNS).eq("id", user_id).single())
+        profile = response.data
+        profile_cache.put(user_id, profile)
+    return profile
+
+# Per-conversation cache of parsed, normalized document embeddings used by /ask
+embedding_cache = ConversationEmbeddingCache()
+
+# Per-conversation IVF indexes persisted to local disk, so large corpora are neither
+# refetched from document_contexts nor scanned exhaustively on every question
+ann_store = ConversationIndexStore() if ANN_INDEX_ENABLED else None
+
+# Embedding model (use a small, fast one for demo; replace with production model as needed).
+# Loaded on first use or by the startup warm-up, not at import (see startup.LazyModel).
+# EMBEDDING_BACKEND picks full precision or int8, EMBEDDING_DTYPE the output dtype
+embedding_backend = get_embedding_backend()
+EMBEDDING_MODEL = embedding_backend.model
+
+# Upload chunks are sized in the embedding model's own tokens, so none are truncated at embed time.
+# Built from the model's tokenizer, so only once the model has loaded
+_text_chunker = None
+
+def upload_chunker():
+    global _text_chunker
+    if _text_chunker is None:
+        _text_chunker = TokenChunker.for_model(EMBEDDING_MODEL.load())
+    return _text_chunker
+
+def warm_embedding_model():
+    try:
+        EMBEDDING_MODEL.warm()
+        upload_chunker()
+        logger.info(f"Embedding model warm-up finished: {embedding_backend.stats()}")
+    except Exception as e:
+        logger.error(f"Embedding model warm-up failed: {e}", exc_info=True)
+
+# Parsed chunks + embeddings of previously seen files, keyed by content hash; the variant
+# changes whenever the model or chunking does, so stale vectors are never served
+doc_cache = DocumentCache() if DOC_CACHE_ENABLED else None
+
+# Micro-batched, memoized query encoder used on the /ask hot path
+embedding_service = EmbeddingService(embedding_backend.encode, executor=embed_pool.executor)
+
+# Answers to questions already asked over the same documents, matched on EMBEDDING_MODEL query vectors
+answer_cache = AnswerCache() if ANSWER_CACHE_ENABLED else None
+
+# Uploads are ingested by background workers: /upload answers 202 with a job id to poll
+ingest_jobs = JobQueue()
+
+# Helper: embed a list of texts as an (n, dim) array of EMBEDDING_DTYPE (no Python list round trip)
 def embed_texts(texts):
-    return EMBEDDING_MODEL.encode(texts).tolist()
+    return embedding_backend.encode(texts)
+
+async def index_is_current(db, conversation_id, index):
+    # Chunks per document in document_contexts, fetching only each row's document id
+    res = await db.execute(db.table("document_contexts").select("document_id:metadata->>document_id")
+                           .eq("conversation_id", conversation_id))
+    return Counter(row.get("document_id") for row in res.data or []) == index.document_counts()
+
+async def conversation_index(db, conversation_id):
+    """Retrieval index for a conversation: in-process cache, then local disk, then rebuilt from document_contexts.
+
+    A cached index is used without touching the database; ingest and deletes
+    invalidate it on this instance, and other instances' writes show once
+    the entry expires (EMBEDDING_CACHE_TTL_SECONDS). An index from disk may
+    predate writes made anywhere, so it is only used if its chunks per
+    document match document_contexts: a new upload always has a new
+    document id, so this also catches a document replaced by one with as
+    many chunks.
+    """
+    index = embedding_cache.get(conversation_id)
+    if index is not None:
+        return index
+    # Taken before reading any rows: if a write invalidates the conversation meanwhile, the result is not cached
+    version = embedding_cache.version()
+    index = await run_io(ann_store.load, conversation_id) if ann_store else None
+    if index is not None and not await index_is_current(db, conversation_id, index):
+        index = None
+    if index is None:
+        doc_chunks = await db.execute(db.table("document_contexts").select("content, embedding, metadata").eq("conversation_id", conversation_id))
+        if ann_store:
+            index = await run_io(IVFIndex.from_rows, doc_chunks.data)
+            if len(index):
+                await run_io(ann_store.save, conversation_id, index)
+            else:
+                await run_io(ann_store.drop, conversation_id)
+        else:
+            index = EmbeddingIndex.from_rows(doc_chunks.data)
+    embedding_cache.put(conversation_id, index, version)
+    return index
+
+def add_to_conversation_index(conversation_id, index, document_id, texts, vectors):
+    # Idempotent per document, in case an /ask during the upload already indexed some of its rows
+    index.remove_document(document_id)
+    index.add(texts, vectors, document_id)
+    ann_store.save(conversation_id, index)
+
+class PreparedAsk:
+    def __init__(self, history, prompt, rag_context, reserved, fingerprint=None, question_embedding=None, cached=None):
+        self.history = history
+        self.prompt = prompt
+        self.rag_context = rag_context
+        self.reserved = reserved  # the AI message was already counted against the user
+        self.fingerprint = fingerprint  # answer_cache key for the documents the answer is grounded in
+        self.question_embedding = question_embedding
+        self.cached = cached  # (answer, similarity) from answer_cache, when one matched
+
+async def prepare_ask(request: Request, query: MessageIn, db):
+    """Quota checks, RAG retrieval, answer cache lookup and prompt assembly shared by /ask and /ask/stream."""
+    # 1. User profile (membership status and counters), usually from profile_cache
+    try:
+        profile = await user_profile(db, query.user_id)
+        user_membership_status = profile['membership_status']
+        conversation_count = profile.get('conversation_count') or 0
+    except Exception as e:
+        logger.error(f"User profile not found or error fetching for user {query.user_id}: {e}")
+        raise HTTPException(status_code=404, detail="User profile not found or database error.")
+
+    is_premium_user = user_membership_status == 'premium'
+
+    # 2. Enforce conversation/message limits for free users using counters
+    reserved = False
+    if not is_premium_user:
+        if conversation_count >= FREE_USER_CONVERSATION_LIMIT:
+            raise HTTPException(
+                status_code=403,
+                detail=f"As a free user, you are limited to {FREE_USER_CONVERSATION_LIMIT} conversation. Please upgrade to premium."
+            )
+        # Count the AI answer up front: the limit check and the +1 are one atomic update, so concurrent
+        # questions cannot both slip under the limit. Callers release it if no answer gets saved
+        try:
+            await user_counters.adjust(db, query.user_id, messages=1, enforce=True)
+        except CounterLimitExceeded as e:
+            raise limit_exceeded(e)
+        reserved = True
+
+    try:
+        return await assemble_prompt(request, query, db, reserved)
+    except BaseException:
+        # No answer will be saved; release even when the request is being cancelled
+        if reserved:
+            with anyio.CancelScope(shield=True):
+                await release_ai_message(db, query.user_id)
+        raise
+
+async def assemble_prompt(request: Request, query: MessageIn, db, reserved):
+    """RAG retrieval, answer cache lookup and the prompt, once the quota has been reserved."""
+    # RAG: Retrieve relevant document_contexts
+    rag_chunks = []
+    question = query.messages[-1]['content']
+    question_embedding = None
+    documents = None  # fingerprint of the document set, when there is one
+    # Accept rag_context from frontend if provided
+    try:
+        body = await request.json()
+        if 'rag_context' in body and body['rag_context']:
+            rag_context = body['rag_context']
+            rag_chunks = rag_context if isinstance(rag_context, list) else str(rag_context).split(RAG_SEPARATOR)
+            documents = texts_fingerprint(str(c).strip() for c in rag_chunks)
+    except Exception:
+        pass
+    # If not provided, fallback to DB retrieval
+    if not rag_chunks:
+        try:
+            with STAGE_SECONDS.time(stage="index_load"):
+                index = await conversation_index(db, str(query.conversation_id))
+            if len(index):
+                documents = index.fingerprint
+                # Embed the user question and take the top-k chunks by cosine similarity
+                question_embedding = await embedding_service.embed(question)
+                with STAGE_SECONDS.time(stage="retrieval"):
+                    scored = index.search(question_embedding, k=RAG_TOP_K, threshold=RAG_SCORE_THRESHOLD)
+                logger.debug(f"RAG: top scores {[round(s, 3) for s, _ in scored]} out of {len(index)} chunks")
+                rag_chunks = [c for _, c in scored]
+        except Exception as e:
+            logger.warning(f"RAG context retrieval failed: {e}")
+
+    # Recent turns, deduplicated RAG context and the question, within PROMPT_TOKEN_BUDGET
+    plan = prompt_budget.build(query.messages, [str(c) for c in rag_chunks])
+
+    # Same question (by embedding) from the same user, over the same documents, model and earlier turns:
+    # reuse the stored answer
+    fingerprint = None
+    if answer_cache and documents:
+        fingerprint = f"{llm.name}|{query.user_id}|{documents}|{history_fingerprint(plan)}"
+    cached = None
+    if fingerprint and query.use_answer_cache:
+        try:
+            if question_embedding is None:
+                question_embedding = await embedding_service.embed(question)
+            cached = answer_cache.get(fingerprint, question_embedding)
+        except Exception as e:
+            logger.warning(f"Answer cache lookup failed: {e}")
+        if cached:
+            logger.info(f"Answer cache hit for conversation {query.conversation_id} (similarity {cached[1]:.3f})")
+
+    tokens = plan.stats
+    for part in ("system", "question", "history", "summary", "rag"):
+        TOKENS.inc(tokens[part], kind=f"prompt_{part}")
+    CHUNKS.inc(tokens["rag_chunks"], kind="retrieved")
+    CHUNKS.inc(tokens["rag_duplicates"], kind="rag_duplicate")
+    logger.info(f"Prompt for conversation {query.conversation_id}: ~{tokens['total']}/{tokens['budget']} tokens "
+                f"(system {tokens['system']}, question {tokens['question']}, history {tokens['history']} in "
+                f"{tokens['turns_kept']} turns, {tokens['turns_dropped']} dropped, summary {tokens['summary']}, "
+                f"rag {tokens['rag']} in {tokens['rag_chunks']} chunks, {tokens['rag_duplicates']} duplicates)")
+    return PreparedAsk(plan.history, plan.prompt, plan.rag_context, reserved,
+                       fingerprint if query.use_answer_cache else None, question_embedding, cached)
+
+def history_fingerprint(plan):
+    # The turns sent with the question and the summary of older ones, so follow-ups only match the same conversation state
+    return hashlib.blake2b(dumps([plan.history, plan.summary]), digest_size=8).hexdigest()
+
+def cache_answer(prepared, question, ai_answer):
+    # Only fresh answers are stored; a cache hit is already there
+    if prepared.fingerprint and prepared.question_embedding is not None and not prepared.cached and ai_answer:
+        try:
+            answer_cache.put(prepared.fingerprint, prepared.question_embedding, ai_answer, question)
+        except Exception as e:
+            logger.warning(f"Failed to cache answer: {e}")
+
+async def save_ai_answer(db, conversation_id, ai_answer, cached=None):
+    with STAGE_SECONDS.time(stage="db_write"):
+        await _save_ai_answer(db, conversation_id, ai_answer, cached)
+
+async def _save_ai_answer(db, conversation_id, ai_answer, cached):
+    # 4. Insert only the AI message into the DB
+    ai_message_data = {
+        "conversation_id": str(conversation_id),
+        "sender": "ai",
+        "content": ai_answer,
+        "content_type": "text",
+        "context": {},
+        "metadata": {"model_used": llm.name, "timestamp": datetime.now().isoformat(), "cache_hit": cached is not None}
+    }
+    if cached:
+        ai_message_data["metadata"]["cache_similarity"] = round(cached[1], 4)
+    insert_ai_response = await db.execute(db.table("messages").insert([ai_message_data]))
+    if insert_ai_response.data is None:
+        logger.error("Error inserting AI message: No data returned from Supabase.")
+        raise HTTPException(status_code=500, detail="Failed to save AI message.")
+
+    # 5. Update conversation's updated_at and summary
+    update_conversation_response = await db.execute(db.table("conversations").update({
+        "updated_at": datetime.now().isoformat(),
+        "summary": ai_answer[:100] + "..." if len(ai_answer) > 100 else ai_answer
+    }).eq("id", str(conversation_id)))
+
+    if update_conversation_response.data is None:
+        logger.warning(f"Failed to update conversation summary/timestamp: No data returned from Supabase.")
+
+async def release_ai_message(db, user_id):
+    # Undo prepare_ask's +1 when no AI message ends up saved
+    try:
+        await user_counters.adjust(db, user_id, messages=-1)
+    except Exception as e:
+        logger.warning(f"Failed to release message counter for user {user_id}: {e}")
+
+async def count_ai_message(db, user_id):
+    # Premium users have no limit to reserve against, so their AI message is counted once saved
+    try:
+        await user_counters.adjust(db, user_id, messages=1)
+    except Exception as e:
+        logger.warning(f"Failed to count AI message for user {user_id}: {e}")
 
 @app.post("/ask")
 @limiter.limit("10/minute")
@@ -194,186 +503,160 @@ async def ask_question(request: Request, query: MessageIn):
         if not validate_uuid(query.conversation_id):
             raise HTTPException(status_code=400, detail="Invalid conversation ID format")
         logger.info(f"Processing question for user {query.user_id} in conversation {query.conversation_id}")
-        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+        db = get_db()
 
-        # 1. Fetch user profile to check membership status and counters
+        prepared = await prepare_ask(request, query, db)
         try:
-            user_profile_response = supabase.table("users").select("membership_status, conversation_count, message_count").eq("id", query.user_id).single().execute()
-            logger.info(f"user_profile_response: {user_profile_response}")
-            user_membership_status = user_profile_response.data['membership_status']
-            conversation_count = user_profile_response.data.get('conversation_count', 0)
-            message_count = user_profile_response.data.get('message_count', 0)
-        except Exception as e:
-            logger.error(f"User profile not found or error fetching for user {query.user_id}: {e}")
-            raise HTTPException(status_code=404, detail="User profile not found or database error.")
-        
-        is_premium_user = user_membership_status == 'premium'
-
-        # 2. Count existing AI messages for the conversation (for reference, but not used for free user limit anymore)
-        ai_messages_count_response = supabase.table("messages").select("id").eq("conversation_id", str(query.conversation_id)).eq("sender", "ai").execute()
-        if ai_messages_count_response.data is None:
-            logger.error("Error counting AI messages: No data returned from Supabase.")
-            raise HTTPException(status_code=500, detail="Failed to count AI messages.")
-        current_ai_messages_count = len(ai_messages_count_response.data)
-
-        # 3. Enforce conversation/message limits for free users using counters
-        if not is_premium_user:
-            if conversation_count >= FREE_USER_CONVERSATION_LIMIT:
-                raise HTTPException(
-                    status_code=403,
-                    detail=f"As a free user, you are limited to {FREE_USER_CONVERSATION_LIMIT} conversation. Please upgrade to premium."
-                )
-            if message_count >= FREE_USER_AI_MESSAGE_LIMIT:
-                raise HTTPException(
-                    status_code=403,
-                    detail=f"As a free user, you are limited to {FREE_USER_AI_MESSAGE_LIMIT} messages. Please upgrade to premium."
-                )
-
-        # RAG: Retrieve relevant document_contexts
-        rag_context = ""
-        # Accept rag_context from frontend if provided
-        try:
-            body = await request.json()
-            if 'rag_context' in body and body['rag_context']:
-                rag_context = body['rag_context']
-        except Exception:
-            pass
-        # If not provided, fallback to DB retrieval
-        if not rag_context:
-            try:
-                doc_chunks = supabase.table("document_contexts").select("content, embedding").eq("conversation_id", str(query.conversation_id)).execute()
-                def safe_parse_embedding(embedding):
-                    if isinstance(embedding, list):
-                        return embedding
-                    if isinstance(embedding, str):
-                        try:
-                            return json.loads(embedding)
-                        except json.JSONDecodeError:
-                            logger.warning(f"Failed to parse embedding string: {embedding}")
-                            return []
-                    return []
-                if doc_chunks.data:
-                    # Embed the user question
-                    question_embedding = embed_texts([query.messages[-1]['content']])[0]
-                    # Compute cosine similarity
-                    def cosine(a, b):
-                        a = np.array(a)
-                        b = np.array(b)
-                        norm_a = np.linalg.norm(a)
-                        norm_b = np.linalg.norm(b)
-                        if norm_a == 0 or norm_b == 0:
-                            return 0.0
-                        return float(np.dot(a, b) / (norm_a * norm_b))
-                    scored = [
-                        (cosine(safe_parse_embedding(chunk["embedding"]), question_embedding), chunk["content"])
-                        for chunk in doc_chunks.data if chunk.get("embedding")
-                    ]
-                    logger.info(f"RAG: scored chunks: {[s[0] for s in scored]}")
-                    scored.sort(reverse=True)
-                    top_chunks = [c for _, c in scored[:3]]
-                    if top_chunks:
-                        rag_context = "\n---\n".join(top_chunks)
-            except Exception as e:
-                logger.warning(f"RAG context retrieval failed: {e}")
-
-        # Prepare chat history for the AI model
-        user_message_content = query.messages[-1]['content']
-        history_for_gemini = []
-        for msg in query.messages[:-1]:
-            if msg['sender'] == 'user':
-                history_for_gemini.append({"role": "user", "parts": [msg["content"]]})
-            elif msg['sender'] == 'ai':
-                history_for_gemini.append({"role": "model", "parts": [msg["content"]]})
-
-        # Inject RAG context if available
-        prompt = SYSTEM_PROMPT
-        if rag_context:
-            prompt += f"\nRelevant Document Context:\n{rag_context}\n"
-        prompt += "\nUser Query: " + user_message_content
-        chat = model.start_chat(history=history_for_gemini)
-        response = chat.send_message(prompt)
-        ai_answer = response.text.strip()
-
-        logger.info(f"Successfully generated AI response for user {query.user_id}")
-
-        # 4. Insert only the AI message into the DB
-        ai_message_data = {
-            "conversation_id": str(query.conversation_id),
-            "sender": "ai",
-            "content": ai_answer,
-            "content_type": "text",
-            "context": {},
-            "metadata": {"model_used": "gemini-1.5-flash", "timestamp": datetime.now().isoformat()}
-        }
-        insert_ai_response = supabase.table("messages").insert([ai_message_data]).execute()
-        if insert_ai_response.data is None:
-            logger.error("Error inserting AI message: No data returned from Supabase.")
-            raise HTTPException(status_code=500, detail="Failed to save AI message.")
-
-        # 5. Update conversation's updated_at and summary
-        update_conversation_response = supabase.table("conversations").update({
-            "updated_at": datetime.now().isoformat(),
-            "summary": ai_answer[:100] + "..." if len(ai_answer) > 100 else ai_answer
-        }).eq("id", str(query.conversation_id)).execute()
-
-        if update_conversation_response.data is None:
-            logger.warning(f"Failed to update conversation summary/timestamp: No data returned from Supabase.")
-
-        return serialize_response({"answer": ai_answer, "context": rag_context})
+            if prepared.cached:
+                ai_answer = prepared.cached[0]
+            else:
+                with STAGE_SECONDS.time(stage="generation"):
+                    ai_answer = (await run_io(llm.generate, prepared.history, prepared.prompt)).strip()
+                logger.info(f"Successfully generated AI response for user {query.user_id}")
+
+            await save_ai_answer(db, query.conversation_id, ai_answer, prepared.cached)
+        except BaseException:
+            if prepared.reserved:
+                with anyio.CancelScope(shield=True):
+                    await release_ai_message(db, query.user_id)
+            raise
+        if not prepared.reserved:
+            await count_ai_message(db, query.user_id)
+        cache_answer(prepared, query.messages[-1]['content'], ai_answer)
+
+        return FastJSONResponse(content={"answer": ai_answer, "context": prepared.rag_context,
+                                         "cache_hit": prepared.cached is not None})
 
     except HTTPException as he:
         logger.warning(f"HTTPException in ask_question: {he.detail} (Status: {he.status_code})")
-        return JSONResponse(status_code=he.status_code, content={"error": he.detail})
+        return FastJSONResponse(status_code=he.status_code, content={"error": he.detail})
     except Exception as e:
         logger.error(f"Unhandled error in ask_question: {str(e)}", exc_info=True)
-        return JSONResponse(status_code=500, content={"error": "An unexpected error occurred."})
+        return FastJSONResponse(status_code=500, content={"error": "An unexpected error occurred."})
 
-@app.get("/conversations/{user_id}")
-async def get_conversations(user_id: str):
+def sse_event(event, data):
+    return f"event: {event}\ndata: {dumps(data).decode()}\n\n"
+
+@app.post("/ask/stream")
+@limiter.limit("10/minute")
+async def ask_question_stream(request: Request, query: MessageIn):
+    """Same as /ask, but forwards answer tokens as Server-Sent Events.
+
+    Emits "token" events with {"text": ...} as the model produces them, then a
+    single "done" event with the full answer and context once the message has
+    been saved, or an "error" event if generation or saving fails. An answer
+    from answer_cache arrives as one "token" event.
+    """
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-        # Select all relevant fields from the new conversations schema
-        response = supabase.table("conversations").select("id, title, created_at, updated_at, summary, metadata").eq("user_id", user_id).order("created_at").execute()
-        
-        if response.error:
-            logger.error(f"Error fetching conversations from DB: {response.error.message}")
-            raise HTTPException(status_code=500, detail=f"Database error: {response.error.message}")
+        if not validate_uuid(query.conversation_id):
+            raise HTTPException(status_code=400, detail="Invalid conversation ID format")
+        logger.info(f"Streaming answer for user {query.user_id} in conversation {query.conversation_id}")
+        db = get_db()
+        prepared = await prepare_ask(request, query, db)
+    except HTTPException as he:
+        logger.warning(f"HTTPException in ask_question_stream: {he.detail} (Status: {he.status_code})")
+        return FastJSONResponse(status_code=he.status_code, content={"error": he.detail})
+    except Exception as e:
+        logger.error(f"Unhandled error in ask_question_stream: {str(e)}", exc_info=True)
+        return FastJSONResponse(status_code=500, content={"error": "An unexpected error occurred."})
 
-        conversations_data = response.data
+    async def event_stream():
+        parts = []
+        saved = False
+        try:
+            if prepared.cached:
+                parts.append(prepared.cached[0])
+                yield sse_event("token", {"text": prepared.cached[0]})
+            else:
+                # The model client is synchronous, so pull tokens from a worker thread
+                start = time.perf_counter()
+                async for token in iterate_in_threadpool(llm.stream(prepared.history, prepared.prompt)):
+                    if not parts:
+                        STAGE_SECONDS.observe(time.perf_counter() - start, stage="first_token")
+                    parts.append(token)
+                    yield sse_event("token", {"text": token})
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage="generation")
+            ai_answer = "".join(parts).strip()
+            # DB writes happen once the full answer is known
+            await save_ai_answer(db, query.conversation_id, ai_answer, prepared.cached)
+            saved = True
+            if not prepared.reserved:
+                await count_ai_message(db, query.user_id)
+            cache_answer(prepared, query.messages[-1]['content'], ai_answer)
+            logger.info(f"Successfully streamed AI response for user {query.user_id}")
+            yield sse_event("done", {"answer": ai_answer, "context": prepared.rag_context,
+                                     "cache_hit": prepared.cached is not None})
+        except HTTPException as he:
+            yield sse_event("error", {"error": he.detail})
+        except Exception as e:
+            logger.error(f"Error while streaming answer: {str(e)}", exc_info=True)
+            yield sse_event("error", {"error": "An unexpected error occurred."})
+        finally:
+            # Also runs when the client disconnects mid-stream, so shield the release from that cancellation
+            if prepared.reserved and not saved:
+                with anyio.CancelScope(shield=True):
+                    await release_ai_message(db, query.user_id)
 
-        return serialize_response(conversations_data)
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/conversations/{user_id}")
+async def get_conversations(user_id: str, request: Request, limit: Optional[int] = None,
+                            cursor: Optional[str] = None, fields: Optional[str] = None):
+    """A page of the user's conversations, oldest first.
+
+    The body is the list of conversations; when more exist, X-Next-Cursor
+    holds the cursor= value for the next page. Unchanged pages revalidate
+    to 304 via ETag / If-None-Match.
+    """
+    try:
+        db = get_db()
+        limit = page_size(limit)
+        # Select all relevant fields from the new conversations schema, or just the requested ones
+        query = db.table("conversations").select(select_fields(fields, CONVERSATION_FIELDS)).eq("user_id", user_id)
+        response = await db.execute(keyset_page(query, cursor, limit))
+        conversations_data, next_cursor = split_page(response.data, limit)
+
+        return etag_response(request, conversations_data,
+                             headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
+    except HTTPException as he:
+        raise he
     except Exception as e:
         logger.error(f"Error fetching conversations: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="An unexpected error occurred while fetching conversations.")
 
 @app.get("/messages/{conversation_id}")
-async def get_messages(conversation_id: str):
+async def get_messages(conversation_id: str, request: Request, limit: Optional[int] = None,
+                       cursor: Optional[str] = None, fields: Optional[str] = None):
+    """The newest page of a conversation's messages, in chronological order.
+
+    Pass the returned next_cursor as cursor= to page further back; fields=
+    picks columns (e.g. fields=sender,content to skip context/metadata).
+    Unchanged pages revalidate to 304 via ETag / If-None-Match.
+    """
     try:
         if not re.match(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', conversation_id):
             raise HTTPException(status_code=400, detail="Invalid conversation ID format")
 
-        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-        
-        # Select all relevant fields from the new messages schema
-        response = supabase.table('messages') \
-            .select('id, conversation_id, sender, content, created_at, content_type, context, metadata') \
-            .eq('conversation_id', conversation_id) \
-            .order('created_at', desc=True) \
-            .execute()
-
-        if response.error:
-            logger.error(f"Error fetching messages from DB: {response.error.message}")
-            raise HTTPException(status_code=500, detail=f"Database error: {response.error.message}")
+        db = get_db()
+        limit = page_size(limit)
 
-        messages_data = response.data
+        # Newest first, so the first page is the latest messages and cursors walk back in time
+        query = db.table('messages').select(select_fields(fields, MESSAGE_FIELDS)).eq('conversation_id', conversation_id)
+        response = await db.execute(keyset_page(query, cursor, limit, descending=True))
+        messages_data, next_cursor = split_page(response.data, limit)
 
         # Reverse the order to get chronological order
         messages = messages_data[::-1]
-        
-        return {
+
+        return etag_response(request, {
             "messages": messages,
-            "total": len(messages)
-        }
+            "total": len(messages),
+            "next_cursor": next_cursor,
+        }, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
 
     except HTTPException as he:
         raise he
@@ -381,103 +664,235 @@ async def get_messages(conversation_id: str):
         logger.error(f"Error fetching messages: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="An unexpected error occurred while fetching messages.")
 
-@app.post("/upload")
-async def upload_file(file: UploadFile = File(...), conversation_id: str = Form(...)):
+@app.post("/upload", status_code=202)
+async def upload_file(file: UploadFile = File(...), conversation_id: str = Form(...),
+                      max_chunks: Optional[int] = Form(None), sim_threshold: Optional[float] = Form(None),
+                      echo_text: Optional[int] = Form(None)):
+    # Small uploads stay in memory; larger ones get a unique temp file, removed once the job is finished
+    staged = StagedUpload(file.filename)
+    queued = False
     try:
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        temp_path = f"temp_uploaded{file_ext}"
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        try:
-            text = parse_file(temp_path, file_ext)
-        except Exception as e:
-            os.remove(temp_path)
-            logger.error(f"Error parsing file: {str(e)}")
-            raise HTTPException(status_code=400, detail=f"Failed to parse file: {str(e)}")
-        os.remove(temp_path)
-        if not text or not isinstance(text, str) or not text.strip():
-            logger.error("Parsed document is empty or invalid.")
-            raise HTTPException(status_code=400, detail="Parsed document is empty or invalid.")
-        # Chunk and embed
-        chunks = chunk_text(text)
-        if not chunks or all(len(c.strip()) <= 0 for c in chunks):
-            logger.error("No valid chunks produced from document.")
-            raise HTTPException(status_code=400, detail="No valid chunks produced from document.")
-        embeddings = embed_texts(chunks)
-        # --- SMART CHUNK SELECTION ---
-        # Score by length (info density) and remove near-duplicates
-        scored = sorted([(len(c), i, c, e) for i, (c, e) in enumerate(zip(chunks, embeddings)) if len(c.strip()) > 50], reverse=True)
-        selected = []
-        selected_embeds = []
-        max_chunks = 10
-        sim_threshold = 0.85
-        for _, _, chunk, embed in scored:
-            if len(selected) >= max_chunks:
-                break
-            # Remove near-duplicates (cosine similarity)
-            is_duplicate = False
-            for e2 in selected_embeds:
-                sim = float(np.dot(embed, e2) / (np.linalg.norm(embed) * np.linalg.norm(e2)))
-                if sim > sim_threshold:
-                    is_duplicate = True
-                    break
-            if not is_duplicate:
-                selected.append((chunk, embed))
-                selected_embeds.append(embed)
-        # Store in document_contexts if conversation_id is provided
-        inserted = []
-        errors = []
-        if conversation_id:
-            supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-            for chunk, embedding in selected:
-                embedding_for_db = embedding  # Must be a list of floats for pgvector
-                data = {
-                    "conversation_id": conversation_id,
-                    "content": chunk,
-                    "source": file.filename,
-                    "source_id": str(uuid.uuid4()),
-                    "metadata": {"filename": file.filename},
-                    "embedding": embedding_for_db
-                }
-                res = supabase.table("document_contexts").insert(data).execute()
-                if getattr(res, 'status_code', None) in (200, 201) and res.data:
-                    inserted.append(res.data)
-                else:
-                    errors.append(str(res.data))
-        if not inserted:
-            logger.error("Upload failed: No document chunks stored.")
-            return JSONResponse(status_code=400, content={"error": "Upload failed: No document chunks stored.", "details": errors})
-        return JSONResponse(content={"text": text, "filename": file.filename, "chunks": len(selected), "conversation_id": conversation_id, "stored": len(inserted)})
+        # Per-request selection overrides; max_chunks=0 keeps every distinct chunk
+        if max_chunks is None:
+            max_chunks = MAX_CHUNKS
+        if sim_threshold is None:
+            sim_threshold = SIM_THRESHOLD
+        if max_chunks < 0 or not 0 < sim_threshold <= 1:
+            raise HTTPException(status_code=400, detail="max_chunks must be >= 0 and sim_threshold in (0, 1].")
+        # How much extracted text to send back: 0 omits it, N truncates to N characters
+        if echo_text is not None and echo_text < 0:
+            raise HTTPException(status_code=400, detail="echo_text must be >= 0.")
+        if not validate_uuid(conversation_id):
+            raise HTTPException(status_code=400, detail="Invalid conversation_id format.")
+        await staged.receive(file)
+        db = get_db()
+        # Queue limits and fairness are per user, so look up who owns the conversation
+        conv = await db.execute(db.table("conversations").select("user_id").eq("id", conversation_id).limit(1))
+        if not conv.data:
+            raise HTTPException(status_code=404, detail="Conversation not found.")
+        job = ingest_jobs.submit(
+            conv.data[0]["user_id"],
+            lambda job: ingest_upload(job, staged, conversation_id, max_chunks, sim_threshold, echo_text),
+            cleanup=staged.close, filename=file.filename, conversation_id=conversation_id)
+        queued = True
+        status_url = f"/upload/{job.id}"
+        return FastJSONResponse(status_code=202, headers={"Location": status_url}, content={
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": status_url,
+            "queue_position": ingest_jobs.position(job),
+        })
+    except QueueFull as e:
+        raise HTTPException(status_code=429 if e.per_owner else 503, detail=str(e),
+                            headers={"Retry-After": str(INGEST_RETRY_AFTER_SECONDS)})
     except HTTPException as he:
         raise he
     except Exception as e:
         logger.error(f"Error uploading file: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if not queued:
+            staged.close()
+
+async def ingest_upload(job, staged, conversation_id, max_chunks, sim_threshold, echo_text):
+    """Runs on an ingest_jobs worker: parse → chunk → embed → dedupe → store one staged upload.
+
+    Returns the summary GET /upload/{job_id} reports as result; failures
+    raise JobError with the status code the upload would have answered.
+    """
+    db = get_db()
+    document_id = str(uuid.uuid4())
+    # Selected (chunk, embedding) pairs become document_contexts rows, written in multi-row batches
+    writer = BatchWriter(db, "document_contexts", make_row=lambda pair: {
+        "conversation_id": conversation_id,
+        "content": str(pair[0]),
+        "source": staged.filename,
+        "source_id": str(uuid.uuid4()),
+        # Character offsets into the parsed document text, so answers can cite the source position
+        "metadata": {"filename": staged.filename, "document_id": document_id,
+                     "char_start": getattr(pair[0], "start", None), "char_end": getattr(pair[0], "end", None)},
+        "embedding": pair[1].tolist()  # NumPy row until here; pgvector takes a JSON list of floats
+    })
+    # Filled in while the pipeline runs, so the job status shows live progress
+    result = IngestResult()
+    job.report = lambda: {"pages": result.pages, "chunks": result.chunks, "selected": result.selected,
+                          "stored": result.stored}
+
+    # An existing on-disk index is extended with this document's chunks once they are all stored
+    ann_index = None
+    if ann_store:
+        ann_index = embedding_cache.get(conversation_id)
+        if not isinstance(ann_index, IVFIndex) or not ann_index.dim:
+            ann_index = await run_io(ann_store.load, conversation_id)
+    store = CollectingStore(writer) if ann_index is not None else writer
+    indexed = False
+
+    # Lazy: nothing is parsed until the pipeline pulls pages, so a cache hit never opens the file
+    try:
+        pages = iter_pages(staged.source, staged.ext, executor=parse_pool if parse_pool.size > 1 else None)
+    except ValueError as e:
+        raise JobError(400, str(e))
+
+    # On the embed pool, as it may have to wait for the model to finish loading
+    text_chunker = await embed_pool.run(upload_chunker)
+    doc_cache_variant = f"{embedding_backend.variant}|{text_chunker.variant}"
+
+    # Repeat uploads of the same bytes skip parse/chunk/embed and go straight to selection and storage.
+    # The cache is best effort: a lookup or writer that fails just means ingesting from the file
+    cached = recorder = None
+    if doc_cache:
+        try:
+            cached = await run_io(doc_cache.get, staged.sha256, doc_cache_variant)
+            if not cached:
+                recorder = await run_io(doc_cache.writer, staged.sha256, doc_cache_variant)
+        except Exception as e:
+            logger.warning(f"Document cache unavailable for {staged.filename}: {e}")
+    try:
+        if cached:
+            logger.info(f"Document cache hit for {staged.filename} ({staged.sha256[:12]})")
+            await ingest_cached(cached, store=store, max_chunks=max_chunks, sim_threshold=sim_threshold, result=result)
+        else:
+            # Parse → chunk → embed → select → store as a stream, so large documents never sit in memory whole
+            await ingest_document(pages, embed=lambda texts: embed_pool.run(embed_texts, texts), store=store,
+                                  max_chunks=max_chunks, sim_threshold=sim_threshold, record=recorder,
+                                  chunker=text_chunker.iter_chunks, result=result)
+            if recorder:
+                build_seconds = sum(result.timings[stage] for stage in ("parse", "chunk", "embed"))
+                await run_io(recorder.commit, result.text, result.text_truncated, result.pages, build_seconds)
+                recorder = None
+        if ann_index is not None and result.stored:
+            await run_io(add_to_conversation_index, conversation_id, ann_index, document_id, store.texts, store.vectors)
+            # Invalidate first, so an /ask that read the rows mid-upload cannot cache its older build over this one
+            embedding_cache.invalidate(conversation_id)
+            embedding_cache.put(conversation_id, ann_index)
+            indexed = True
+    except BaseException as e:
+        # All or nothing: whatever stopped the upload (a parse failure or timeout, an unexpected error, or
+        # DELETE /upload/{job_id}), remove the rows already stored, shielded so a second cancel cannot cut it short
+        if writer.rows:
+            logger.info(f"Upload job {job.id} stopped ({type(e).__name__}), rolling back {writer.rows} stored rows")
+        await asyncio.shield(writer.rollback())
+        if isinstance(e, (DocumentTooLarge, IngestMemoryExceeded)):
+            raise JobError(413, str(e))
+        if isinstance(e, ParseTimeout):
+            logger.error(f"Parsing timed out: {str(e)}")
+            raise JobError(408, str(e))
+        if isinstance(e, ParseError):
+            logger.error(f"Error parsing file: {str(e)}")
+            raise JobError(400, f"Failed to parse file: {str(e)}")
+        if isinstance(e, BatchInsertError):
+            logger.error(f"Upload failed: {str(e)}")
+            raise JobError(400, "Upload failed: No document chunks stored.", e.errors)
+        raise
+    finally:
+        if recorder:
+            recorder.abort()
+        if not indexed:
+            # Anything built while this upload was in flight may hold rolled-back or partial rows
+            embedding_cache.invalidate(conversation_id)
+            if ann_store:
+                await run_io(ann_store.drop, conversation_id)
+
+    # Per-upload stage timings; a document cache hit skips parse, chunk and embed
+    for stage, seconds in result.timings.items():
+        if not (cached and stage in ("parse", "chunk", "embed")):
+            STAGE_SECONDS.observe(seconds, stage="embed_document" if stage == "embed" else stage)
+    if not cached:
+        EMBEDDED_TEXTS.inc(result.chunks, source="upload")
+    CHUNKS.inc(result.chunks, kind="parsed")
+    CHUNKS.inc(result.selected, kind="selected")
+    CHUNKS.inc(result.stored, kind="stored")
+    if not result.chunks:
+        logger.error("Parsed document is empty or invalid.")
+        raise JobError(400, "Parsed document is empty or invalid.")
+    if not result.stored:
+        logger.error("Upload failed: No document chunks stored.")
+        raise JobError(400, "Upload failed: No document chunks stored.", writer.errors)
+    text, text_truncated = result_text(result, echo_text)
+    return {
+        "text": text,
+        "text_truncated": text_truncated,
+        "filename": staged.filename,
+        "chunks": result.selected,
+        "conversation_id": conversation_id,
+        "stored": result.stored,
+        "pages": result.pages,
+        "timings": {stage: round(seconds, 3) for stage, seconds in result.timings.items()},
+        "insert": writer.stats(),
+        "cache_hit": cached is not None,
+    }
+
+def result_text(result, echo_text):
+    # The job result is held until the job is pruned, so the echoed text is capped tighter than the pipeline's copy
+    text, text_truncated = result.text, result.text_truncated
+    echo_text = INGEST_RESULT_TEXT_MAX_CHARS if echo_text is None else min(echo_text, INGEST_RESULT_TEXT_MAX_CHARS)
+    if len(text) > echo_text:
+        text, text_truncated = (text[:echo_text] if echo_text else None), True
+    return text, text_truncated
+
+@app.get("/upload/{job_id}")
+async def upload_status(job_id: str):
+    """Status of a background upload: progress while queued or running, result or error once finished"""
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Upload job not found.")
+    return job.to_dict(ingest_jobs.position(job))
+
+@app.delete("/upload/{job_id}")
+async def cancel_upload(job_id: str):
+    """Cancel a queued or running upload; rows it already stored are removed"""
+    job = ingest_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Upload job not found.")
+    if job.status in (SUCCEEDED, FAILED):
+        raise HTTPException(status_code=409, detail=f"Upload job already {job.status}.")
+    return FastJSONResponse(status_code=202, content=job.to_dict())
 
 @app.post("/conversations")
 async def create_conversation(conv: NewConversation):
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-        # Fetch user profile for counters
-        user_profile_response = supabase.table("users").select("membership_status, conversation_count").eq("id", conv.user_id).single().execute()
-        user_membership_status = user_profile_response.data['membership_status']
-        conversation_count = user_profile_response.data.get('conversation_count', 0)
-        is_premium_user = user_membership_status == 'premium'
-        # Enforce conversation limit for free users
-        if not is_premium_user and conversation_count >= FREE_USER_CONVERSATION_LIMIT:
-            raise HTTPException(status_code=403, detail=f"As a free user, you are limited to {FREE_USER_CONVERSATION_LIMIT} conversation. Please upgrade to premium.")
+        db = get_db()
+        # Reserve the conversation first: the free-user limit check and the +1 are one atomic update
+        try:
+            counts = await user_counters.adjust(db, conv.user_id, conversations=1, enforce=True)
+        except CounterLimitExceeded as e:
+            raise limit_exceeded(e)
+        if counts is None:
+            raise HTTPException(status_code=404, detail="User profile not found.")
         # Create conversation
-        response = supabase.table("conversations").insert({
-            "user_id": conv.user_id,
-            "title": conv.title,
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat()
-        }).select("id").single().execute()
-        conversation_data = response['data']
-        # Always update counts after creation
-        update_user_conversation_count(supabase, conv.user_id)
-        update_user_message_count(supabase, conv.user_id)
-        return serialize_response({"id": conversation_data['id']})
+        try:
+            response = await db.execute(db.table("conversations").insert({
+                "user_id": conv.user_id,
+                "title": conv.title,
+                "created_at": datetime.now().isoformat(),
+                "updated_at": datetime.now().isoformat()
+            }))
+            if not response.data:
+                raise RuntimeError("No data returned from Supabase.")
+        except Exception:
+            await user_counters.adjust(db, conv.user_id, conversations=-1)
+            raise
+        return FastJSONResponse(content={"id": response.data[0]['id']})
     except HTTPException as he:
         raise he
     except Exception as e:
@@ -487,14 +902,14 @@ async def create_conversation(conv: NewConversation):
 @app.put("/conversations/{conversation_id}")
 async def rename_conversation(conversation_id: str, body: RenameConversation):
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+        db = get_db()
         # Frontend now handles rename directly to DB, but this can be a fallback or for server-side rename
-        supabase.table("conversations").update({
+        await db.execute(db.table("conversations").update({
             "title": body.title,
             "updated_at": datetime.now().isoformat()
-        }).eq("id", conversation_id).execute()
+        }).eq("id", conversation_id))
         
-        return JSONResponse(status_code=200, content={"message": "Conversation renamed successfully"})
+        return FastJSONResponse(status_code=200, content={"message": "Conversation renamed successfully"})
     except Exception as e:
         logger.error(f"Error renaming conversation: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -502,19 +917,22 @@ async def rename_conversation(conversation_id: str, body: RenameConversation):
 @app.delete("/conversations/{conversation_id}")
 async def delete_conversation(conversation_id: str, request: Request):
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+        db = get_db()
         # Get user_id before deleting
-        conv = supabase.table("conversations").select("user_id").eq("id", conversation_id).single().execute()
+        conv = await db.execute(db.table("conversations").select("user_id").eq("id", conversation_id).single())
         user_id = conv.data["user_id"] if conv.data else None
         # Delete all messages for this conversation first
-        supabase.table("messages").delete().eq("conversation_id", conversation_id).execute()
+        deleted_messages = await db.execute(db.table("messages").delete().eq("conversation_id", conversation_id))
         # Now delete the conversation
-        supabase.table("conversations").delete().eq("id", conversation_id).execute()
-        # Always update counts after deletion
+        deleted_conversation = await db.execute(db.table("conversations").delete().eq("id", conversation_id))
+        embedding_cache.invalidate(conversation_id)
+        if ann_store:
+            await run_io(ann_store.drop, conversation_id)
+        # Subtract exactly the rows this request removed
         if user_id:
-            update_user_conversation_count(supabase, user_id)
-            update_user_message_count(supabase, user_id)
-        return JSONResponse(status_code=200, content={"message": "Conversation and its messages deleted successfully"})
+            await user_counters.adjust(db, user_id, conversations=-len(deleted_conversation.data or []),
+                                       messages=-len(deleted_messages.data or []))
+        return FastJSONResponse(status_code=200, content={"message": "Conversation and its messages deleted successfully"})
     except Exception as e:
         logger.error(f"Error deleting conversation: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -522,18 +940,17 @@ async def delete_conversation(conversation_id: str, request: Request):
 @app.post("/messages")
 async def create_message(message: dict):
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+        db = get_db()
         # Insert user message
-        insert_result = supabase.table("messages").insert([message]).execute()
+        insert_result = await db.execute(db.table("messages").insert([message]))
         if insert_result.data is None:
             raise HTTPException(status_code=500, detail="Failed to save user message.")
         # Update counts for the user
-        conv = supabase.table("conversations").select("user_id").eq("id", message["conversation_id"]).single().execute()
+        conv = await db.execute(db.table("conversations").select("user_id").eq("id", message["conversation_id"]).single())
         user_id = conv.data["user_id"] if conv.data else None
         if user_id:
-            update_user_message_count(supabase, user_id)
-            update_user_conversation_count(supabase, user_id)
-        return JSONResponse(status_code=200, content={"message": "User message created successfully"})
+            await user_counters.adjust(db, user_id, messages=len(insert_result.data))
+        return FastJSONResponse(status_code=200, content={"message": "User message created successfully"})
     except Exception as e:
         logger.error(f"Error creating user message: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -541,34 +958,82 @@ async def create_message(message: dict):
 @app.delete("/messages/{message_id}")
 async def delete_message(message_id: str):
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+        db = get_db()
         # Get conversation_id and user_id before deleting
-        msg = supabase.table("messages").select("conversation_id").eq("id", message_id).single().execute()
+        msg = await db.execute(db.table("messages").select("conversation_id").eq("id", message_id).single())
         conversation_id = msg.data["conversation_id"] if msg.data else None
         user_id = None
         if conversation_id:
-            conv = supabase.table("conversations").select("user_id").eq("id", conversation_id).single().execute()
+            conv = await db.execute(db.table("conversations").select("user_id").eq("id", conversation_id).single())
             user_id = conv.data["user_id"] if conv.data else None
-        supabase.table("messages").delete().eq("id", message_id).execute()
+        deleted = await db.execute(db.table("messages").delete().eq("id", message_id))
         if user_id:
-            update_user_message_count(supabase, user_id)
-            update_user_conversation_count(supabase, user_id)
-        return JSONResponse(status_code=200, content={"message": "Message deleted successfully"})
+            await user_counters.adjust(db, user_id, messages=-len(deleted.data or []))
+        return FastJSONResponse(status_code=200, content={"message": "Message deleted successfully"})
     except Exception as e:
         logger.error(f"Error deleting message: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/users/{user_id}/recount")
 async def recount_user_counts(user_id: str):
+    """Rebuild a user's counters with COUNT(*); run periodically to reconcile any drift in the deltas"""
+    # The recount queries are raw SQL, so only ever interpolate a well-formed UUID
+    if not validate_uuid(user_id):
+        raise HTTPException(status_code=400, detail="Invalid user ID format")
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-        update_user_conversation_count(supabase, user_id)
-        update_user_message_count(supabase, user_id)
-        return JSONResponse(status_code=200, content={"message": "User counts updated"})
+        db = get_db()
+        counts = await user_counters.recount(db, str(uuid.UUID(user_id)))
+        return FastJSONResponse(status_code=200, content={"message": "User counts updated", **counts})
     except Exception as e:
         logger.error(f"Error recounting user counts: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+def require_service_caller(request: Request):
+    # Internal endpoints take the service role key as a bearer token, which is what Supabase database webhooks send
+    token = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    if not SUPABASE_SERVICE_ROLE_KEY or not hmac.compare_digest(token.encode(), SUPABASE_SERVICE_ROLE_KEY.encode()):
+        raise HTTPException(status_code=401, detail="Service credentials required.")
+
+@app.post("/users/{user_id}/invalidate")
+@limiter.limit("10/minute")
+async def invalidate_user_profile(user_id: str, request: Request):
+    """Drop the cached profile; called by the users table webhook whenever membership_status changes"""
+    require_service_caller(request)
+    profile_cache.invalidate(user_id)
+    return FastJSONResponse(status_code=200, content={"message": "User profile cache invalidated"})
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss/eviction counters for sizing the in-process caches"""
+    return {
+        "embedding_cache": embedding_cache.stats(),
+        "embedding_service": embedding_service.stats(),
+        "document_cache": doc_cache.stats() if doc_cache else None,
+        "user_profiles": profile_cache.stats(),
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "ann_index": ann_store.stats() if ann_store else None,
+    }
+
+@app.get("/pools/stats")
+async def worker_pool_stats():
+    """Size, in-flight work and queue depth of the blocking-work pools"""
+    return {**pool_stats(), "supabase": get_db().stats(), "bulk_insert": bulk_stats(), "ingest_jobs": ingest_jobs.stats()}
+
+# Pool and queue depths, read from the pools' own stats at scrape time
+REGISTRY.gauge("pool_in_flight", "Tasks running or queued on a worker pool", ("pool",)).set_function(
+    lambda: {(name,): stats["in_flight"] for name, stats in pool_stats().items()})
+REGISTRY.gauge("pool_queue_depth", "Tasks waiting for a free worker", ("pool",)).set_function(
+    lambda: {(name,): stats["queue_depth"] for name, stats in pool_stats().items()})
+REGISTRY.gauge("embedding_queue_depth", "Questions waiting for the embedding micro-batcher").set_function(
+    lambda: {(): embedding_service.stats()["queue_depth"]})
+REGISTRY.gauge("ingest_jobs", "Upload ingestion jobs waiting or running", ("state",)).set_function(
+    lambda: {("queued",): ingest_jobs.stats()["queued"], ("running",): ingest_jobs.stats()["running"]})
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text format: stage latency histograms, token/chunk counters, pool and queue depths"""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint for deployment monitoring"""
@@ -578,6 +1043,15 @@ async def health_check():
         "service": "crispterms-backend"
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until the embedding model has loaded, unlike /health which answers at once"""
+    model = embedding_backend.stats()
+    if EMBEDDING_MODEL.ready or not MODEL_WARMUP_ENABLED:
+        return {"status": "ready", "embedding_model": model}
+    status = "failed" if model["error"] else "starting"
+    return FastJSONResponse(status_code=503, content={"status": status, "embedding_model": model})
+
 if __name__ == "__main__":
     import uvicorn
     import os
@@ -0,0 +1,163 @@
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Chunk sizing (override via environment). all-MiniLM-L6-v2 embeds at most 256 tokens
+# including [CLS] and [SEP]; anything past that is silently truncated
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 254))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 32))
+
+# Sentence ends: terminal punctuation followed by whitespace, or a line break
+_SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?])\s+|\s*\n\s*")
+# Fallback tokenizer: words and single punctuation marks, close to WordPiece counts for English prose
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+class Chunk(str):
+    """Chunk text that also knows where it came from.
+
+    start/end are character offsets into the document text (the parsed
+    pieces joined with newlines), so a retrieved chunk can cite its
+    position; tokens is the chunk's size under the chunker's tokenizer.
+    Being a str, it goes anywhere a plain chunk string did.
+    """
+
+    def __new__(cls, text, start, end, tokens):
+        chunk = super().__new__(cls, text)
+        chunk.start = start
+        chunk.end = end
+        chunk.tokens = tokens
+        return chunk
+
+    def __reduce__(self):
+        return Chunk, (str(self), self.start, self.end, self.tokens)
+
+
+def regex_token_spans(texts):
+    return [[m.span() for m in _TOKEN_RE.finditer(text)] for text in texts]
+
+
+def tokenizer_token_spans(tokenizer):
+    """Token offsets from a Hugging Face fast tokenizer (SentenceTransformer.tokenizer)."""
+    def token_spans(texts):
+        encoded = tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True)
+        return encoded["offset_mapping"]
+    return token_spans
+
+
+def _sentence_spans(text):
+    start = 0
+    breaks = [(m.start(), m.end()) for m in _SENTENCE_BREAK_RE.finditer(text)]
+    for end, next_start in breaks + [(len(text), len(text))]:
+        segment = text[start:end]
+        stripped = segment.strip()
+        if stripped:
+            lead = len(segment) - len(segment.lstrip())
+            yield start + lead, start + lead + len(stripped)
+        start = next_start
+
+
+class TokenChunker:
+    """Packs whole sentences into chunks of at most max_tokens tokens.
+
+    Consecutive chunks share up to overlap_tokens tokens of trailing
+    sentences. A sentence longer than the budget is cut at token
+    boundaries and slides with the same overlap. Chunks are slices of the
+    original text (never re-joined sentences), so Chunk.start/end locate
+    them exactly. Works incrementally over an iterable of text pieces, as
+    parsers.iter_pages yields them, and may span piece boundaries.
+    """
+
+    def __init__(self, token_spans=regex_token_spans, max_tokens=CHUNK_MAX_TOKENS,
+                 overlap_tokens=CHUNK_OVERLAP_TOKENS, name="regex"):
+        if max_tokens <= 0:
+            raise ValueError("max_tokens must be positive")
+        self.token_spans = token_spans
+        self.max_tokens = max_tokens
+        self.overlap_tokens = max(0, min(overlap_tokens, max_tokens - 1))
+        self.name = name
+
+    @classmethod
+    def for_model(cls, model, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+        """Budget chunks with the embedding model's own tokenizer when it has a fast one."""
+        max_seq_length = getattr(model, "max_seq_length", None)
+        if max_seq_length:
+            max_tokens = min(max_tokens, max_seq_length - 2)
+        tokenizer = getattr(model, "tokenizer", None)
+        if getattr(tokenizer, "is_fast", False):
+            name = getattr(tokenizer, "name_or_path", "") or type(tokenizer).__name__
+            return cls(tokenizer_token_spans(tokenizer), max_tokens, overlap_tokens, name=name)
+        logger.warning("Embedding model has no fast tokenizer, approximating token counts with a regex")
+        return cls(regex_token_spans, max_tokens, overlap_tokens)
+
+    @property
+    def variant(self):
+        """Identifies the chunking settings, e.g. as part of a cache key."""
+        return f"tokens={self.max_tokens}/overlap={self.overlap_tokens}/{self.name}"
+
+    def _units(self, text, offset):
+        """(start, end, tokens) spans of text, in global offsets, each within the token budget."""
+        sentences = list(_sentence_spans(text))
+        if not sentences:
+            return
+        all_spans = self.token_spans([text[start:end] for start, end in sentences])
+        step = self.overlap_tokens or self.max_tokens
+        for (start, end), spans in zip(sentences, all_spans):
+            if len(spans) <= self.max_tokens:
+                yield offset + start, offset + end, len(spans)
+                continue
+            # Oversized sentence: overlap-sized pieces, so packing them slides with the overlap
+            for i in range(0, len(spans), step):
+                piece = spans[i:i + step]
+                yield offset + start + piece[0][0], offset + start + piece[-1][1], len(piece)
+
+    def iter_chunks(self, pieces):
+        window = []  # (start, text) of pieces still referenced by pending units
+        pending = []  # (start, end, tokens)
+        pending_tokens = 0
+        fresh = 0  # pending units not yet part of an emitted chunk
+        offset = 0
+
+        def emit():
+            start, end = pending[0][0], pending[-1][1]
+            return Chunk(_slice(window, start, end), start, end, pending_tokens)
+
+        for piece in pieces:
+            window.append((offset, piece))
+            for unit in self._units(piece, offset):
+                if pending and pending_tokens + unit[2] > self.max_tokens:
+                    yield emit()
+                    # Carry trailing units worth at most overlap_tokens into the next chunk,
+                    # leaving room for the unit that did not fit
+                    budget = min(self.overlap_tokens, self.max_tokens - unit[2])
+                    keep = len(pending)
+                    carried = 0
+                    while keep > 0 and carried + pending[keep - 1][2] <= budget:
+                        keep -= 1
+                        carried += pending[keep][2]
+                    pending = pending[keep:]
+                    pending_tokens = carried
+                    fresh = 0
+                    while window and window[0][0] + len(window[0][1]) < (pending[0][0] if pending else unit[0]):
+                        window.pop(0)
+                pending.append(unit)
+                pending_tokens += unit[2]
+                fresh += 1
+            offset += len(piece) + 1
+        if fresh:
+            yield emit()
+
+
+def _slice(window, start, end):
+    """Text between global offsets, across pieces that were joined with newlines."""
+    parts = []
+    for piece_start, text in window:
+        piece_end = piece_start + len(text)
+        if piece_end < start:
+            continue
+        if piece_start >= end:
+            break
+        parts.append(text[max(0, start - piece_start):end - piece_start])
+    return "\n".join(parts)
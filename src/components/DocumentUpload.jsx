@@ -1,5 +1,6 @@
 import React, { useState } from 'react';
 import { FileText } from 'lucide-react';
+import { waitForUpload, uploadErrorMessage } from '../utils/uploadJobs';
 
 // Unified DocumentUpload component
 // - Requires conversationId prop to upload
@@ -33,12 +34,14 @@ const DocumentUpload = ({ onDocumentParsed, conversationId }) => {
       const response = await fetch('http://localhost:8080/upload', {
         method: 'POST',
         body: formData,
+        credentials: 'include', // session affinity cookie: status polls must reach the same instance
       });
       if (!response.ok) {
         const errorData = await response.json();
-        throw new Error(errorData.error || 'Upload failed');
+        throw new Error(uploadErrorMessage(errorData, 'Upload failed'));
       }
-      const data = await response.json();
+      // 202 with a job id: poll until the background ingestion finishes
+      const data = await waitForUpload('http://localhost:8080', await response.json());
       if (data.text) {
         if (onDocumentParsed) {
           onDocumentParsed(data.text, data.filename);
@@ -0,0 +1,97 @@
+import os
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Pool sizes (override via environment)
+IO_POOL_SIZE = int(os.getenv("IO_POOL_SIZE", 32))
+EMBED_POOL_SIZE = int(os.getenv("EMBED_POOL_SIZE", 1))
+PARSE_POOL_SIZE = int(os.getenv("PARSE_POOL_SIZE", os.cpu_count() or 1))
+
+
+class WorkerPool:
+    """Bounded executor that keeps blocking work off the event loop and tracks queue depth.
+
+    kind is "thread" for I/O and GIL-releasing work (Supabase, Gemini,
+    embedding) or "process" for pure-Python CPU work (document parsing).
+    The executor is created on first use so importing the app never forks.
+    """
+
+    def __init__(self, name, size, kind="thread"):
+        self.name = name
+        self.size = max(1, size)
+        self.kind = kind
+        self._executor = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    # spawn, not fork: the parent holds model threads and open sockets
+                    self._executor = ProcessPoolExecutor(max_workers=self.size, mp_context=multiprocessing.get_context("spawn"))
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix=self.name)
+            return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def submit(self, fn, *args, **kwargs):
+        """concurrent.futures-style submit, so the pool can be handed to sync code as an executor."""
+        with self._lock:
+            self.in_flight += 1
+        future = self.executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future):
+        with self._lock:
+            self.in_flight -= 1
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "size": self.size,
+            "in_flight": self.in_flight,
+            "queue_depth": max(0, self.in_flight - self.size),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=True)
+                self._executor = None
+
+
+io_pool = WorkerPool("io", IO_POOL_SIZE)
+embed_pool = WorkerPool("embed", EMBED_POOL_SIZE)
+parse_pool = WorkerPool("parse", PARSE_POOL_SIZE, kind="process")
+
+
+async def run_io(fn, *args, **kwargs):
+    """Run a blocking network call (Supabase, Gemini) on the I/O pool."""
+    return await io_pool.run(fn, *args, **kwargs)
+
+
+def pool_stats():
+    return {pool.name: pool.stats() for pool in (io_pool, embed_pool, parse_pool)}
+
+
+def shutdown_pools(wait=True):
+    for pool in (io_pool, embed_pool, parse_pool):
+        pool.shutdown(wait=wait)
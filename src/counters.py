@@ -0,0 +1,152 @@
+import logging
+import threading
+from postgrest.exceptions import APIError
+from .profile_cache import PROFILE_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Postgres function from supabase/migrations/*_adjust_user_counters.sql
+COUNTER_RPC = "adjust_user_counters"
+# PostgREST: function not found in the schema cache (migration not applied yet)
+_MISSING_FUNCTION = "PGRST202"
+
+
+class CounterLimitExceeded(Exception):
+    def __init__(self, counter, limit):
+        super().__init__(f"{counter} limit of {limit} reached")
+        self.counter = counter  # "conversations" or "messages"
+        self.limit = limit
+
+
+class UserCounters:
+    """Maintains users.conversation_count / message_count by deltas.
+
+    Every write applies its +1/-1 through adjust_user_counters, one atomic
+    UPDATE, instead of re-running COUNT(*) over the user's conversations
+    and messages. With enforce=True, positive deltas are refused for free
+    users at conversation_limit / message_limit, so the check and the
+    increment cannot race. recount() rebuilds both counters from scratch
+    and backs POST /users/{user_id}/recount for periodic reconciliation.
+
+    Until the migration is applied, adjust() falls back to a read-check-write
+    of the stored counters (correct, but not atomic under concurrency).
+    Every row read or written here is also passed to profile_cache, if given.
+    """
+
+    def __init__(self, conversation_limit, message_limit, profile_cache=None):
+        self.conversation_limit = conversation_limit
+        self.message_limit = message_limit
+        self.profile_cache = profile_cache
+        self.rpc_available = True
+        self._lock = threading.Lock()
+        self.adjustments = 0
+        self.refused = 0
+        self.fallbacks = 0
+        self.recounts = 0
+
+    async def adjust(self, db, user_id, conversations=0, messages=0, enforce=False):
+        """Apply deltas; returns the user's new counters, or None if the user does not exist.
+
+        Raises CounterLimitExceeded when enforce is set and a free user would
+        go over a limit; nothing is changed in that case.
+        """
+        if not conversations and not messages:
+            return None
+        conversation_limit = self.conversation_limit if enforce else None
+        message_limit = self.message_limit if enforce else None
+        if self.rpc_available:
+            try:
+                res = await db.execute(db.rpc(COUNTER_RPC, {
+                    "p_user_id": str(user_id),
+                    "p_conversations": conversations,
+                    "p_messages": messages,
+                    "p_conversation_limit": conversation_limit,
+                    "p_message_limit": message_limit,
+                }))
+            except APIError as e:
+                if e.code != _MISSING_FUNCTION:
+                    raise
+                logger.warning(f"{COUNTER_RPC} is not deployed, falling back to read-modify-write counters")
+                self.rpc_available = False
+            else:
+                if res.data:
+                    self._count("adjustments")
+                    self._cache(user_id, res.data[0], conversations, messages)
+                    return res.data[0]
+                # No row back: either no such user, or a limit refused the update
+                profile = await self._profile(db, user_id)
+                if profile is not None:
+                    self._cache(user_id, profile)
+                    self._refuse(profile, conversations, messages, conversation_limit, message_limit)
+                return None
+        return await self._adjust_fallback(db, user_id, conversations, messages, conversation_limit, message_limit)
+
+    async def _adjust_fallback(self, db, user_id, conversations, messages, conversation_limit, message_limit):
+        self._count("fallbacks")
+        profile = await self._profile(db, user_id)
+        if profile is None:
+            return None
+        self._refuse(profile, conversations, messages, conversation_limit, message_limit)
+        counts = {
+            "conversation_count": max(0, (profile.get("conversation_count") or 0) + conversations),
+            "message_count": max(0, (profile.get("message_count") or 0) + messages),
+        }
+        await db.execute(db.table("users").update(counts).eq("id", str(user_id)))
+        self._cache(user_id, dict(profile, **counts), conversations, messages)
+        return dict(profile, **counts)
+
+    def _refuse(self, profile, conversations, messages, conversation_limit, message_limit):
+        """Raise CounterLimitExceeded if the deltas would take a free user over a limit."""
+        if profile.get("membership_status") == "premium":
+            return
+        if conversation_limit is not None and conversations > 0 and \
+                (profile.get("conversation_count") or 0) + conversations > conversation_limit:
+            self._count("refused")
+            raise CounterLimitExceeded("conversations", conversation_limit)
+        if message_limit is not None and messages > 0 and \
+                (profile.get("message_count") or 0) + messages > message_limit:
+            self._count("refused")
+            raise CounterLimitExceeded("messages", message_limit)
+
+    async def _profile(self, db, user_id):
+        res = await db.execute(db.table("users").select(PROFILE_COLUMNS).eq("id", str(user_id)))
+        return res.data[0] if res.data else None
+
+    async def recount(self, db, user_id):
+        """Rebuild both counters with COUNT(*); user_id must already be a validated UUID."""
+        sql = f"SELECT COUNT(*) AS count FROM conversations WHERE user_id = '{user_id}'"
+        conversation_count = await self._scalar(db, sql)
+        sql = f"SELECT COUNT(*) AS count FROM messages WHERE conversation_id IN (SELECT id FROM conversations WHERE user_id = '{user_id}')"
+        message_count = await self._scalar(db, sql)
+        logger.info(f"Recounted user_id={user_id}: conversation_count={conversation_count}, message_count={message_count}")
+        await db.execute(db.table("users").update({
+            "conversation_count": conversation_count,
+            "message_count": message_count,
+        }).eq("id", user_id))
+        self._count("recounts")
+        counts = {"conversation_count": conversation_count, "message_count": message_count}
+        self._cache(user_id, counts)
+        return counts
+
+    async def _scalar(self, db, sql):
+        result = await db.execute(db.rpc('execute_sql', {'sql': sql}))
+        if result.data and isinstance(result.data, list) and len(result.data) > 0:
+            return result.data[0].get('count', 0)
+        return 0
+
+    def _cache(self, user_id, row, conversations=0, messages=0):
+        if self.profile_cache is not None:
+            self.profile_cache.apply(user_id, row, conversations, messages)
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        return {
+            "rpc_available": self.rpc_available,
+            "adjustments": self.adjustments,
+            "refused": self.refused,
+            "fallbacks": self.fallbacks,
+            "recounts": self.recounts,
+        }
@@ -0,0 +1,210 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import httpx
+from postgrest.utils import SyncClient
+from supabase import create_client
+from supabase.lib.client_options import SyncClientOptions
+from .concurrency import run_io
+from .metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Connection pool and retry settings (override via environment)
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", 30))
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", 50))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", 20))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", 60))
+SUPABASE_MAX_RETRIES = int(os.getenv("SUPABASE_MAX_RETRIES", 2))
+SUPABASE_RETRY_BACKOFF = float(os.getenv("SUPABASE_RETRY_BACKOFF", 0.2))
+
+# Failures where the request never reached the server, so even writes are safe to resend
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class Database:
+    """Application-lifetime Supabase access layer.
+
+    Owns one Supabase client whose PostgREST session is a keep-alive httpx
+    connection pool, so handlers share connections instead of paying a new
+    TLS handshake per request. Build queries with table()/rpc() and run them
+    with `await db.execute(query)`, which retries transport failures with
+    exponential backoff and records per-call timings.
+    """
+
+    def __init__(self, url, key, timeout=SUPABASE_TIMEOUT, max_connections=SUPABASE_MAX_CONNECTIONS,
+                 max_keepalive=SUPABASE_MAX_KEEPALIVE, keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+                 max_retries=SUPABASE_MAX_RETRIES, retry_backoff=SUPABASE_RETRY_BACKOFF):
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.client = create_client(url, key, options=SyncClientOptions(postgrest_client_timeout=timeout))
+        postgrest = self.client.postgrest
+        default_session = postgrest.session
+        postgrest.session = SyncClient(
+            base_url=default_session.base_url,
+            headers=default_session.headers,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            follow_redirects=True,
+            http2=True,
+        )
+        default_session.close()
+        self._stats = {}
+
+    def table(self, name):
+        return self.client.table(name)
+
+    def rpc(self, name, params):
+        return self.client.rpc(name, params)
+
+    async def execute(self, query):
+        method = getattr(query, "http_method", "GET")
+        label = f"{method} {getattr(query, 'path', '?')}"
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                result = await run_io(query.execute)
+                self._record(label, time.perf_counter() - start, retried=attempt > 0)
+                return result
+            except httpx.TransportError as e:
+                retryable = method in ("GET", "HEAD") or isinstance(e, _NOT_SENT_ERRORS)
+                if not retryable or attempt >= self.max_retries:
+                    self._record(label, time.perf_counter() - start, retried=attempt > 0, failed=True)
+                    raise
+                delay = self.retry_backoff * (2 ** attempt) * (1 + random.random() / 2)
+                logger.warning(f"Supabase {label} failed ({e.__class__.__name__}), retrying in {delay:.2f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+            except Exception:
+                self._record(label, time.perf_counter() - start, retried=attempt > 0, failed=True)
+                raise
+
+    def _record(self, label, elapsed, retried=False, failed=False):
+        STAGE_SECONDS.observe(elapsed, stage="supabase")
+        entry = self._stats.setdefault(label, {"calls": 0, "errors": 0, "retried": 0, "total_ms": 0.0, "max_ms": 0.0})
+        entry["calls"] += 1
+        entry["errors"] += int(failed)
+        entry["retried"] += int(retried)
+        entry["total_ms"] += elapsed * 1000
+        entry["max_ms"] = max(entry["max_ms"], elapsed * 1000)
+
+    def stats(self):
+        return {
+            label: dict(entry, avg_ms=entry["total_ms"] / entry["calls"] if entry["calls"] else 0.0)
+            for label, entry in self._stats.items()
+        }
+
+    def close(self):
+        self.client.postgrest.session.close()
+
+
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", 100))
+
+# Process-wide bulk insert counters, reported next to the per-call timings
+bulk_insert_stats = {"documents": 0, "rows": 0, "batches": 0, "failed_batches": 0, "rolled_back_rows": 0, "seconds": 0.0}
+
+
+class BatchInsertError(Exception):
+    def __init__(self, message, errors):
+        super().__init__(message)
+        self.errors = errors
+
+
+class BatchWriter:
+    """Writes one document's rows as multi-row inserts of batch_size rows.
+
+    PostgREST applies each multi-row insert atomically. To make the whole
+    document all-or-nothing, a failed batch stops the writer and deletes
+    the rows earlier batches already stored, then raises BatchInsertError
+    with per-batch error details. make_row, if given, maps each written
+    item to the row dict to insert.
+    """
+
+    def __init__(self, db, table, batch_size=INSERT_BATCH_SIZE, make_row=None):
+        self.db = db
+        self.table = table
+        self.make_row = make_row
+        self.batch_size = max(1, batch_size)
+        self._pending = []
+        self._inserted_ids = []
+        self.batches = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.errors = []
+
+    async def write(self, rows):
+        """Buffer rows, sending full batches; returns how many rows were stored by this call."""
+        self._pending.extend(map(self.make_row, rows) if self.make_row else rows)
+        stored = 0
+        while len(self._pending) >= self.batch_size:
+            batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+            stored += await self._insert(batch)
+        return stored
+
+    async def flush(self):
+        """Send whatever is still buffered and finish the document."""
+        stored = 0
+        if self._pending:
+            batch, self._pending = self._pending, []
+            stored = await self._insert(batch)
+        bulk_insert_stats["documents"] += 1
+        return stored
+
+    async def _insert(self, batch):
+        start = time.perf_counter()
+        number = self.batches + 1
+        try:
+            res = await self.db.execute(self.db.table(self.table).insert(batch))
+            if not res.data or len(res.data) != len(batch):
+                raise RuntimeError(f"expected {len(batch)} rows back, got {len(res.data or [])}")
+        except Exception as e:
+            self.seconds += time.perf_counter() - start
+            bulk_insert_stats["failed_batches"] += 1
+            self.errors.append({"batch": number, "rows": len(batch), "error": str(e)})
+            logger.error(f"Bulk insert into {self.table} failed on batch {number} ({len(batch)} rows): {e}")
+            await self.rollback()
+            raise BatchInsertError(f"Insert into {self.table} failed on batch {number}", self.errors)
+        elapsed = time.perf_counter() - start
+        self.seconds += elapsed
+        self.batches += 1
+        self.rows += len(batch)
+        self._inserted_ids.extend(row["id"] for row in res.data if "id" in row)
+        bulk_insert_stats["batches"] += 1
+        bulk_insert_stats["rows"] += len(batch)
+        bulk_insert_stats["seconds"] += elapsed
+        return len(batch)
+
+    async def rollback(self):
+        """Delete every row this writer already stored."""
+        self._pending = []
+        ids, self._inserted_ids = self._inserted_ids, []
+        for start in range(0, len(ids), self.batch_size):
+            chunk = ids[start:start + self.batch_size]
+            try:
+                await self.db.execute(self.db.table(self.table).delete().in_("id", chunk))
+                bulk_insert_stats["rolled_back_rows"] += len(chunk)
+            except Exception as e:
+                self.errors.append({"rollback": True, "rows": len(chunk), "error": str(e)})
+                logger.error(f"Rollback of {len(chunk)} {self.table} rows failed: {e}")
+        self.rows = 0
+
+    def stats(self):
+        return {
+            "rows": self.rows,
+            "batches": self.batches,
+            "seconds": round(self.seconds, 3),
+            "rows_per_second": round(self.rows / self.seconds, 1) if self.seconds else 0.0,
+        }
+
+
+def bulk_stats():
+    stats = dict(bulk_insert_stats)
+    stats["rows_per_second"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+import numpy as np
+from .chunking import Chunk
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed upload cache (override via environment)
+DOC_CACHE_ENABLED = os.getenv("DOC_CACHE_ENABLED", "true").lower() == "true"
+# The default directory is under the temp dir, which is RAM-backed on Cloud Run: keep the bound small
+# there, or point DOC_CACHE_DIR at real disk before raising it
+DOC_CACHE_DIR = os.getenv("DOC_CACHE_DIR", os.path.join(tempfile.gettempdir(), "policy-agent-doc-cache"))
+DOC_CACHE_MAX_BYTES = int(os.getenv("DOC_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+
+_SUFFIXES = (".chunks", ".f32", ".txt")
+
+
+class CachedDocument:
+    """A cache hit: echo text, chunk count and a read-only memory-mapped embedding matrix.
+
+    Chunk texts stay on disk and are read batch by batch in batches(). The
+    files are opened on lookup, so a concurrent eviction cannot pull them
+    out from under a reader.
+    """
+
+    def __init__(self, sha256, text, text_truncated, pages, chunks_file, embeddings, on_corrupt=None):
+        self.sha256 = sha256
+        self.text = text
+        self.text_truncated = text_truncated
+        self.pages = pages
+        self.embeddings = embeddings
+        self._chunks_file = chunks_file
+        self._on_corrupt = on_corrupt
+
+    @property
+    def chunks(self):
+        return len(self.embeddings)
+
+    def close(self):
+        self._chunks_file.close()
+
+    def batches(self, batch_size):
+        """Yield (chunk texts, float32 embeddings) in the order they were first ingested.
+
+        A line that does not decode drops the entry, so the next upload of
+        the document misses and rebuilds it, and raises ValueError.
+        """
+        with self._chunks_file as f:
+            start = 0
+            while start < len(self.embeddings):
+                try:
+                    lines = [json.loads(f.readline()) for _ in range(min(batch_size, len(self.embeddings) - start))]
+                except ValueError as e:
+                    if self._on_corrupt is not None:
+                        self._on_corrupt()
+                    raise ValueError(f"Document cache entry {self.sha256[:12]} is corrupt: {e}") from e
+                chunks = [Chunk(*line) if isinstance(line, list) else line for line in lines]
+                yield chunks, np.array(self.embeddings[start:start + len(chunks)])
+                start += len(chunks)
+
+
+class CacheEntryWriter:
+    """Appends a document's chunks and embeddings to disk while the upload pipeline runs.
+
+    Every writer has its own temp files in the entry's directory, so
+    overlapping uploads of the same document cannot write into each
+    other's files; commit() moves them into place, last one wins.
+    """
+
+    def __init__(self, cache, sha256, variant):
+        self.cache = cache
+        self.sha256 = sha256
+        self.variant = variant
+        self.base = cache._base_path(sha256, variant)
+        directory = os.path.dirname(self.base)
+        os.makedirs(directory, exist_ok=True)
+        self.partials = {}
+        for suffix in _SUFFIXES:
+            fd, self.partials[suffix] = tempfile.mkstemp(prefix=os.path.basename(self.base) + ".",
+                                                         suffix=suffix + ".partial", dir=directory)
+            os.close(fd)
+        self._chunks = open(self.partials[".chunks"], "w", encoding="utf-8")
+        self._vectors = open(self.partials[".f32"], "wb")
+        self.count = 0
+        self.dim = None
+        self.failed = False
+
+    def add(self, chunks, embeddings):
+        # Best effort like commit(): after a failed write the rest of the document is ignored
+        if self.failed:
+            return
+        try:
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+            for chunk in chunks:
+                # Token chunks keep their source offsets
+                line = [str(chunk), chunk.start, chunk.end, chunk.tokens] if isinstance(chunk, Chunk) else chunk
+                self._chunks.write(json.dumps(line) + "\n")
+            self._vectors.write(embeddings.tobytes())
+            self.count += len(chunks)
+        except Exception as e:
+            logger.warning(f"Caching document {self.sha256[:12]} failed, skipping it: {e}")
+            self.failed = True
+            self.abort()
+
+    def commit(self, text, text_truncated, pages, build_seconds):
+        """Publish the entry. Best effort: a failure is logged and leaves no entry behind, never raises."""
+        try:
+            self._close_files()
+            if self.failed or not self.count:
+                self.abort()
+                return
+            with open(self.partials[".txt"], "w", encoding="utf-8") as f:
+                f.write(text)
+            size = sum(os.path.getsize(path) for path in self.partials.values())
+            self.cache._install(self.sha256, self.variant, self.partials, self.count, self.dim, pages,
+                                text_truncated, size, build_seconds)
+        except Exception as e:
+            logger.warning(f"Caching document {self.sha256[:12]} failed, dropping the entry: {e}")
+            self.abort()
+            self.cache.drop(self.sha256, self.variant)
+
+    def abort(self):
+        self._close_files()
+        for path in self.partials.values():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _close_files(self):
+        for f in (self._chunks, self._vectors):
+            if not f.closed:
+                f.close()
+
+
+class DocumentCache:
+    """Parsed text, chunks and embeddings keyed by SHA-256 of the upload bytes.
+
+    The variant string (embedding model plus chunker settings) is part of
+    the key, so changing either misses instead of serving stale vectors.
+    Embeddings are stored as raw float32 files and memory-mapped on read;
+    metadata lives in SQLite. Entries are evicted least-recently-used once
+    the total size exceeds max_bytes. The cache is best effort: an entry
+    that cannot be read or decoded is dropped and counts as a miss.
+    """
+
+    def __init__(self, directory=DOC_CACHE_DIR, max_bytes=DOC_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " sha256 TEXT NOT NULL, variant TEXT NOT NULL, chunks INTEGER, dim INTEGER, pages INTEGER,"
+            " text_truncated INTEGER, bytes INTEGER, build_seconds REAL, created_at REAL, last_used_at REAL,"
+            " hits INTEGER DEFAULT 0, PRIMARY KEY (sha256, variant))"
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+    def _base_path(self, sha256, variant):
+        variant_id = hashlib.sha1(variant.encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self.directory, sha256[:2], f"{sha256}-{variant_id}")
+
+    def get(self, sha256, variant):
+        start = time.perf_counter()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT chunks, dim, pages, text_truncated, build_seconds FROM entries WHERE sha256 = ? AND variant = ?",
+                (sha256, variant),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            count, dim, pages, text_truncated, build_seconds = row
+            base = self._base_path(sha256, variant)
+            chunks_file = None
+            try:
+                embeddings = np.memmap(base + ".f32", dtype=np.float32, mode="r", shape=(count, dim))
+                with open(base + ".txt", encoding="utf-8") as f:
+                    text = f.read()
+                chunks_file = open(base + ".chunks", encoding="utf-8")
+                # Decode every line up front, so a bad entry is a miss rather than an upload failing halfway
+                lines = 0
+                for line in chunks_file:
+                    json.loads(line)
+                    lines += 1
+                if lines != count:
+                    raise ValueError(f"{lines} chunk lines for {count} embeddings")
+                chunks_file.seek(0)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Document cache entry {sha256[:12]} unreadable, dropping it: {e}")
+                if chunks_file is not None:
+                    chunks_file.close()
+                self._delete(sha256, variant)
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE entries SET last_used_at = ?, hits = hits + 1 WHERE sha256 = ? AND variant = ?",
+                (time.time(), sha256, variant),
+            )
+            self._conn.commit()
+            self.hits += 1
+            # Parse + chunk + embed time the first upload spent, minus what this lookup cost
+            self.saved_seconds += max(0.0, (build_seconds or 0.0) - (time.perf_counter() - start))
+            return CachedDocument(sha256, text, bool(text_truncated), pages, chunks_file, embeddings,
+                                  on_corrupt=lambda: self.drop(sha256, variant))
+
+    def writer(self, sha256, variant):
+        return CacheEntryWriter(self, sha256, variant)
+
+    def _install(self, sha256, variant, partials, count, dim, pages, text_truncated, size, build_seconds):
+        # Files and row change together under the lock, so get() never pairs files from different writers
+        now = time.time()
+        base = self._base_path(sha256, variant)
+        with self._lock:
+            for suffix, path in partials.items():
+                os.replace(path, base + suffix)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (sha256, variant, chunks, dim, pages, text_truncated, bytes, build_seconds,"
+                " created_at, last_used_at, hits) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                (sha256, variant, count, dim, pages, int(text_truncated), size, build_seconds, now, now),
+            )
+            self._conn.commit()
+            self._evict()
+
+    def drop(self, sha256, variant):
+        try:
+            with self._lock:
+                self._delete(sha256, variant)
+        except Exception as e:
+            logger.warning(f"Dropping document cache entry {sha256[:12]} failed: {e}")
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM entries").fetchone()[0]
+        while total > self.max_bytes:
+            oldest = self._conn.execute("SELECT sha256, variant, bytes FROM entries ORDER BY last_used_at LIMIT 1").fetchone()
+            if oldest is None:
+                break
+            self._delete(oldest[0], oldest[1])
+            total -= oldest[2]
+            self.evictions += 1
+
+    def _delete(self, sha256, variant):
+        base = self._base_path(sha256, variant)
+        for suffix in _SUFFIXES:
+            try:
+                os.remove(base + suffix)
+            except FileNotFoundError:
+                pass
+        self._conn.execute("DELETE FROM entries WHERE sha256 = ? AND variant = ?", (sha256, variant))
+        self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
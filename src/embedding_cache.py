@@ -0,0 +1,122 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Cache sizing (override via environment)
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", 600))
+
+
+class ConversationEmbeddingCache:
+    """In-process LRU of parsed EmbeddingIndex objects keyed by conversation_id.
+
+    Entries are evicted least-recently-used first once the total size exceeds
+    max_bytes, and lazily dropped on access once older than ttl_seconds.
+    Write paths call invalidate() whenever a conversation's document_contexts
+    change. A reader that builds an index takes version() before reading the
+    rows and passes it to put(), which drops the index if the conversation
+    was invalidated in the meantime, so a build that raced a write is not
+    cached.
+    """
+
+    def __init__(self, max_bytes=EMBEDDING_CACHE_MAX_BYTES, ttl_seconds=EMBEDDING_CACHE_TTL_SECONDS, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries = OrderedDict()  # conversation_id -> (index, size, stored_at)
+        self._bytes = 0
+        self._version = 0
+        # conversation_id -> (version, invalidated_at), oldest first; older than ttl_seconds no build can still be running
+        self._invalidated = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    def get(self, conversation_id):
+        key = str(conversation_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            index, size, stored_at = entry
+            if self._clock() - stored_at > self.ttl_seconds:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return index
+
+    def version(self):
+        """Token for put(): take it before reading the rows an index is built from."""
+        with self._lock:
+            return self._version
+
+    def put(self, conversation_id, index, version=None):
+        key = str(conversation_id)
+        size = index.nbytes
+        with self._lock:
+            invalidated = self._invalidated.get(key)
+            if version is not None and invalidated is not None and invalidated[0] > version:
+                self.stale_puts += 1
+                return
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                logger.info(f"Embedding cache: conversation {key} ({size} bytes) exceeds budget, not cached")
+                return
+            self._entries[key] = (index, size, self._clock())
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, conversation_id):
+        key = str(conversation_id)
+        with self._lock:
+            now = self._clock()
+            self._version += 1
+            self._invalidated.pop(key, None)
+            self._invalidated[key] = (self._version, now)
+            while now - next(iter(self._invalidated.values()))[1] > self.ttl_seconds:
+                self._invalidated.popitem(last=False)
+            if key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts,
+            }
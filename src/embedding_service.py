@@ -0,0 +1,151 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .metrics import STAGE_SECONDS, EMBEDDED_TEXTS
+
+logger = logging.getLogger(__name__)
+
+# Micro-batching settings (override via environment)
+EMBED_MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE", 32))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", 5))
+EMBED_MEMO_SIZE = int(os.getenv("EMBED_MEMO_SIZE", 2048))
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingService:
+    """Coalesces concurrent encode requests into micro-batches run off the event loop.
+
+    encode_fn takes a list of strings and returns an array-like of shape
+    (len(texts), dim). Results for repeated strings are memoized in an LRU
+    keyed by the SHA-256 of the text.
+    """
+
+    def __init__(self, encode_fn, max_batch_size=EMBED_MAX_BATCH_SIZE, max_wait_ms=EMBED_MAX_WAIT_MS,
+                 memo_size=EMBED_MEMO_SIZE, executor=None):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._memo_lock = threading.Lock()
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+        self._queue = None
+        self._worker = None
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self.batches = 0
+        self.batched_texts = 0
+
+    # --- memo ---
+
+    def _memo_get(self, key):
+        with self._memo_lock:
+            vector = self._memo.get(key)
+            if vector is None:
+                self.memo_misses += 1
+                return None
+            self._memo.move_to_end(key)
+            self.memo_hits += 1
+            return vector
+
+    def _memo_put(self, key, vector):
+        if self.memo_size <= 0:
+            return
+        with self._memo_lock:
+            self._memo[key] = vector
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    # --- public API ---
+
+    def encode_sync(self, texts):
+        """Blocking batch encode for callers that are already off the event loop."""
+        vectors = np.asarray(self.encode_fn(list(texts)), dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        return vectors
+
+    async def embed(self, text):
+        """Return the float32 embedding for a single string."""
+        key = text_key(text)
+        vector = self._memo_get(key)
+        if vector is not None:
+            return vector
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((key, text, future))
+        return await future
+
+    async def embed_many(self, texts):
+        return await asyncio.gather(*(self.embed(t) for t in texts))
+
+    def stats(self):
+        lookups = self.memo_hits + self.memo_misses
+        return {
+            "memo_entries": len(self._memo),
+            "memo_hits": self.memo_hits,
+            "memo_misses": self.memo_misses,
+            "memo_hit_rate": self.memo_hits / lookups if lookups else 0.0,
+            "batches": self.batches,
+            "avg_batch_size": self.batched_texts / self.batches if self.batches else 0.0,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+    # --- batching worker ---
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._encode_batch(loop, batch)
+
+    async def _encode_batch(self, loop, batch):
+        # Identical strings queued together are encoded once
+        unique = OrderedDict()
+        for key, text, _ in batch:
+            unique.setdefault(key, text)
+        start = time.perf_counter()
+        try:
+            vectors = await loop.run_in_executor(self._executor, self.encode_sync, list(unique.values()))
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(unique)} failed: {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="embed_query")
+        EMBEDDED_TEXTS.inc(len(unique), source="query")
+        self.batches += 1
+        self.batched_texts += len(unique)
+        results = {}
+        for key, vector in zip(unique, vectors):
+            vector.flags.writeable = False
+            results[key] = vector
+            self._memo_put(key, vector)
+        for key, _, future in batch:
+            if not future.done():
+                future.set_result(results[key])
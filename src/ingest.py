@@ -0,0 +1,271 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import numpy as np
+from .selection import ChunkSelector, MAX_CHUNKS, SIM_THRESHOLD
+from .concurrency import io_pool
+from .parsers import ParseError
+
+logger = logging.getLogger(__name__)
+
+# Upload pipeline settings (override via environment)
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", 64))
+INGEST_PREFETCH_CHUNKS = int(os.getenv("INGEST_PREFETCH_CHUNKS", 256))
+INGEST_MEMORY_LIMIT_BYTES = int(os.getenv("INGEST_MEMORY_LIMIT_BYTES", 256 * 1024 * 1024))
+UPLOAD_ECHO_TEXT_MAX_CHARS = int(os.getenv("UPLOAD_ECHO_TEXT_MAX_CHARS", 1_000_000))
+
+
+class IngestMemoryExceeded(Exception):
+    pass
+
+
+def iter_chunks(pieces, max_length=2000):
+    """Character-based chunking of an iterable of text pieces; ingest_document's default chunker.
+
+    Pieces are treated as if joined with newlines, then packed line by line
+    into chunks of fewer than max_length characters.
+    """
+    parts = []
+    size = 0
+    for piece in pieces:
+        for para in piece.split('\n'):
+            if size + len(para) < max_length:
+                parts.append(para)
+                size += len(para) + 1
+            else:
+                if parts:
+                    chunk = '\n'.join(parts).strip()
+                    if chunk:
+                        yield chunk
+                parts = [para]
+                size = len(para) + 1
+    if parts:
+        chunk = '\n'.join(parts).strip()
+        if chunk:
+            yield chunk
+
+
+class IngestResult:
+    def __init__(self):
+        self.text_parts = []
+        self.text_chars = 0
+        self.text_truncated = False
+        self.pages = 0
+        self.chunks = 0
+        self.selected = 0
+        self.stored = 0
+        self.duplicates = 0
+        self.timings = {"parse": 0.0, "chunk": 0.0, "embed": 0.0, "select": 0.0, "store": 0.0}
+        self.peak_buffer_bytes = 0
+
+    @property
+    def text(self):
+        return "\n".join(self.text_parts)
+
+    def keep_text(self, piece, limit):
+        # Echo text for the response, capped so it does not defeat the memory bound
+        if self.text_truncated:
+            return
+        remaining = limit - self.text_chars
+        if len(piece) > remaining:
+            piece = piece[:max(0, remaining)]
+            self.text_truncated = True
+        self.text_parts.append(piece)
+        self.text_chars += len(piece) + 1
+
+
+class CollectingStore:
+    """Wraps a store, keeping a compact copy (texts + float32 rows) of every pair it writes."""
+
+    def __init__(self, store):
+        self.store = store
+        self.texts = []
+        self._vectors = []
+
+    async def write(self, pairs):
+        stored = await self.store.write(pairs)
+        self.texts.extend(chunk for chunk, _ in pairs)
+        self._vectors.append(np.asarray([embedding for _, embedding in pairs], dtype=np.float32))
+        return stored
+
+    async def flush(self):
+        return await self.store.flush()
+
+    @property
+    def vectors(self):
+        return np.concatenate(self._vectors) if self._vectors else np.zeros((0, 0), dtype=np.float32)
+
+
+async def _prefetch(iterator, maxsize):
+    """Run a blocking iterator in a thread, handing items over through a bounded queue."""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=maxsize)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterator:
+                if stop.is_set():
+                    return
+                asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+            asyncio.run_coroutine_threadsafe(queue.put(done), loop).result()
+        except BaseException as e:
+            if not stop.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put(e), loop).result()
+
+    producer_task = asyncio.ensure_future(io_pool.run(produce))
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Unblock a producer waiting on a full queue
+        while not queue.empty():
+            queue.get_nowait()
+        await producer_task
+
+
+class _SelectAndStore:
+    """Selection and storage stages shared by the full pipeline and cache hits."""
+
+    def __init__(self, result, selector, store, memory_limit):
+        self.result = result
+        self.selector = selector
+        self.store = store
+        self.memory_limit = memory_limit
+
+    async def offer(self, batch, embeddings):
+        result = self.result
+        start = time.perf_counter()
+        ready = self.selector.offer(batch, embeddings)
+        result.timings["select"] += time.perf_counter() - start
+        buffered = self.selector.nbytes + result.text_chars + sum(len(c) for c in batch) + np.asarray(embeddings).nbytes
+        result.peak_buffer_bytes = max(result.peak_buffer_bytes, buffered)
+        if self.memory_limit and buffered > self.memory_limit:
+            raise IngestMemoryExceeded(f"Upload pipeline buffered {buffered} bytes, the limit is {self.memory_limit}")
+        await self._write(ready)
+
+    async def _write(self, pairs):
+        if not pairs:
+            return
+        start = time.perf_counter()
+        self.result.stored += await self.store.write(pairs)
+        self.result.timings["store"] += time.perf_counter() - start
+        self.result.selected += len(pairs)
+
+    async def finish(self):
+        result = self.result
+        await self._write(self.selector.finish())
+        start = time.perf_counter()
+        result.stored += await self.store.flush()
+        result.timings["store"] += time.perf_counter() - start
+        result.duplicates = self.selector.duplicates
+        logger.info(
+            f"Ingested {result.pages} pages, {result.chunks} chunks, {result.selected} selected, {result.stored} stored; "
+            f"timings {', '.join(f'{k}={v:.2f}s' for k, v in result.timings.items())}; peak buffer {result.peak_buffer_bytes} bytes"
+        )
+        return result
+
+
+async def ingest_document(pages, embed, store, max_chunks=MAX_CHUNKS, sim_threshold=SIM_THRESHOLD,
+                          batch_size=INGEST_EMBED_BATCH_SIZE, memory_limit=INGEST_MEMORY_LIMIT_BYTES,
+                          echo_limit=UPLOAD_ECHO_TEXT_MAX_CHARS, record=None, chunker=iter_chunks, result=None):
+    """Parse → chunk → embed → select → store, streaming.
+
+    pages is a blocking iterator of text pieces (see parsers.iter_pages); it
+    is consumed in a background thread so parsing overlaps with embedding
+    and storage. embed is an async callable mapping a list of strings to an
+    array of embeddings. store has async write(pairs) and flush() methods
+    taking (chunk, embedding) pairs and returning how many rows they stored.
+    chunker maps the iterable of pieces to an iterable of chunk strings
+    (e.g. chunking.TokenChunker.iter_chunks). record, if given, has a blocking add(chunks, embeddings) method that is
+    handed every embedded batch (see doc_cache.CacheEntryWriter). result, if
+    given, is the IngestResult to fill in, so a caller can watch its counters
+    while ingestion runs.
+    """
+    result = result if result is not None else IngestResult()
+    stages = _SelectAndStore(result, ChunkSelector(max_chunks=max_chunks, sim_threshold=sim_threshold), store, memory_limit)
+
+    def timed_pages():
+        start = time.perf_counter()
+        try:
+            for page in pages:
+                result.timings["parse"] += time.perf_counter() - start
+                result.pages += 1
+                result.keep_text(page, echo_limit)
+                yield page
+                start = time.perf_counter()
+        except ParseError:
+            raise
+        except Exception as e:
+            # Whatever a parser library raises on a corrupt file is a parse failure, not a server error
+            raise ParseError(str(e)) from e
+        result.timings["parse"] += time.perf_counter() - start
+
+    def timed_chunks():
+        chunks = chunker(timed_pages())
+        while True:
+            start = time.perf_counter()
+            parse_before = result.timings["parse"]
+            chunk = next(chunks, None)
+            # Time spent pulling pages is parse time; the rest is chunking
+            result.timings["chunk"] += time.perf_counter() - start - (result.timings["parse"] - parse_before)
+            if chunk is None:
+                return
+            yield chunk
+
+    async def process(batch):
+        start = time.perf_counter()
+        embeddings = await embed(batch)
+        result.timings["embed"] += time.perf_counter() - start
+        if record is not None:
+            await io_pool.run(record.add, batch, embeddings)
+        await stages.offer(batch, embeddings)
+
+    batch = []
+    stream = _prefetch(timed_chunks(), INGEST_PREFETCH_CHUNKS)
+    try:
+        async for chunk in stream:
+            result.chunks += 1
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                await process(batch)
+                batch = []
+    finally:
+        # Stops the parsing thread promptly if a later stage failed
+        await stream.aclose()
+    if batch:
+        await process(batch)
+    return await stages.finish()
+
+
+async def ingest_cached(cached, store, max_chunks=MAX_CHUNKS, sim_threshold=SIM_THRESHOLD,
+                        batch_size=INGEST_EMBED_BATCH_SIZE, memory_limit=INGEST_MEMORY_LIMIT_BYTES, result=None):
+    """Select → store for a document whose chunks and embeddings came from the document cache."""
+    result = result if result is not None else IngestResult()
+    result.text_parts = [cached.text]
+    result.text_chars = len(cached.text)
+    result.text_truncated = cached.text_truncated
+    result.pages = cached.pages
+    result.timings["cache_read"] = 0.0
+    stages = _SelectAndStore(result, ChunkSelector(max_chunks=max_chunks, sim_threshold=sim_threshold), store, memory_limit)
+    stream = _prefetch(cached.batches(batch_size), 4)
+    try:
+        start = time.perf_counter()
+        async for batch, embeddings in stream:
+            result.timings["cache_read"] += time.perf_counter() - start
+            result.chunks += len(batch)
+            await stages.offer(batch, embeddings)
+            start = time.perf_counter()
+    finally:
+        await stream.aclose()
+        cached.close()
+    return await stages.finish()
@@ -0,0 +1,282 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Ingestion job queue settings (override via environment)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))
+INGEST_QUEUE_MAX = int(os.getenv("INGEST_QUEUE_MAX", 100))
+INGEST_QUEUE_MAX_PER_USER = int(os.getenv("INGEST_QUEUE_MAX_PER_USER", 5))
+# Finished jobs stay queryable for this long (and at most INGEST_JOBS_RETAINED of them); clients poll
+# every second, so a few minutes is plenty
+INGEST_JOB_RETENTION_SECONDS = float(os.getenv("INGEST_JOB_RETENTION_SECONDS", 600))
+INGEST_JOBS_RETAINED = int(os.getenv("INGEST_JOBS_RETAINED", 200))
+# Most document text a finished upload's result echoes back, as it is held until the job is pruned
+INGEST_RESULT_TEXT_MAX_CHARS = int(os.getenv("INGEST_RESULT_TEXT_MAX_CHARS", 100_000))
+# Sent as Retry-After when an upload is turned away because the queue is full
+INGEST_RETRY_AFTER_SECONDS = int(os.getenv("INGEST_RETRY_AFTER_SECONDS", 10))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class QueueFull(Exception):
+    def __init__(self, message, per_owner=False):
+        super().__init__(message)
+        self.per_owner = per_owner
+
+
+class JobError(Exception):
+    """An expected job failure, reported in the job status with an HTTP-style status code."""
+
+    def __init__(self, status_code, detail, details=None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.details = details
+
+
+class Job:
+    def __init__(self, owner, run, cleanup=None, **info):
+        self.id = str(uuid.uuid4())
+        self.owner = owner
+        self.info = info  # returned with the status, e.g. filename and conversation_id
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.report = None  # set by run: returns the live progress dict
+        self.progress = {}
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self._run = run
+        self._cleanup = cleanup
+        self._task = None
+
+    @property
+    def done(self):
+        return self.status in (SUCCEEDED, FAILED, CANCELLED)
+
+    def snapshot(self):
+        if self.report is not None:
+            try:
+                self.progress = self.report()
+            except Exception as e:
+                logger.warning(f"Progress report for job {self.id} failed: {e}")
+        return dict(self.progress)
+
+    def to_dict(self, position=None):
+        status = {
+            "job_id": self.id,
+            "status": self.status,
+            **self.info,
+            "progress": self.snapshot(),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if position is not None:
+            status["queue_position"] = position
+        if self.cancel_requested and not self.done:
+            status["cancel_requested"] = True
+        if self.result is not None:
+            status["result"] = self.result
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+
+class JobQueue:
+    """Bounded in-process queue of async jobs run by a fixed number of workers.
+
+    Each owner (user) has its own FIFO and workers take from owners in
+    round-robin order, so one user's burst of uploads cannot starve the
+    others. submit() raises QueueFull past max_queued jobs in total or
+    max_queued_per_owner for one owner. A job is an async callable taking
+    the Job; its return value becomes job.result, a JobError becomes
+    job.error with its status code, and any other exception a 500. cancel()
+    drops a queued job or cancels the running task, so the job's own
+    cleanup (finally blocks, rollbacks) runs. Everything lives in this
+    process: jobs do not survive a restart, and status must be polled on
+    the instance that accepted the job. The deployment therefore runs with
+    session affinity, which routes a client's polls back to that instance
+    on a best-effort basis, and without CPU throttling, so jobs keep running
+    between requests.
+    """
+
+    def __init__(self, workers=INGEST_WORKERS, max_queued=INGEST_QUEUE_MAX,
+                 max_queued_per_owner=INGEST_QUEUE_MAX_PER_USER, retention_seconds=INGEST_JOB_RETENTION_SECONDS,
+                 max_retained=INGEST_JOBS_RETAINED):
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.max_queued_per_owner = max_queued_per_owner
+        self.retention_seconds = retention_seconds
+        self.max_retained = max_retained
+        self._jobs = OrderedDict()  # job id -> Job, in submission order
+        self._queues = OrderedDict()  # owner -> deque of queued jobs; the next owner to serve is first
+        self._queued = 0
+        self._running = 0
+        self._wakeup = None
+        self._tasks = []
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = {SUCCEEDED: 0, FAILED: 0, CANCELLED: 0}
+
+    def start(self):
+        """Start the workers; call from the running event loop (the app lifespan)."""
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.get_running_loop().create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        running = [job._task for job in self._jobs.values() if job.status == RUNNING and job._task is not None]
+        for job in list(self._jobs.values()):
+            if not job.done:
+                self.cancel(job.id)
+        # Let cancelled jobs finish their cleanup before the workers go
+        await asyncio.gather(*running, return_exceptions=True)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, owner, run, cleanup=None, **info):
+        """Queue run(job); cleanup(), if given, is called once the job is finished, whatever the outcome."""
+        self._prune()
+        owner_queue = self._queues.get(owner)
+        if self._queued >= self.max_queued:
+            self.rejected += 1
+            raise QueueFull(f"The ingestion queue is full ({self.max_queued} jobs)")
+        if owner_queue is not None and len(owner_queue) >= self.max_queued_per_owner:
+            self.rejected += 1
+            raise QueueFull(f"Too many uploads waiting (at most {self.max_queued_per_owner} per user)", per_owner=True)
+        job = Job(owner, run, cleanup, **info)
+        self._jobs[job.id] = job
+        self._queues.setdefault(owner, deque()).append(job)
+        self._queued += 1
+        self.submitted += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    def get(self, job_id):
+        self._prune()
+        return self._jobs.get(job_id)
+
+    def position(self, job):
+        """Jobs ahead of a queued job, following the round-robin order; None once it has started."""
+        if job.status != QUEUED:
+            return None
+        queues = [list(q) for q in self._queues.values()]
+        ahead = 0
+        for depth in range(max(map(len, queues), default=0)):
+            for q in queues:
+                if depth < len(q):
+                    if q[depth] is job:
+                        return ahead
+                    ahead += 1
+        return None
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns it, or None if unknown."""
+        job = self._jobs.get(job_id)
+        if job is None or job.done:
+            return job
+        job.cancel_requested = True
+        if job.status == QUEUED:
+            owner_queue = self._queues.get(job.owner)
+            if owner_queue is not None and job in owner_queue:
+                owner_queue.remove(job)
+                self._queued -= 1
+                if not owner_queue:
+                    del self._queues[job.owner]
+            self._finish(job, CANCELLED)
+        elif job._task is not None:
+            job._task.cancel()
+        return job
+
+    def _next(self):
+        if not self._queues:
+            return None
+        owner, owner_queue = next(iter(self._queues.items()))
+        job = owner_queue.popleft()
+        self._queued -= 1
+        if owner_queue:
+            self._queues.move_to_end(owner)
+        else:
+            del self._queues[owner]
+        return job
+
+    async def _worker(self, number):
+        while True:
+            job = self._next()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self._execute(job)
+
+    async def _execute(self, job):
+        job.status = RUNNING
+        job.started_at = time.time()
+        self._running += 1
+        job._task = asyncio.get_running_loop().create_task(job._run(job))
+        try:
+            job.result = await job._task
+            self._finish(job, SUCCEEDED)
+        except asyncio.CancelledError:
+            self._finish(job, CANCELLED)
+            if not job.cancel_requested:
+                raise  # the worker itself is being stopped
+        except JobError as e:
+            job.error = {"status_code": e.status_code, "detail": e.detail}
+            if e.details is not None:
+                job.error["details"] = e.details
+            self._finish(job, FAILED)
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+            job.error = {"status_code": 500, "detail": str(e)}
+            self._finish(job, FAILED)
+        finally:
+            self._running -= 1
+
+    def _finish(self, job, status):
+        job.snapshot()
+        job.report = None
+        job.status = status
+        job.finished_at = time.time()
+        self.completed[status] += 1
+        logger.info(f"Job {job.id} {status} after {job.finished_at - (job.started_at or job.created_at):.2f}s")
+        if job._cleanup is not None:
+            try:
+                job._cleanup()
+            except Exception as e:
+                logger.warning(f"Cleanup of job {job.id} failed: {e}")
+        job._run = job._cleanup = job._task = None
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        finished = [job for job in self._jobs.values() if job.done]
+        excess = len(finished) - self.max_retained
+        for job in finished:
+            if excess > 0 or job.finished_at < cutoff:
+                del self._jobs[job.id]
+                excess -= 1
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queued": self._queued,
+            "running": self._running,
+            "owners_waiting": len(self._queues),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            **self.completed,
+        }
@@ -0,0 +1,97 @@
+import os
+import re
+import time
+import threading
+import logging
+from .metrics import TOKENS
+
+logger = logging.getLogger(__name__)
+
+# "gemini" in production, "fake" for local/offline runs
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-1.5-flash")
+
+
+class GeminiBackend:
+    """Thin wrapper over google-generativeai chat sessions.
+
+    google-generativeai is imported and configured on the first call, as
+    importing it takes about a second of cold start.
+    """
+
+    def __init__(self, model_name=GEMINI_MODEL_NAME, api_key=None):
+        self.name = model_name
+        self.api_key = api_key or os.getenv("GEMINI_API_KEY")
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                import google.generativeai as genai
+                if self.api_key:
+                    genai.configure(api_key=self.api_key)
+                self._model = genai.GenerativeModel(self.name)
+            return self._model
+
+    def generate(self, history, prompt):
+        chat = self.model.start_chat(history=history)
+        response = chat.send_message(prompt)
+        self._log_usage(response)
+        return response.text
+
+    def stream(self, history, prompt):
+        chat = self.model.start_chat(history=history)
+        response = chat.send_message(prompt, stream=True)
+        for chunk in response:
+            text = getattr(chunk, "text", "")
+            if text:
+                yield text
+        self._log_usage(response)
+
+    def _log_usage(self, response):
+        # Billed token counts, to compare against the prompt budget's estimates
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            TOKENS.inc(usage.prompt_token_count or 0, kind="gemini_prompt")
+            TOKENS.inc(usage.candidates_token_count or 0, kind="gemini_answer")
+            logger.info(f"Gemini usage: prompt {usage.prompt_token_count} tokens, "
+                        f"answer {usage.candidates_token_count} tokens, total {usage.total_token_count}")
+
+
+class FakeBackend:
+    """Deterministic offline model: echoes the user query back word by word.
+
+    token_delay simulates generation speed so streaming can be exercised
+    without network access.
+    """
+
+    def __init__(self, token_delay=float(os.getenv("FAKE_LLM_TOKEN_DELAY", 0.0)), reply=None):
+        self.name = "fake"
+        self.token_delay = token_delay
+        self.reply = reply
+
+    def _answer(self, prompt):
+        if self.reply is not None:
+            return self.reply
+        query = prompt.rsplit("User Query:", 1)[-1].strip()
+        return f"(fake answer) You asked: {query}"
+
+    def generate(self, history, prompt):
+        return "".join(self.stream(history, prompt))
+
+    def stream(self, history, prompt):
+        for token in re.findall(r"\S+\s*", self._answer(prompt)):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            yield token
+
+
+def get_backend(name=LLM_BACKEND):
+    if name == "fake":
+        logger.info("Using fake LLM backend")
+        return FakeBackend()
+    if name == "gemini":
+        return GeminiBackend()
+    raise ValueError(f"Unknown LLM backend: {name}")
@@ -14,6 +14,7 @@ import { saveMessages } from '../utils/offlineUtils';
 import { useNotification } from '../contexts/NotificationContext';
 import { UserContext } from '../contexts/UserContext';
 import DocumentUpload from '../components/DocumentUpload';
+import { waitForUpload, uploadErrorMessage } from '../utils/uploadJobs';
 
 const FREE_USER_CONVERSATION_LIMIT = 1;
 const FREE_USER_AI_MESSAGE_LIMIT = 10;
@@ -431,6 +432,7 @@ const Chat = () => {
       const response = await fetch('http://localhost:8000/upload', {
         method: 'POST',
         body: formData,
+        credentials: 'include', // session affinity cookie: status polls must reach the same instance
       });
       let data;
       try {
@@ -443,12 +445,14 @@ const Chat = () => {
       }
       if (!response.ok) {
         // Show backend error if present
-        const errorMsg = data && data.error ? data.error : 'Upload failed.';
+        const errorMsg = uploadErrorMessage(data, 'Upload failed.');
         setUploadError(errorMsg);
         setUploadedDoc(null);
         showError(errorMsg);
         return;
       }
+      // The document is ingested in the background; wait for the job to finish
+      data = await waitForUpload('http://localhost:8000', data);
       // Success if at least one chunk was stored
       if ((data.stored && data.stored > 0) || (data.chunks && data.chunks > 0)) {
         setDocText(data.text);
@@ -472,8 +476,12 @@ const Chat = () => {
         showError('Upload failed: No document chunks stored.');
       }
     } catch (err) {
-      setUploadError(err.message);
       setUploadedDoc(null);
+      if (err.pending) {
+        showInfo(err.message);
+        return;
+      }
+      setUploadError(err.message);
       showError(err.message);
     } finally {
       setUploadingDoc(false);
@@ -0,0 +1,85 @@
+import os
+import json
+import base64
+import hashlib
+import binascii
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+from .responses import FastJSONResponse
+
+# Page sizes for the list endpoints (override via environment)
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", 50))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 200))
+
+# Keyset columns; always selected so every page can produce the next cursor
+CURSOR_FIELDS = ("created_at", "id")
+
+
+def page_size(limit):
+    if limit is None:
+        return PAGE_SIZE
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def select_fields(fields, allowed):
+    """PostgREST select list for a comma-separated fields= parameter (all allowed columns if omitted)."""
+    if not fields:
+        return ", ".join(allowed)
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}")
+    columns = list(CURSOR_FIELDS) + [f for f in requested if f not in CURSOR_FIELDS]
+    return ", ".join(columns)
+
+
+def encode_cursor(row):
+    raw = json.dumps([row["created_at"], str(row["id"])], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        if not all(isinstance(v, str) and '"' not in v and "\\" not in v for v in (created_at, row_id)):
+            raise ValueError(cursor)
+        return created_at, row_id
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_page(query, cursor, limit, descending=False):
+    """Order query by (created_at, id) and continue strictly past cursor; fetches one extra row to detect a next page."""
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        op = "lt" if descending else "gt"
+        # Quoted, since timestamps contain characters PostgREST treats as syntax in or=()
+        query = query.or_(f'created_at.{op}."{created_at}",and(created_at.eq."{created_at}",id.{op}."{row_id}")')
+    return query.order("created_at", desc=descending).order("id", desc=descending).limit(limit + 1)
+
+
+def split_page(rows, limit):
+    """(page rows, cursor for the next page or None) from a keyset_page result."""
+    rows = rows or []
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1])
+
+
+def etag_response(request: Request, content, headers=None):
+    """FastJSONResponse with a content-hash ETag, or an empty 304 if the client already has this exact body."""
+    response = FastJSONResponse(content=content, headers=headers)
+    etag = '"' + hashlib.blake2b(response.body, digest_size=16).hexdigest() + '"'
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in candidates or "*" in candidates:
+            not_modified = {k: v for k, v in response.headers.items() if k.lower() not in ("content-length", "content-type")}
+            return Response(status_code=304, headers=not_modified)
+    return response
@@ -1,39 +1,203 @@
-import fitz  # PyMuPDF
-from docx import Document as DocxDocument
-from pptx import Presentation
-from PIL import Image
-import pytesseract
+# fitz (PyMuPDF), python-docx, python-pptx, PIL and pytesseract are imported by the
+# functions that use them, so importing this module (and starting the app) stays cheap
+import io
 import os
+import mmap
+import time
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeout
 
-def parse_pdf(file_path):
-    doc = fitz.open(file_path)
-    return "\n".join([page.get_text() for page in doc])
+# Parsing limits (override via environment)
+PARSE_TIMEOUT_SECONDS = float(os.getenv("PARSE_TIMEOUT_SECONDS", 120))
+PARSE_MAX_PAGES = int(os.getenv("PARSE_MAX_PAGES", 1000))
+PARSE_PAGES_PER_TASK = int(os.getenv("PARSE_PAGES_PER_TASK", 16))
+OCR_DPI = int(os.getenv("OCR_DPI", 200))
+OCR_ENABLED = os.getenv("OCR_ENABLED", "true").lower() == "true"
 
-def parse_docx(file_path):
-    doc = DocxDocument(file_path)
-    return "\n".join([para.text for para in doc.paragraphs])
 
-def parse_pptx(file_path):
-    prs = Presentation(file_path)
-    text = ""
-    for slide in prs.slides:
-        for shape in slide.shapes:
-            if hasattr(shape, "text"):
-                text += shape.text + "\n"
+class ParseError(Exception):
+    pass
+
+
+class DocumentTooLarge(ParseError):
+    pass
+
+
+class ParseTimeout(ParseError):
+    pass
+
+
+def _is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+
+def _as_buffer(source):
+    # fitz and BytesIO take bytes-like objects; a memoryview over an mmap avoids copying it
+    if isinstance(source, mmap.mmap):
+        return memoryview(source)
+    return source
+
+
+def _open_pdf(source):
+    import fitz  # PyMuPDF
+    if _is_path(source):
+        return fitz.open(source)
+    return fitz.open(stream=_as_buffer(source), filetype="pdf")
+
+
+def _as_file(source):
+    """Path, or a file-like view for parsers (python-docx, python-pptx, PIL) that need one."""
+    if _is_path(source):
+        return source
+    return io.BytesIO(_as_buffer(source))
+
+
+def _ocr_pdf_page(page, dpi=OCR_DPI):
+    from PIL import Image
+    import pytesseract
+    pix = page.get_pixmap(dpi=dpi)
+    image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    return pytesseract.image_to_string(image)
+
+
+def _pdf_page_text(page, ocr=OCR_ENABLED):
+    text = page.get_text()
+    # Only scanned pages (no text layer, but images) go through OCR
+    if ocr and not text.strip() and page.get_images():
+        text = _ocr_pdf_page(page)
     return text
 
-def parse_image(file_path):
-    image = Image.open(file_path)
+
+def _parse_pdf_range(file_path, start, stop, ocr=OCR_ENABLED):
+    # Runs in a worker process: each task opens its own handle to the document
+    doc = _open_pdf(file_path)
+    try:
+        return start, [_pdf_page_text(doc[i], ocr) for i in range(start, stop)]
+    finally:
+        doc.close()
+
+
+def _check_page_count(count, max_pages):
+    if max_pages and count > max_pages:
+        raise DocumentTooLarge(f"Document has {count} pages, the limit is {max_pages}")
+
+
+def iter_pdf_pages(source, executor=None, timeout=PARSE_TIMEOUT_SECONDS, max_pages=PARSE_MAX_PAGES):
+    """Yield page texts in order, OCRing pages that have no text layer.
+
+    source is a file path or an in-memory buffer (bytes, memoryview, mmap).
+    With an executor (a process pool) and a path, page ranges of
+    PARSE_PAGES_PER_TASK are parsed in parallel, keeping a bounded window
+    of ranges in flight, and still yielded in page order. Buffers are
+    parsed in-process so they are never pickled to workers.
+    """
+    deadline = time.monotonic() + timeout
+    doc = _open_pdf(source)
+    try:
+        page_count = doc.page_count
+        _check_page_count(page_count, max_pages)
+        if executor is None or not _is_path(source) or page_count <= PARSE_PAGES_PER_TASK:
+            for number, page in enumerate(doc):
+                if time.monotonic() > deadline:
+                    raise ParseTimeout(f"Parsing exceeded {timeout:.0f}s after {number} of {page_count} pages")
+                yield _pdf_page_text(page)
+            return
+    finally:
+        doc.close()
+
+    starts = list(range(0, page_count, PARSE_PAGES_PER_TASK))
+    window = max(2, 2 * getattr(executor, "size", 2))
+    in_flight = deque()
+    try:
+        for start in starts:
+            in_flight.append(executor.submit(_parse_pdf_range, source, start, min(start + PARSE_PAGES_PER_TASK, page_count)))
+            if len(in_flight) < window:
+                continue
+            yield from _next_range(in_flight, deadline, timeout)
+        while in_flight:
+            yield from _next_range(in_flight, deadline, timeout)
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def _next_range(in_flight, deadline, timeout):
+    future = in_flight.popleft()
+    try:
+        _, texts = future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FutureTimeout:
+        raise ParseTimeout(f"Parsing exceeded {timeout:.0f}s")
+    return texts
+
+
+def parse_pdf(source, executor=None, timeout=PARSE_TIMEOUT_SECONDS, max_pages=PARSE_MAX_PAGES):
+    return "\n".join(iter_pdf_pages(source, executor=executor, timeout=timeout, max_pages=max_pages))
+
+
+def iter_docx_paragraphs(source):
+    from docx import Document as DocxDocument
+    doc = DocxDocument(_as_file(source))
+    for para in doc.paragraphs:
+        yield para.text
+
+
+def parse_docx(source):
+    return "\n".join(iter_docx_paragraphs(source))
+
+
+def iter_pptx_slides(source, max_pages=PARSE_MAX_PAGES):
+    from pptx import Presentation
+    prs = Presentation(_as_file(source))
+    _check_page_count(len(prs.slides), max_pages)
+    for slide in prs.slides:
+        texts = [shape.text for shape in slide.shapes if hasattr(shape, "text")]
+        if texts:
+            yield "\n".join(texts)
+
+
+def parse_pptx(source, max_pages=PARSE_MAX_PAGES):
+    text = "\n".join(iter_pptx_slides(source, max_pages=max_pages))
+    return text + "\n" if text else ""
+
+
+def parse_image(source):
+    from PIL import Image
+    import pytesseract
+    image = Image.open(_as_file(source))
     return pytesseract.image_to_string(image)
 
-def parse_file(file_path, ext):
+
+def _iter_image(source):
+    yield parse_image(source)
+
+
+def iter_pages(source, ext, executor=None, timeout=PARSE_TIMEOUT_SECONDS, max_pages=PARSE_MAX_PAGES):
+    """Yield a document's text incrementally (PDF pages, DOCX paragraphs, PPTX slides).
+
+    source is a file path or an in-memory buffer (bytes, memoryview, mmap).
+
+    Joining the yielded parts with newlines gives the text parse_file returns.
+    """
+    if ext == ".pdf":
+        return iter_pdf_pages(source, executor=executor, timeout=timeout, max_pages=max_pages)
+    elif ext == ".docx":
+        return iter_docx_paragraphs(source)
+    elif ext == ".pptx":
+        return iter_pptx_slides(source, max_pages=max_pages)
+    elif ext in [".jpeg", ".jpg", ".png"]:
+        return _iter_image(source)
+    else:
+        raise ValueError(f"Unsupported file type: {ext}")
+
+
+def parse_file(source, ext, executor=None, timeout=PARSE_TIMEOUT_SECONDS, max_pages=PARSE_MAX_PAGES):
     if ext == ".pdf":
-        return parse_pdf(file_path)
+        return parse_pdf(source, executor=executor, timeout=timeout, max_pages=max_pages)
     elif ext == ".docx":
-        return parse_docx(file_path)
+        return parse_docx(source)
     elif ext == ".pptx":
-        return parse_pptx(file_path)
+        return parse_pptx(source, max_pages=max_pages)
     elif ext in [".jpeg", ".jpg", ".png"]:
-        return parse_image(file_path)
+        return parse_image(source)
     else:
         raise ValueError(f"Unsupported file type: {ext}")
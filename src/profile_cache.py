@@ -0,0 +1,124 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Cache sizing (override via environment)
+USER_PROFILE_CACHE_TTL_SECONDS = float(os.getenv("USER_PROFILE_CACHE_TTL_SECONDS", 30))
+USER_PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("USER_PROFILE_CACHE_MAX_ENTRIES", 10000))
+
+PROFILE_COLUMNS = "membership_status, conversation_count, message_count"
+
+
+class UserProfileCache:
+    """In-process LRU of users rows (membership_status and counters) keyed by user_id.
+
+    Entries expire ttl_seconds after they were last written. Counter updates
+    write the authoritative row returned by the database through apply(),
+    so the counters are usually exact; membership changes made outside
+    this process only show up once the entry expires or is invalidated.
+    apply() also notices when a cached row had drifted from the database
+    and counts it in stats() as stale_detected.
+    """
+
+    def __init__(self, ttl_seconds=USER_PROFILE_CACHE_TTL_SECONDS, max_entries=USER_PROFILE_CACHE_MAX_ENTRIES, clock=time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()  # user_id -> (profile, stored_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.updates = 0
+        self.stale_detected = 0
+        self._served_age_total = 0.0
+        self._served_age_max = 0.0
+
+    def get(self, user_id):
+        key = str(user_id)
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            profile, stored_at = entry
+            age = self._clock() - stored_at
+            self._served_age_total += age
+            self._served_age_max = max(self._served_age_max, age)
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(profile)
+
+    def put(self, user_id, profile):
+        """Cache a row read from the database, unless a fresher write already landed."""
+        key = str(user_id)
+        with self._lock:
+            if self._live(key) is None:
+                self._store(key, profile)
+
+    def apply(self, user_id, row, conversations=0, messages=0):
+        """Store the row a counter update returned; the deltas are what that update applied."""
+        key = str(user_id)
+        with self._lock:
+            entry = self._live(key)
+            profile = dict(entry[0]) if entry else {}
+            if entry and any(
+                column in row and (profile.get(column) or 0) + delta != row[column]
+                for column, delta in (("conversation_count", conversations), ("message_count", messages))
+            ):
+                self.stale_detected += 1
+            profile.update(row)
+            if "membership_status" not in profile:
+                # Counters alone are not a usable profile
+                self._entries.pop(key, None)
+                return
+            self.updates += 1
+            self._store(key, profile)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._entries.pop(str(user_id), None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _live(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and self._clock() - entry[1] > self.ttl_seconds:
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        return entry
+
+    def _store(self, key, profile):
+        self._entries[key] = (dict(profile), self._clock())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "updates": self.updates,
+                "stale_detected": self.stale_detected,
+                "avg_served_age_seconds": self._served_age_total / self.hits if self.hits else 0.0,
+                "max_served_age_seconds": self._served_age_max,
+            }
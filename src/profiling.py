@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+import uuid
+import random
+import threading
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Opt-in request profiling (override via environment). When enabled, a request is
+# profiled if it sends "X-Profile: 1" or, at random, for PROFILE_SAMPLE_RATE of requests
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0.0))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+
+def should_profile(request):
+    if not PROFILE_ENABLED:
+        return False
+    if request.headers.get("x-profile") == "1":
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads every interval_ms while running.
+
+    The result is in the collapsed ("folded") stack format, one
+    "thread;outer;...;inner count" line per distinct stack, which
+    flamegraph.pl and speedscope render directly. Requests share the event
+    loop and worker threads, so a profile also shows whatever else ran
+    during the request; it covers the handler until the response starts,
+    not the body of a streaming response.
+    """
+
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.samples = Counter()
+        self.started_at = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._stop.is_set():
+            return self
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def write(self, label, directory=PROFILE_DIR):
+        """Save the folded stacks under directory; returns the file path."""
+        os.makedirs(directory, exist_ok=True)
+        safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in label).strip("_")[:80]
+        path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:12]}-{safe}.folded")
+        with open(path, "w") as f:
+            f.write(self.folded())
+        logger.info(f"Profile of {label} ({self.duration * 1000:.0f}ms, {sum(self.samples.values())} samples) written to {path}")
+        return path
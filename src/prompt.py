@@ -0,0 +1,165 @@
+import os
+import re
+import math
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Prompt token budget (override via environment). Counts are estimates at
+# PROMPT_CHARS_PER_TOKEN characters per token, Google's rule of thumb for Gemini
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 8000))
+PROMPT_RAG_MAX_TOKENS = int(os.getenv("PROMPT_RAG_MAX_TOKENS", 2500))
+PROMPT_SUMMARY_MAX_TOKENS = int(os.getenv("PROMPT_SUMMARY_MAX_TOKENS", 300))
+PROMPT_MAX_TURNS = int(os.getenv("PROMPT_MAX_TURNS", 20))
+PROMPT_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", 4))
+
+# Per-message framing Gemini adds around each history turn
+_TURN_OVERHEAD_TOKENS = 4
+RAG_SEPARATOR = "\n---\n"
+_WHITESPACE_RE = re.compile(r"\s+")
+_FIRST_SENTENCE_RE = re.compile(r"^(.+?[.!?])(\s|$)", re.S)
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / PROMPT_CHARS_PER_TOKEN) if text else 0
+
+
+def truncate_to_tokens(text, tokens):
+    """Cut text to about tokens tokens, at a word boundary where there is one."""
+    limit = int(tokens * PROMPT_CHARS_PER_TOKEN)
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > limit // 2 else cut).rstrip() + " …"
+
+
+def _normalized(text):
+    return _WHITESPACE_RE.sub(" ", text).strip().lower()
+
+
+class PromptPlan:
+    def __init__(self, history, prompt, rag_context, stats, summary=""):
+        self.history = history  # Gemini chat history: [{"role": ..., "parts": [...]}]
+        self.summary = summary  # the dropped turns, as summarized in the prompt
+        self.prompt = prompt
+        self.rag_context = rag_context  # the context actually sent, after dedupe and capping
+        self.stats = stats
+
+
+class PromptBudget:
+    """Assembles the Gemini chat history and prompt within a token budget.
+
+    The system prompt and the user's question are always sent. RAG chunks
+    are deduplicated (repeats, ignoring whitespace and case, and chunks
+    contained in one already kept) and kept in relevance order up to
+    rag_max_tokens. The remaining budget goes to the most recent turns,
+    newest first, capped at max_turns; older turns are dropped and replaced
+    by a short extractive summary (the first sentence of each dropped
+    question) of at most summary_max_tokens.
+    """
+
+    def __init__(self, system_prompt, budget=PROMPT_TOKEN_BUDGET, rag_max_tokens=PROMPT_RAG_MAX_TOKENS,
+                 summary_max_tokens=PROMPT_SUMMARY_MAX_TOKENS, max_turns=PROMPT_MAX_TURNS):
+        self.system_prompt = system_prompt
+        self.budget = budget
+        self.rag_max_tokens = rag_max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.max_turns = max_turns
+
+    def select_rag(self, chunks, max_tokens):
+        """Deduplicated chunks, in the given (relevance) order, within max_tokens."""
+        kept, seen, used, duplicates = [], [], 0, 0
+        for chunk in chunks:
+            chunk = chunk.strip()
+            normalized = _normalized(chunk)
+            if not normalized or any(normalized in other for other in seen):
+                duplicates += 1
+                continue
+            tokens = estimate_tokens(chunk)
+            if used + tokens > max_tokens:
+                if not kept and max_tokens > 0:
+                    # Better part of the most relevant chunk than no context at all
+                    chunk = truncate_to_tokens(chunk, max_tokens)
+                    kept.append(chunk)
+                    used = estimate_tokens(chunk)
+                break
+            kept.append(chunk)
+            seen.append(normalized)
+            used += tokens
+        return kept, used, duplicates
+
+    def build(self, messages, rag_chunks=()):
+        """messages: the request's messages, oldest first, the last one being the question."""
+        question = messages[-1]["content"]
+        system_tokens = estimate_tokens(self.system_prompt)
+        question_tokens = estimate_tokens(question) + estimate_tokens("\nUser Query: ")
+        remaining = max(0, self.budget - system_tokens - question_tokens)
+
+        rag, rag_tokens, duplicates = self.select_rag(rag_chunks, min(self.rag_max_tokens, remaining))
+        rag_context = RAG_SEPARATOR.join(rag)
+        remaining -= rag_tokens
+
+        turns = [m for m in messages[:-1] if m["sender"] in ("user", "ai")]
+        # Reserve room for the summary only if older turns will actually be dropped
+        history_tokens = sum(estimate_tokens(m["content"]) + _TURN_OVERHEAD_TOKENS for m in turns)
+        summary_tokens = 0
+        if len(turns) > self.max_turns or history_tokens > remaining:
+            summary_tokens = min(self.summary_max_tokens, remaining // 4)
+            remaining -= summary_tokens
+        kept, used = [], 0
+        for message in reversed(turns[-self.max_turns:] if self.max_turns else []):
+            tokens = estimate_tokens(message["content"]) + _TURN_OVERHEAD_TOKENS
+            if used + tokens > remaining:
+                break
+            kept.append(message)
+            used += tokens
+        kept.reverse()
+        # Gemini expects the history to open with a user turn
+        while kept and kept[0]["sender"] != "user":
+            used -= estimate_tokens(kept[0]["content"]) + _TURN_OVERHEAD_TOKENS
+            kept.pop(0)
+        dropped = turns[:len(turns) - len(kept)]
+
+        summary = self.summarize(dropped, summary_tokens)
+        history = [{"role": "user" if m["sender"] == "user" else "model", "parts": [m["content"]]} for m in kept]
+
+        prompt = self.system_prompt
+        if summary:
+            prompt += f"\nEarlier in this conversation the user asked: {summary}\n"
+        if rag_context:
+            prompt += f"\nRelevant Document Context:\n{rag_context}\n"
+        prompt += "\nUser Query: " + question
+
+        stats = {
+            "budget": self.budget,
+            "total": estimate_tokens(prompt) + used,
+            "system": system_tokens,
+            "question": question_tokens,
+            "history": used,
+            "turns_kept": len(kept),
+            "turns_dropped": len(dropped),
+            "summary": estimate_tokens(summary),
+            "rag": rag_tokens,
+            "rag_chunks": len(rag),
+            "rag_duplicates": duplicates,
+        }
+        return PromptPlan(history, prompt, rag_context, stats, summary)
+
+    def summarize(self, dropped, max_tokens):
+        """First sentence of each dropped user turn, the most recent ones when over max_tokens."""
+        questions = []
+        for message in dropped:
+            if message["sender"] != "user":
+                continue
+            text = _WHITESPACE_RE.sub(" ", message["content"]).strip()
+            match = _FIRST_SENTENCE_RE.match(text)
+            questions.append(truncate_to_tokens(match.group(1) if match else text, 40))
+        parts, used = [], 0
+        for question in reversed(questions):
+            tokens = estimate_tokens(question) + 1
+            if used + tokens > max_tokens:
+                break
+            parts.append(question)
+            used += tokens
+        return "; ".join(reversed(parts))
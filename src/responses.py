@@ -0,0 +1,152 @@
+import os
+import gzip
+import json
+import uuid
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+import numpy as np
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from .concurrency import run_io
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json is used when it is not installed
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip is offered when it is not installed
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Response compression settings (override via environment)
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", 1024))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 5))
+# Bodies above this are compressed on a worker thread instead of the event loop
+COMPRESSION_OFFLOAD_BYTES = int(os.getenv("COMPRESSION_OFFLOAD_BYTES", 256 * 1024))
+
+# SSE must reach the client token by token, so it is never compressed
+_COMPRESSIBLE_TYPES = ("application/json", "text/plain", "text/html", "text/css", "application/javascript")
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content):
+    """Encode content to JSON bytes in one pass; UUIDs, datetimes and numpy values are handled natively."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with dumps(), so payloads need no pre-serialization round trip."""
+
+    def render(self, content):
+        return dumps(content)
+
+
+def negotiate_encoding(accept_encoding):
+    """Best supported content coding the client accepts: "br", "gzip" or None."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    wildcard = accepted.get("*", 0.0)
+    for coding in (("br", "gzip") if brotli is not None else ("gzip",)):
+        if accepted.get(coding, wildcard) > 0:
+            return coding
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """Compresses complete (non-streaming) responses of at least minimum_size bytes.
+
+    Prefers brotli when the optional brotli package is installed and the
+    client accepts it, then gzip. Streaming bodies, such as the /ask/stream
+    Server-Sent Events, pass through untouched so tokens are not buffered.
+    A strong ETag becomes weak on a compressed response, as the bytes now
+    depend on the encoding; pagination.etag_response compares weakly.
+    """
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start = message  # held until the first body message shows whether to compress
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            content_type = headers.get("content-type", "").split(";")[0].strip()
+            if (message.get("more_body", False) or len(body) < self.minimum_size or "content-encoding" in headers
+                    or content_type not in _COMPRESSIBLE_TYPES):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+            if len(body) >= COMPRESSION_OFFLOAD_BYTES:
+                compressed = await run_io(compress, body, encoding)
+            else:
+                compressed = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = "W/" + etag
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
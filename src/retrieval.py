@@ -0,0 +1,111 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Retrieval settings (override via environment)
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", 3))
+RAG_SCORE_THRESHOLD = float(os.getenv("RAG_SCORE_THRESHOLD")) if os.getenv("RAG_SCORE_THRESHOLD") else None
+
+
+def parse_embedding(embedding):
+    """Decode an embedding coming back from Supabase (list or JSON string)."""
+    if isinstance(embedding, list):
+        return embedding
+    if isinstance(embedding, str):
+        try:
+            return json.loads(embedding)
+        except json.JSONDecodeError:
+            logger.warning(f"Failed to parse embedding string: {embedding[:50]}")
+            return []
+    return []
+
+
+def texts_fingerprint(texts):
+    """Order-independent hash of a multiset of chunk texts.
+
+    The same documents chunked the same way fingerprint the same in every
+    conversation, whatever order their rows come back in.
+    """
+    total, count = 0, 0
+    for text in texts:
+        total = (total + int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")) % 2 ** 64
+        count += 1
+    return f"{count}-{total:016x}"
+
+
+def normalize_rows(matrix):
+    """Return a float32 copy of matrix with every row scaled to unit length (zero rows stay zero)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class EmbeddingIndex:
+    """Exact cosine top-k over a pre-normalized float32 embedding matrix."""
+
+    def __init__(self, texts, embeddings):
+        self.texts = list(texts)
+        self._fingerprint = None
+        if len(self.texts):
+            self.matrix = normalize_rows(embeddings)
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+        if self.matrix.shape[0] != len(self.texts):
+            raise ValueError("texts and embeddings must have the same length")
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build an index from document_contexts rows ({"content", "embedding"})."""
+        texts = []
+        vectors = []
+        dim = None
+        for row in rows or []:
+            vector = parse_embedding(row.get("embedding"))
+            if not vector:
+                continue
+            if dim is None:
+                dim = len(vector)
+            elif len(vector) != dim:
+                logger.warning(f"Skipping embedding with dimension {len(vector)} (expected {dim})")
+                continue
+            texts.append(row.get("content", ""))
+            vectors.append(vector)
+        return cls(texts, vectors)
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + sum(len(t) for t in self.texts)
+
+    @property
+    def fingerprint(self):
+        """texts_fingerprint of the indexed chunks (the index is immutable, so computed once)."""
+        if self._fingerprint is None:
+            self._fingerprint = texts_fingerprint(self.texts)
+        return self._fingerprint
+
+    def search(self, query_embedding, k=RAG_TOP_K, threshold=RAG_SCORE_THRESHOLD):
+        """Return up to k (score, text) pairs, best first, optionally dropping scores below threshold."""
+        if not len(self) or k <= 0:
+            return []
+        query = normalize_rows(query_embedding)[0]
+        if query.shape[0] != self.matrix.shape[1]:
+            raise ValueError(f"Query dimension {query.shape[0]} does not match index dimension {self.matrix.shape[1]}")
+        scores = self.matrix @ query
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        if threshold is not None:
+            top = top[scores[top] >= threshold]
+        return [(float(scores[i]), self.texts[i]) for i in top]
@@ -0,0 +1,137 @@
+import os
+import heapq
+import logging
+import numpy as np
+from .retrieval import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+# Chunk selection defaults (override via environment; /upload can override per request)
+MAX_CHUNKS = int(os.getenv("UPLOAD_MAX_CHUNKS", 10))
+SIM_THRESHOLD = float(os.getenv("UPLOAD_SIM_THRESHOLD", 0.85))
+MIN_CHUNK_LENGTH = 50
+
+
+class ChunkSelector:
+    """Streaming near-duplicate filter and length-based chunk selection.
+
+    Embeddings are normalized once per batch and compared as matrix
+    products: each batch against the already kept chunks in one block,
+    then within itself.
+
+    With max_chunks > 0 it retains the max_chunks longest distinct chunks
+    seen so far (memory is O(max_chunks)) and releases them from finish(),
+    longest first. This is the legacy length-ordered greedy pass (longest
+    first, the later chunk first among equal lengths, skip near-duplicates
+    of a kept chunk, stop at max_chunks) computed as a stream, and it gives
+    the same selection whenever near-duplicates form groups. It differs
+    only for chains, where A~B and B~C but not A~C: a chunk dropped for a
+    longer near-duplicate is not reconsidered when that one is displaced in
+    turn. For example C (60 chars), B (70) and A (80) arriving in that
+    order keep only A, where the legacy pass keeps A and C.
+
+    With max_chunks == 0 every distinct chunk is released from offer() as
+    soon as it arrives, in document order, so it can be stored while later
+    pages are still parsing; of near-duplicates the first one wins.
+    """
+
+    def __init__(self, max_chunks=MAX_CHUNKS, sim_threshold=SIM_THRESHOLD, min_length=MIN_CHUNK_LENGTH):
+        self.max_chunks = max_chunks
+        self.sim_threshold = sim_threshold
+        self.min_length = min_length
+        self._heap = []  # (length, seq, slot, chunk, embedding)
+        self._units = None  # capped: one row per heap slot; uncapped: every released chunk
+        self._free_slots = []
+        self._accepted_count = 0
+        self._seq = 0
+        self.duplicates = 0
+
+    @property
+    def nbytes(self):
+        units = self._units.nbytes if self._units is not None else 0
+        if self.max_chunks:
+            return units + sum(len(item[3]) + item[4].nbytes for item in self._heap)
+        return units
+
+    def offer(self, chunks, embeddings):
+        """Consider a batch of chunks; returns the (chunk, float32 embedding row) pairs ready to store now."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        keep = [i for i, chunk in enumerate(chunks) if len(chunk.strip()) > self.min_length]
+        if not keep:
+            return []
+        chunks = [chunks[i] for i in keep]
+        embeddings = embeddings[keep]
+        units = normalize_rows(embeddings)
+        if self._units is None:
+            rows = self.max_chunks or 1024
+            self._units = np.zeros((rows, units.shape[1]), dtype=np.float32)
+            self._free_slots = list(range(self.max_chunks - 1, -1, -1))
+        if self.max_chunks:
+            self._offer_capped(chunks, embeddings, units)
+            return []
+        return self._offer_uncapped(chunks, embeddings, units)
+
+    def _offer_uncapped(self, chunks, embeddings, units):
+        count = self._accepted_count
+        if count:
+            prior = (units @ self._units[:count].T).max(axis=1) > self.sim_threshold
+        else:
+            prior = np.zeros(len(units), bool)
+        # Within the batch, a chunk is a duplicate of an earlier one in the same batch that was kept
+        within = units @ units.T > self.sim_threshold
+        kept = []
+        for i in range(len(chunks)):
+            if prior[i] or (kept and within[i, kept].any()):
+                self.duplicates += 1
+                continue
+            kept.append(i)
+        if not kept:
+            return []
+        self._append_units(units[kept])
+        return [(chunks[i], embeddings[i]) for i in kept]
+
+    def _append_units(self, units):
+        needed = self._accepted_count + len(units)
+        if needed > len(self._units):
+            grown = np.zeros((max(needed, 2 * len(self._units)), self._units.shape[1]), dtype=np.float32)
+            grown[:self._accepted_count] = self._units[:self._accepted_count]
+            self._units = grown
+        self._units[self._accepted_count:needed] = units
+        self._accepted_count = needed
+
+    def _offer_capped(self, chunks, embeddings, units):
+        # One block product gives every candidate's similarity to every slot;
+        # rows of slots refilled during this batch are patched in below
+        sims = units @ self._units.T
+        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+            self._seq += 1
+            length = len(chunk)
+            full = len(self._heap) == self.max_chunks
+            # Shorter than everything in a full heap: either a near-duplicate of a longer entry or the one
+            # to evict. An equal length still counts, as the later chunk wins ties
+            if full and length < self._heap[0][0]:
+                continue
+            occupied = {item[2]: item for item in self._heap}
+            row = sims[i]
+            duplicates = [slot for slot in occupied if row[slot] > self.sim_threshold]
+            if duplicates:
+                self.duplicates += 1
+                # Only a strictly longer near-duplicate beats this chunk; on equal length the later one wins
+                if any(occupied[slot][0] > length for slot in duplicates):
+                    continue
+                self._heap = [item for item in self._heap if item[2] not in duplicates]
+                heapq.heapify(self._heap)
+                self._free_slots.extend(duplicates)
+            if len(self._heap) == self.max_chunks:
+                evicted = heapq.heappop(self._heap)
+                self._free_slots.append(evicted[2])
+            slot = self._free_slots.pop()
+            self._units[slot] = units[i]
+            sims[i + 1:, slot] = units[i + 1:] @ units[i]
+            heapq.heappush(self._heap, (length, self._seq, slot, chunk, embedding))
+
+    def finish(self):
+        """Return the retained chunks (capped mode), longest first."""
+        selected = sorted(self._heap, key=lambda item: (item[0], item[1]), reverse=True)
+        self._heap = []
+        return [(chunk, embedding) for _, _, _, chunk, embedding in selected]
@@ -0,0 +1,97 @@
+import io
+import os
+import hashlib
+import logging
+import tempfile
+from .concurrency import run_io
+
+logger = logging.getLogger(__name__)
+
+# Uploads up to this size are parsed straight from memory (override via environment)
+UPLOAD_SPOOL_MAX_BYTES = int(os.getenv("UPLOAD_SPOOL_MAX_BYTES", 4 * 1024 * 1024))
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR") or None
+UPLOAD_READ_CHUNK_BYTES = 1024 * 1024
+
+
+class StagedUpload:
+    """Holds one request's upload either in memory or in its own temp file.
+
+    Files up to spool_max_bytes stay in a BytesIO and are exposed as a
+    memoryview, so parsers read them without touching disk. Larger files
+    roll over to a uniquely named temp file (the parse process pool needs a
+    path), which is removed when the context exits, whatever happened. The
+    SHA-256 of the bytes is computed while copying (see doc_cache).
+
+        async with StagedUpload(file.filename) as staged:
+            await staged.receive(file)
+            parse_file(staged.source, staged.ext)
+    """
+
+    def __init__(self, filename, spool_max_bytes=UPLOAD_SPOOL_MAX_BYTES, tmp_dir=UPLOAD_TMP_DIR):
+        self.filename = filename
+        self.ext = os.path.splitext(filename or "")[1].lower()
+        self.spool_max_bytes = spool_max_bytes
+        self.tmp_dir = tmp_dir
+        self.size = 0
+        self.sha256 = None
+        self.path = None
+        self._memory = io.BytesIO()
+        self._file = None
+
+    @property
+    def in_memory(self):
+        return self.path is None
+
+    @property
+    def source(self):
+        """What to hand to the parsers: a memoryview for spooled uploads, else the temp file path."""
+        if self.in_memory:
+            return self._memory.getbuffer()
+        return self.path
+
+    async def receive(self, upload):
+        """Copy a FastAPI UploadFile in, rolling over to disk past the spool threshold."""
+        await run_io(self._copy, upload.file)
+        return self
+
+    def _copy(self, stream):
+        digest = hashlib.sha256()
+        while True:
+            block = stream.read(UPLOAD_READ_CHUNK_BYTES)
+            if not block:
+                break
+            digest.update(block)
+            self.size += len(block)
+            if self._file is None and self.size > self.spool_max_bytes:
+                self._rollover()
+            (self._file or self._memory).write(block)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.sha256 = digest.hexdigest()
+
+    def _rollover(self):
+        fd, self.path = tempfile.mkstemp(prefix="upload_", suffix=self.ext, dir=self.tmp_dir)
+        self._file = os.fdopen(fd, "wb")
+        self._file.write(self._memory.getbuffer())
+        self._memory = io.BytesIO()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not remove staged upload {self.path}: {e}")
+            self.path = None
+        self._memory = io.BytesIO()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,134 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Embedding model settings (override via environment)
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+# Directory of pre-serialized models (model.save() output, one subdirectory per model name);
+# a model found there loads from local disk without resolving it on the Hugging Face hub
+EMBEDDING_MODEL_CACHE_DIR = os.getenv("EMBEDDING_MODEL_CACHE_DIR") or None
+# Load and warm the model in the background at startup instead of on the first request
+MODEL_WARMUP_ENABLED = os.getenv("MODEL_WARMUP_ENABLED", "true").lower() == "true"
+
+
+class LazyModel:
+    """SentenceTransformer that is imported and loaded on first use.
+
+    Importing sentence_transformers (and torch) alone takes seconds, so the
+    app holds this stand-in and calls warm() in the background at startup;
+    encode() from a request that arrives earlier blocks until the load
+    finishes. With cache_dir set, the model is loaded from
+    cache_dir/<name> when a serialized copy is there, and saved there after
+    a download otherwise, so later cold starts read it from local disk.
+    prepare, if given, transforms the loaded model (e.g. quantizes it)
+    before first use; the cached copy stays the original.
+    """
+
+    def __init__(self, name=EMBEDDING_MODEL_NAME, cache_dir=EMBEDDING_MODEL_CACHE_DIR, prepare=None):
+        self.name = name
+        self.cache_dir = cache_dir
+        self.prepare = prepare
+        self._model = None
+        self._lock = threading.Lock()
+        self.source = None
+        self.error = None
+        self.load_seconds = None
+        self.warm_seconds = None
+
+    @property
+    def local_path(self):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, self.name.replace("/", "__"))
+
+    @property
+    def ready(self):
+        return self._model is not None
+
+    def load(self):
+        if self._model is not None:
+            return self._model
+        with self._lock:
+            if self._model is None:
+                start = time.perf_counter()
+                try:
+                    model = self._load()
+                    self._model = self.prepare(model) if self.prepare else model
+                except Exception as e:
+                    self.error = f"{type(e).__name__}: {e}"
+                    raise
+                self.error = None
+                self.load_seconds = time.perf_counter() - start
+                logger.info(f"Loaded embedding model {self.name} from {self.source} in {self.load_seconds:.2f}s")
+        return self._model
+
+    def _load(self):
+        from sentence_transformers import SentenceTransformer
+        path = self.local_path
+        if path and os.path.isfile(os.path.join(path, "modules.json")):
+            self.source = path
+            return SentenceTransformer(path)
+        self.source = "hub"
+        model = SentenceTransformer(self.name)
+        if path:
+            self.save(model, path)
+        return model
+
+    @staticmethod
+    def save(model, path):
+        # Written next to path and renamed into place, so a concurrent start never loads half a model
+        parent = os.path.dirname(path) or "."
+        tmp = None
+        try:
+            os.makedirs(parent, exist_ok=True)
+            tmp = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+            model.save(tmp)
+            os.rename(tmp, path)
+            logger.info(f"Saved embedding model to {path}")
+        except OSError as e:
+            logger.warning(f"Could not save embedding model to {path}: {e}")
+            if tmp:
+                shutil.rmtree(tmp, ignore_errors=True)
+
+    def warm(self):
+        """Load the model and run one encode, so the first request pays neither cost."""
+        model = self.load()
+        if self.warm_seconds is None:
+            start = time.perf_counter()
+            model.encode(["warm-up"])
+            self.warm_seconds = time.perf_counter() - start
+        return model
+
+    def encode(self, texts, **kwargs):
+        return self.load().encode(texts, **kwargs)
+
+    def __getattr__(self, name):
+        # tokenizer, max_seq_length, ... of the loaded model
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "ready": self.ready,
+            "source": self.source,
+            "load_seconds": self.load_seconds,
+            "warm_seconds": self.warm_seconds,
+            "error": self.error,
+        }
+
+
+if __name__ == "__main__":
+    # Pre-serialize the model at build time:
+    #   EMBEDDING_MODEL_CACHE_DIR=/app/models python -m src.startup
+    logging.basicConfig(level=logging.INFO)
+    if not EMBEDDING_MODEL_CACHE_DIR:
+        sys.exit("Set EMBEDDING_MODEL_CACHE_DIR to the directory to save the model to")
+    LazyModel().warm()
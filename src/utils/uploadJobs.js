@@ -0,0 +1,57 @@
+// POST /upload answers 202 with a job id; the document is ingested in the background.
+// Poll the job's status URL until it finishes and resolve with the ingestion result.
+// Jobs live on the instance that accepted the upload, so requests send the session affinity cookie.
+
+const POLL_INTERVAL_MS = 1000;
+// Session affinity is best effort: a poll routed to another instance gets a 404 for a job that exists.
+// Keep polling through that many in a row before telling the user to check back.
+const MISSING_JOB_POLLS = 10;
+
+// Error message from a failed job or an error response body
+export const uploadErrorMessage = (body, fallback) => {
+  if (!body) return fallback;
+  if (body.error && typeof body.error === 'object') return body.error.detail || fallback;
+  return body.error || body.detail || fallback;
+};
+
+// Resolves with the job's result once it succeeded, rejects if it failed or was cancelled.
+// onProgress receives { status, progress, queue_position } after every poll.
+export const waitForUpload = async (baseUrl, job, { onProgress, intervalMs = POLL_INTERVAL_MS } = {}) => {
+  const statusUrl = new URL(job.status_url, baseUrl).toString();
+  let missing = 0;
+  for (;;) {
+    const response = await fetch(statusUrl, { credentials: 'include' });
+    if (response.status === 404) {
+      // The job was accepted, so it is still there, on an instance this poll did not reach
+      missing += 1;
+      if (missing >= MISSING_JOB_POLLS) {
+        const err = new Error('Your document was received and is still being processed. Check back in a moment; it will appear once it is ready.');
+        err.pending = true; // not a failure: callers show it as a notice
+        throw err;
+      }
+      await new Promise(resolve => setTimeout(resolve, intervalMs));
+      continue;
+    }
+    missing = 0;
+    let body;
+    try {
+      body = await response.json();
+    } catch (jsonErr) {
+      throw new Error('Upload failed: Invalid server response.');
+    }
+    if (!response.ok) {
+      throw new Error(uploadErrorMessage(body, 'Upload failed.'));
+    }
+    if (onProgress) {
+      onProgress({ status: body.status, progress: body.progress, queue_position: body.queue_position });
+    }
+    if (body.status === 'succeeded') return body.result;
+    if (body.status === 'failed') throw new Error(uploadErrorMessage(body, 'Upload failed.'));
+    if (body.status === 'cancelled') throw new Error('Upload cancelled.');
+    await new Promise(resolve => setTimeout(resolve, intervalMs));
+  }
+};
+
+// Stops a queued or running upload; stored chunks are removed by the server
+export const cancelUpload = (baseUrl, job) =>
+  fetch(new URL(job.status_url, baseUrl).toString(), { method: 'DELETE', credentials: 'include' });
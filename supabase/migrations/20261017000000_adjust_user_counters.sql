@@ -0,0 +1,38 @@
+-- Incremental user counters, used by src/counters.py.
+--
+-- Applies signed deltas to users.conversation_count / users.message_count in a
+-- single UPDATE, so concurrent requests never lose an increment. A positive
+-- delta is refused for a non-premium user once it would take the counter past
+-- the given limit; a refused update (or an unknown user) returns no row.
+-- Counters never drop below zero. POST /users/{user_id}/recount still rebuilds
+-- both counters from COUNT(*) for periodic reconciliation.
+create or replace function public.adjust_user_counters(
+  p_user_id uuid,
+  p_conversations integer default 0,
+  p_messages integer default 0,
+  p_conversation_limit integer default null,
+  p_message_limit integer default null
+)
+returns table (conversation_count integer, message_count integer, membership_status text)
+language sql
+security definer
+set search_path = public
+as $$
+  update users as u
+  set conversation_count = greatest(coalesce(u.conversation_count, 0) + p_conversations, 0),
+      message_count = greatest(coalesce(u.message_count, 0) + p_messages, 0)
+  where u.id = p_user_id
+    and (
+      u.membership_status = 'premium'
+      or (
+        (p_conversation_limit is null or p_conversations <= 0
+          or coalesce(u.conversation_count, 0) + p_conversations <= p_conversation_limit)
+        and (p_message_limit is null or p_messages <= 0
+          or coalesce(u.message_count, 0) + p_messages <= p_message_limit)
+      )
+    )
+  returning u.conversation_count::integer, u.message_count::integer, u.membership_status::text;
+$$;
+
+revoke all on function public.adjust_user_counters(uuid, integer, integer, integer, integer) from public, anon, authenticated;
+grant execute on function public.adjust_user_counters(uuid, integer, integer, integer, integer) to service_role;
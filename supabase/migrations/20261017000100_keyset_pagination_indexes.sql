@@ -0,0 +1,9 @@
+-- Indexes backing the keyset (cursor) pagination of GET /messages/{conversation_id}
+-- and GET /conversations/{user_id} (src/pagination.py). Each page is an index range
+-- scan of limit + 1 rows, however deep the cursor, instead of a sort of the whole
+-- conversation or conversation list.
+create index if not exists messages_conversation_created_at_id_idx
+  on public.messages (conversation_id, created_at desc, id desc);
+
+create index if not exists conversations_user_created_at_id_idx
+  on public.conversations (user_id, created_at, id);
@@ -0,0 +1,187 @@
+import os
+import sys
+import uuid
+import threading
+from types import SimpleNamespace
+from collections import defaultdict
+
+import pytest
+from postgrest.exceptions import APIError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# src.app reads these at import time; everything runs offline against FakeDatabase
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "test-service-role-key")
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("MODEL_WARMUP_ENABLED", "false")
+os.environ.setdefault("DOC_CACHE_ENABLED", "false")
+os.environ.setdefault("ANN_INDEX_ENABLED", "false")
+
+from src.db import Database  # noqa: E402
+
+
+class FakeQuery:
+    """The slice of the postgrest query builder the app uses, run against FakeDatabase.tables."""
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.http_method = "GET"
+        self.path = f"/{table}"
+        self.payload = None
+        self.filters = []
+        self.row_limit = None
+        self.head = False
+        self.one = False
+        self.columns = None
+
+    def select(self, *columns, count=None, head=None):
+        self.columns = ",".join(columns)
+        self.head = bool(head)
+        return self
+
+    def insert(self, rows):
+        self.http_method, self.payload = "POST", rows if isinstance(rows, list) else [rows]
+        return self
+
+    def update(self, values):
+        self.http_method, self.payload = "PATCH", values
+        return self
+
+    def delete(self):
+        self.http_method = "DELETE"
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: str(row.get(column)) == str(value))
+        return self
+
+    def in_(self, column, values):
+        values = {str(v) for v in values}
+        self.filters.append(lambda row: str(row.get(column)) in values)
+        return self
+
+    def limit(self, count):
+        self.row_limit = count
+        return self
+
+    def order(self, column, desc=False):
+        return self
+
+    def single(self):
+        self.one = True
+        return self
+
+    def execute(self):
+        return self.db.run(self)
+
+
+class FakeRpc:
+    def __init__(self, db, name, params):
+        self.db = db
+        self.http_method = "POST"
+        self.path = f"/rpc/{name}"
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        function = self.db.functions.get(self.name)
+        if function is None:
+            # What PostgREST answers until the migration defining the function is applied
+            raise APIError({"code": "PGRST202", "message": f"Could not find the function public.{self.name}"})
+        with self.db.lock:
+            return SimpleNamespace(data=function(self.db, **self.params))
+
+
+def project(row, columns):
+    # PostgREST column lists: "a, b", "alias:column" and "alias:json_column->>key"
+    if not columns or columns.strip() == "*":
+        return dict(row)
+    projected = {}
+    for spec in columns.split(","):
+        alias, _, path = spec.strip().rpartition(":")
+        column, _, key = path.partition("->>")
+        value = row.get(column)
+        if key:
+            value = (value or {}).get(key)
+            value = None if value is None else str(value)
+        projected[alias or key or column] = value
+    return projected
+
+
+def adjust_user_counters(db, p_user_id, p_conversations=0, p_messages=0, p_conversation_limit=None,
+                         p_message_limit=None):
+    # Same rules as supabase/migrations/*_adjust_user_counters.sql; FakeRpc holds the lock
+    for user in db.tables["users"]:
+        if str(user["id"]) != str(p_user_id):
+            continue
+        conversations = (user.get("conversation_count") or 0) + p_conversations
+        messages = (user.get("message_count") or 0) + p_messages
+        if user.get("membership_status") != "premium" and (
+                (p_conversation_limit is not None and p_conversations > 0 and conversations > p_conversation_limit)
+                or (p_message_limit is not None and p_messages > 0 and messages > p_message_limit)):
+            return []
+        user["conversation_count"], user["message_count"] = max(conversations, 0), max(messages, 0)
+        return [{"conversation_count": user["conversation_count"], "message_count": user["message_count"],
+                 "membership_status": user.get("membership_status")}]
+    return []
+
+
+class FakeDatabase(Database):
+    """In-memory tables behind the real Database.execute (timings, retries)."""
+
+    def __init__(self):
+        self.max_retries = 0
+        self.retry_backoff = 0
+        self._stats = {}
+        self.tables = defaultdict(list)
+        self.functions = {"adjust_user_counters": adjust_user_counters}
+        self.lock = threading.Lock()
+        self.inserted = defaultdict(int)  # rows ever inserted per table
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params):
+        return FakeRpc(self, name, params)
+
+    def run(self, query):
+        with self.lock:
+            rows = self.tables[query.table]
+            if query.http_method == "POST":
+                new = [dict(row, id=row.get("id") or str(uuid.uuid4())) for row in query.payload]
+                rows.extend(new)
+                self.inserted[query.table] += len(new)
+                return SimpleNamespace(data=[dict(row) for row in new])
+            matched = [row for row in rows if all(f(row) for f in query.filters)]
+            if query.http_method == "PATCH":
+                for row in matched:
+                    row.update(query.payload)
+            elif query.http_method == "DELETE":
+                self.tables[query.table] = [row for row in rows if row not in matched]
+            count = len(matched)
+            if query.head:
+                matched = []
+            elif query.row_limit is not None:
+                matched = matched[:query.row_limit]
+            if query.one:
+                if len(matched) != 1:
+                    raise LookupError(f"{len(matched)} rows in {query.table}, expected one")
+                return SimpleNamespace(data=project(matched[0], query.columns), count=count)
+            return SimpleNamespace(data=[project(row, query.columns) for row in matched], count=count)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_db():
+    return FakeDatabase()
+
+
+@pytest.fixture
+def app_module(fake_db, monkeypatch):
+    import src.app as app_module
+    monkeypatch.setattr(app_module, "get_db", lambda: fake_db)
+    return app_module
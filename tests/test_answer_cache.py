@@ -0,0 +1,113 @@
+import uuid
+import asyncio
+
+import httpx
+import numpy as np
+import pytest
+
+from src.answer_cache import AnswerCache
+
+CONTEXT = ["Section 4: fire damage is covered up to the insured value."]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def vector(*values):
+    return np.array(values, dtype=np.float32)
+
+
+def test_hit_needs_same_fingerprint_and_similar_question():
+    cache = AnswerCache(threshold=0.9)
+    cache.put("docs", vector(1, 0, 0), "Fire is covered.", "Is fire covered?")
+    answer, similarity = cache.get("docs", vector(1, 0.1, 0))
+    assert answer == "Fire is covered." and similarity > 0.99
+    assert cache.get("docs", vector(0.5, 1, 0)) is None
+    assert cache.get("other docs", vector(1, 0, 0)) is None
+    # A near-identical question replaces the stored answer instead of adding another
+    cache.put("docs", vector(1, 0.05, 0), "Fire is covered up to the insured value.")
+    assert cache.get("docs", vector(1, 0, 0))[0] == "Fire is covered up to the insured value."
+    assert cache.stats()["entries"] == 1 and cache.stats()["replacements"] == 1
+
+
+def test_entries_expire_and_least_recently_used_go_first():
+    clock = Clock()
+    cache = AnswerCache(threshold=0.9, max_entries=2, ttl_seconds=60, clock=clock)
+    cache.put("docs", vector(1, 0, 0), "a")
+    cache.put("docs", vector(0, 1, 0), "b")
+    assert cache.get("docs", vector(1, 0, 0))[0] == "a"  # b is now least recently used
+    cache.put("docs", vector(0, 0, 1), "c")
+    assert cache.get("docs", vector(0, 1, 0)) is None and cache.stats()["evictions"] == 1
+    clock.now += 61
+    assert cache.get("docs", vector(1, 0, 0)) is None and cache.stats()["expirations"] == 2
+
+
+@pytest.fixture
+def ask(app_module, fake_db, monkeypatch):
+    monkeypatch.setattr(app_module.limiter, "enabled", False)
+    monkeypatch.setattr(app_module, "answer_cache", AnswerCache())
+    app_module.profile_cache.clear()
+    for user in ("alice", "bob"):
+        fake_db.tables["users"].append({"id": user, "membership_status": "premium",
+                                        "conversation_count": 0, "message_count": 0})
+
+    async def embed(text):
+        return np.ones(8, dtype=np.float32)
+    monkeypatch.setattr(app_module.embedding_service, "embed", embed)
+    answers = iter(f"answer {n}" for n in range(100))
+    monkeypatch.setattr(app_module.llm, "generate", lambda history, prompt: next(answers))
+
+    def post(user, turns, conversation_id=None, **options):
+        body = {"user_id": user, "conversation_id": conversation_id or str(uuid.uuid4()),
+                "messages": [{"sender": s, "content": c} for s, c in turns], "rag_context": CONTEXT, **options}
+
+        async def send():
+            transport = httpx.ASGITransport(app=app_module.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                return await http.post("/ask", json=body)
+        response = asyncio.run(send())
+        assert response.status_code == 200
+        return response.json()
+    return post
+
+
+def test_first_question_hits_for_the_same_user_only(ask):
+    first = ask("alice", [("user", "Is fire covered?")])
+    assert ask("alice", [("user", "Is fire covered?")]) == dict(first, cache_hit=True)
+    assert ask("bob", [("user", "Is fire covered?")])["cache_hit"] is False
+
+
+def test_follow_up_does_not_hit_across_conversations(ask):
+    ask("alice", [("user", "Is fire covered?"), ("ai", "Yes."), ("user", "Up to what amount?")])
+    other = ask("alice", [("user", "Is flood covered?"), ("ai", "No."), ("user", "Up to what amount?")])
+    assert other["cache_hit"] is False
+    again = ask("alice", [("user", "Is flood covered?"), ("ai", "No."), ("user", "Up to what amount?")])
+    assert again == dict(other, cache_hit=True)
+
+
+def test_hits_are_saved_as_messages_marked_cache_hit(ask, fake_db):
+    ask("alice", [("user", "Is fire covered?")])
+    ask("alice", [("user", "Is fire covered?")])
+    assert [m["metadata"]["cache_hit"] for m in fake_db.tables["messages"]] == [False, True]
+    assert fake_db.tables["messages"][1]["metadata"]["cache_similarity"] == 1.0
+    assert fake_db.tables["messages"][0]["content"] == fake_db.tables["messages"][1]["content"]
+
+
+def test_opting_out_skips_the_cache_both_ways(ask, app_module):
+    assert ask("alice", [("user", "Is fire covered?")], use_answer_cache=False)["cache_hit"] is False
+    assert app_module.answer_cache.stats()["entries"] == 0
+    first = ask("alice", [("user", "Is fire covered?")])
+    assert ask("alice", [("user", "Is fire covered?")], use_answer_cache=False)["answer"] != first["answer"]
+
+
+def test_works_with_the_local_fake_model(ask, app_module, monkeypatch):
+    from src.llm import FakeBackend
+    monkeypatch.setattr(app_module, "llm", FakeBackend())
+    first = ask("alice", [("user", "Is fire covered?")])
+    assert first["answer"].startswith("(fake answer)") and first["cache_hit"] is False
+    assert ask("alice", [("user", "Is fire covered?")]) == dict(first, cache_hit=True)
@@ -0,0 +1,60 @@
+import time
+import uuid
+import asyncio
+
+import httpx
+import pytest
+
+LIMIT = 10
+
+
+@pytest.fixture
+def client(app_module, fake_db, monkeypatch):
+    monkeypatch.setattr(app_module.limiter, "enabled", False)
+    app_module.profile_cache.clear()
+    fake_db.tables["users"].append({"id": "free-user", "membership_status": "free",
+                                    "conversation_count": 0, "message_count": 0})
+
+    async def post_all(path, bodies):
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await asyncio.gather(*(http.post(path, json=body) for body in bodies))
+    return lambda path, bodies: asyncio.run(post_all(path, bodies))
+
+
+def question(content="What does the policy cover?"):
+    return {"user_id": "free-user", "conversation_id": str(uuid.uuid4()),
+            "messages": [{"sender": "user", "content": content}], "use_answer_cache": False}
+
+
+def message_count(fake_db):
+    return fake_db.tables["users"][0]["message_count"]
+
+
+@pytest.mark.parametrize("path", ["/ask", "/ask/stream"])
+def test_parallel_asks_at_the_limit(client, app_module, fake_db, monkeypatch, path):
+    def slow_generate(history, prompt):
+        time.sleep(0.05)
+        return "It covers fire and theft."
+    monkeypatch.setattr(app_module.llm, "generate", slow_generate)
+    monkeypatch.setattr(app_module.llm, "stream", lambda history, prompt: iter([slow_generate(history, prompt)]))
+    responses = client(path, [question() for _ in range(LIMIT + 5)])
+    answered = [r for r in responses if r.status_code == 200]
+    assert len(answered) == LIMIT
+    assert all(r.status_code == 403 for r in responses if r.status_code != 200)
+    assert message_count(fake_db) == len(fake_db.tables["messages"]) == LIMIT
+
+
+def test_failure_before_generation_releases_the_reservation(client, app_module, fake_db, monkeypatch):
+    def broken_build(messages, rag_chunks):
+        raise RuntimeError("prompt assembly failed")
+    monkeypatch.setattr(app_module.prompt_budget, "build", broken_build)
+    responses = client("/ask", [question(), question()])
+    assert [r.status_code for r in responses] == [500, 500]
+    assert message_count(fake_db) == len(fake_db.tables["messages"]) == 0
+
+
+def test_non_string_content_is_rejected_before_reserving(client, fake_db):
+    responses = client("/ask", [question(123)])
+    assert responses[0].status_code == 422
+    assert message_count(fake_db) == 0
@@ -0,0 +1,114 @@
+import os
+import asyncio
+
+import numpy as np
+import pytest
+
+from src.ann import IVFIndex, ConversationIndexStore
+from src.embedding_cache import ConversationEmbeddingCache
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def rows(n, conversation_id="conversation", seed=0, document_id="doc"):
+    vectors = np.random.default_rng(seed).standard_normal((n, 16))
+    return [{"conversation_id": conversation_id, "content": f"{document_id} clause {i}", "embedding": v.tolist(),
+             "metadata": {"document_id": document_id}} for i, v in enumerate(vectors)]
+
+
+def test_cache_hit_does_not_restart_ttl(app_module, fake_db, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(app_module, "embedding_cache", ConversationEmbeddingCache(ttl_seconds=60, clock=clock))
+    fake_db.tables["document_contexts"] = rows(3)
+    first = asyncio.run(app_module.conversation_index(fake_db, "conversation"))
+    clock.now += 45
+    assert asyncio.run(app_module.conversation_index(fake_db, "conversation")) is first
+    clock.now += 45
+    assert app_module.embedding_cache.get("conversation") is None
+
+
+def test_cached_index_is_served_without_the_database_until_invalidated(app_module, fake_db, monkeypatch):
+    monkeypatch.setattr(app_module, "embedding_cache", ConversationEmbeddingCache())
+    fake_db.tables["document_contexts"] = rows(3)
+    first = asyncio.run(app_module.conversation_index(fake_db, "conversation"))
+    fake_db.tables["document_contexts"] = rows(5, document_id="other")
+    assert asyncio.run(app_module.conversation_index(fake_db, "conversation")) is first
+    app_module.embedding_cache.invalidate("conversation")
+    assert len(asyncio.run(app_module.conversation_index(fake_db, "conversation"))) == 5
+
+
+def test_build_that_raced_a_write_is_not_cached():
+    cache = ConversationEmbeddingCache()
+    index = IVFIndex.from_rows(rows(3))
+    version = cache.version()
+    cache.invalidate("conversation")  # e.g. an upload finished while the rows were being read
+    cache.put("conversation", index, version)
+    assert cache.get("conversation") is None and cache.stats()["stale_puts"] == 1
+    cache.put("conversation", index, cache.version())
+    assert cache.get("conversation") is index
+    # Other conversations are unaffected
+    cache.put("other", index, version)
+    assert cache.get("other") is index
+
+
+def test_saved_index_is_checked_against_document_contexts(app_module, fake_db, tmp_path, monkeypatch):
+    # Another instance changed the rows after this one saved its index
+    store = ConversationIndexStore(str(tmp_path))
+    monkeypatch.setattr(app_module, "ann_store", store)
+    monkeypatch.setattr(app_module, "embedding_cache", ConversationEmbeddingCache())
+    fake_db.tables["document_contexts"] = rows(3, document_id="a")
+    asyncio.run(app_module.conversation_index(fake_db, "conversation"))
+
+    # Unchanged: the saved index is used as is
+    app_module.embedding_cache.clear()
+    with monkeypatch.context() as patched:
+        patched.setattr(IVFIndex, "from_rows", None)
+        assert len(asyncio.run(app_module.conversation_index(fake_db, "conversation"))) == 3
+
+    # Replaced by a document with as many chunks: rebuilt, and saved again
+    app_module.embedding_cache.clear()
+    fake_db.tables["document_contexts"] = rows(3, seed=1, document_id="b")
+    index = asyncio.run(app_module.conversation_index(fake_db, "conversation"))
+    assert index.texts == [row["content"] for row in fake_db.tables["document_contexts"]]
+    assert store.load("conversation").document_counts() == {"b": 3}
+
+    # A document removed: rebuilt
+    app_module.embedding_cache.clear()
+    fake_db.tables["document_contexts"] = fake_db.tables["document_contexts"][:2]
+    assert len(asyncio.run(app_module.conversation_index(fake_db, "conversation"))) == 2
+
+
+def test_store_expires_and_evicts_least_recently_used(tmp_path):
+    clock = Clock()
+    index = IVFIndex.from_rows(rows(50))
+    store = ConversationIndexStore(str(tmp_path), ttl_seconds=3600, clock=clock)
+    store.save("a", index)
+    size = store.stats()["bytes"]
+    store.max_bytes = 2 * size
+    clock.now += 10
+    store.save("b", index)
+    clock.now += 10
+    assert store.load("a") is not None  # a is now the most recently used
+    clock.now += 10
+    store.save("c", index)
+    assert store.load("b") is None
+    assert store.load("a") is not None and store.load("c") is not None
+    assert store.stats()["evictions"] == 1
+
+    clock.now += 3601
+    assert store.load("a") is None
+    assert store.stats()["expirations"] == 1
+
+
+@pytest.mark.parametrize("name", ["../escape", "a.b"])
+def test_store_keeps_odd_ids_inside_its_directory(tmp_path, name):
+    store = ConversationIndexStore(str(tmp_path))
+    store.save(name, IVFIndex.from_rows(rows(5)))
+    assert len(store.load(name)) == 5
+    assert os.listdir(tmp_path) and all("." not in entry for entry in os.listdir(tmp_path))
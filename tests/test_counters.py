@@ -0,0 +1,131 @@
+import uuid
+import random
+import asyncio
+
+import httpx
+import pytest
+
+from src.counters import UserCounters, CounterLimitExceeded
+
+USER = str(uuid.uuid4())
+
+
+@pytest.fixture
+def counters(app_module, monkeypatch):
+    counters = UserCounters(app_module.FREE_USER_CONVERSATION_LIMIT, app_module.FREE_USER_AI_MESSAGE_LIMIT,
+                            profile_cache=app_module.profile_cache)
+    monkeypatch.setattr(app_module, "user_counters", counters)
+    app_module.profile_cache.clear()
+    return counters
+
+
+@pytest.fixture
+def api(app_module):
+    async def send(requests):
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await asyncio.gather(*(http.request(method, path, json=body) for method, path, body in requests))
+    return lambda requests: asyncio.run(send(requests))
+
+
+def add_user(fake_db, membership_status="premium", conversations=0, messages=0):
+    fake_db.tables["users"].append({"id": USER, "membership_status": membership_status,
+                                    "conversation_count": conversations, "message_count": messages})
+
+
+def add_conversation(fake_db, messages=0):
+    conversation_id = str(uuid.uuid4())
+    fake_db.tables["conversations"].append({"id": conversation_id, "user_id": USER, "title": "Policy"})
+    message_ids = [str(uuid.uuid4()) for _ in range(messages)]
+    fake_db.tables["messages"] += [{"id": m, "conversation_id": conversation_id, "sender": "user", "content": "Hi"}
+                                   for m in message_ids]
+    return conversation_id, message_ids
+
+
+def ground_truth(fake_db):
+    conversations = {c["id"] for c in fake_db.tables["conversations"] if c["user_id"] == USER}
+    messages = [m for m in fake_db.tables["messages"] if m["conversation_id"] in conversations]
+    return len(conversations), len(messages)
+
+
+def stored_counters(fake_db):
+    user = fake_db.tables["users"][0]
+    return user["conversation_count"], user["message_count"]
+
+
+def new_message(conversation_id):
+    return {"conversation_id": conversation_id, "sender": "user", "content": "What is covered?"}
+
+
+def test_concurrent_writes_match_row_counts(counters, api, fake_db):
+    add_user(fake_db)
+    kept = [add_conversation(fake_db, messages=4) for _ in range(4)]
+    doomed = [add_conversation(fake_db, messages=3) for _ in range(3)]
+    fake_db.tables["users"][0].update(zip(("conversation_count", "message_count"), ground_truth(fake_db)))
+
+    requests = [("POST", "/conversations", {"user_id": USER, "title": f"New {n}"}) for n in range(6)]
+    requests += [("POST", "/messages", new_message(conversation_id)) for conversation_id, _ in kept for _ in range(5)]
+    requests += [("DELETE", f"/messages/{message_id}", None) for _, message_ids in kept for message_id in message_ids[:2]]
+    requests += [("DELETE", f"/conversations/{conversation_id}", None) for conversation_id, _ in doomed]
+    random.Random(0).shuffle(requests)
+    responses = api(requests)
+
+    assert all(r.status_code == 200 for r in responses)
+    assert counters.adjustments == len(requests) and counters.fallbacks == 0
+    assert stored_counters(fake_db) == ground_truth(fake_db) == (4 + 6, 4 * (4 + 5 - 2))
+
+
+def test_racing_deletes_of_one_row_count_it_once(counters, api, fake_db):
+    add_user(fake_db)
+    conversation_id, message_ids = add_conversation(fake_db, messages=3)
+    other_id, _ = add_conversation(fake_db, messages=2)
+    fake_db.tables["users"][0].update(zip(("conversation_count", "message_count"), ground_truth(fake_db)))
+    # A loser that looks the row up after the winner deleted it fails; it must not decrement either way
+    api([("DELETE", f"/messages/{message_ids[0]}", None)] * 4 + [("DELETE", f"/conversations/{other_id}", None)] * 4)
+    assert stored_counters(fake_db) == ground_truth(fake_db) == (1, 2)
+
+
+def test_free_user_limit_is_enforced_under_concurrency(counters, api, fake_db):
+    add_user(fake_db, membership_status="free")
+    responses = api([("POST", "/conversations", {"user_id": USER, "title": f"New {n}"}) for n in range(5)])
+    assert sorted(r.status_code for r in responses) == [200] + [403] * 4
+    assert counters.refused == 4
+    assert stored_counters(fake_db) == ground_truth(fake_db) == (1, 0)
+
+
+def test_limit_refusal_changes_nothing(counters, fake_db):
+    add_user(fake_db, membership_status="free", messages=counters.message_limit)
+    with pytest.raises(CounterLimitExceeded) as raised:
+        asyncio.run(counters.adjust(fake_db, USER, messages=1, enforce=True))
+    assert raised.value.counter == "messages"
+    assert stored_counters(fake_db) == (0, counters.message_limit)
+    # Decrements are never refused, even at the limit
+    assert asyncio.run(counters.adjust(fake_db, USER, messages=-1, enforce=True))["message_count"] == counters.message_limit - 1
+
+
+def test_deletes_never_take_counters_below_zero(counters, api, fake_db):
+    # Rows written before the counters existed: the counters start at zero
+    add_user(fake_db)
+    conversation_id, message_ids = add_conversation(fake_db, messages=2)
+    api([("DELETE", f"/messages/{message_id}", None) for message_id in message_ids])
+    assert stored_counters(fake_db) == (0, 0)
+    api([("DELETE", f"/conversations/{conversation_id}", None)])
+    assert stored_counters(fake_db) == (0, 0)
+
+
+def test_fallback_without_the_rpc(counters, api, fake_db):
+    del fake_db.functions["adjust_user_counters"]
+    add_user(fake_db, membership_status="free")
+    # Read-modify-write is not atomic, so the fallback is checked one request at a time
+    assert api([("POST", "/conversations", {"user_id": USER, "title": "First"})])[0].status_code == 200
+    assert not counters.rpc_available and counters.fallbacks == 1
+    assert api([("POST", "/conversations", {"user_id": USER, "title": "Second"})])[0].status_code == 403
+    conversation_id = fake_db.tables["conversations"][0]["id"]
+    for _ in range(3):
+        api([("POST", "/messages", new_message(conversation_id))])
+    message_id = fake_db.tables["messages"][0]["id"]
+    api([("DELETE", f"/messages/{message_id}", None)])
+    assert stored_counters(fake_db) == ground_truth(fake_db) == (1, 2)
+    fake_db.tables["users"][0]["message_count"] = 0
+    api([("DELETE", f"/conversations/{conversation_id}", None)])
+    assert stored_counters(fake_db) == ground_truth(fake_db) == (0, 0)
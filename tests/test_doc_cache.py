@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.doc_cache import DocumentCache
+
+SHA = "ab" * 32
+VARIANT = "model|chunker"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DocumentCache(directory=str(tmp_path), max_bytes=10 * 1024 * 1024)
+
+
+def write(writer, chunks, seed):
+    writer.add(chunks, np.random.default_rng(seed).standard_normal((len(chunks), 8)))
+
+
+def read(entry):
+    return [chunk for chunks, _ in entry.batches(2) for chunk in chunks]
+
+
+def test_overlapping_writers_of_one_document(cache):
+    first, second = cache.writer(SHA, VARIANT), cache.writer(SHA, VARIANT)
+    write(first, ["a", "b", "c"], 1)
+    write(second, ["x", "y"], 2)
+    first.commit("abc", False, 1, 0.5)
+    second.commit("xy", False, 1, 0.5)
+    entry = cache.get(SHA, VARIANT)
+    assert entry.text == "xy" and read(entry) == ["x", "y"]
+    # No temp files left behind
+    assert not [name for _, _, files in os.walk(cache.directory) for name in files if name.endswith(".partial")]
+
+
+def test_corrupt_entry_is_dropped(cache):
+    writer = cache.writer(SHA, VARIANT)
+    write(writer, ["a", "b", "c"], 1)
+    writer.commit("abc", False, 1, 0.5)
+    with open(cache._base_path(SHA, VARIANT) + ".chunks", "w") as f:
+        f.write('"a"\n{not json\n"c"\n')
+    assert cache.get(SHA, VARIANT) is None
+    assert cache.stats()["entries"] == 0
+    # The next upload rebuilds it
+    writer = cache.writer(SHA, VARIANT)
+    write(writer, ["a", "b", "c"], 1)
+    writer.commit("abc", False, 1, 0.5)
+    assert read(cache.get(SHA, VARIANT)) == ["a", "b", "c"]
+
+
+def test_failed_commit_does_not_raise(cache, monkeypatch):
+    writer = cache.writer(SHA, VARIANT)
+    write(writer, ["a"], 1)
+
+    def fail(*args):
+        raise OSError("disk full")
+    monkeypatch.setattr(cache, "_install", fail)
+    writer.commit("a", False, 1, 0.5)
+    assert cache.get(SHA, VARIANT) is None
+    assert not [name for _, _, files in os.walk(cache.directory) for name in files if name.endswith(".partial")]
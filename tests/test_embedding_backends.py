@@ -0,0 +1,19 @@
+import numpy as np
+
+from src.doc_cache import DocumentCache
+from src.embedding_backends import TorchBackend, Int8Backend
+
+
+def test_variant_tells_backends_and_dtypes_apart():
+    variants = {backend(dtype=dtype).variant for backend in (TorchBackend, Int8Backend) for dtype in ("float32", "float16")}
+    assert len(variants) == 4
+
+
+def test_document_cache_entries_are_per_backend(tmp_path):
+    cache = DocumentCache(str(tmp_path))
+    torch, int8 = TorchBackend().variant, Int8Backend().variant
+    writer = cache.writer("0" * 64, torch)
+    writer.add(["Claims are paid within thirty days."], np.ones((1, 8), dtype=np.float32))
+    writer.commit("Claims are paid within thirty days.", False, 1, 0.1)
+    assert cache.get("0" * 64, torch) is not None
+    assert cache.get("0" * 64, int8) is None
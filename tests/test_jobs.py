@@ -0,0 +1,189 @@
+import time
+import uuid
+import zlib
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import numpy as np
+import pytest
+
+from src.ingest import iter_chunks
+from src.jobs import JobQueue, JobError, QueueFull, QUEUED, SUCCEEDED, FAILED, CANCELLED
+
+
+async def drain(queue, *jobs):
+    while not all(job.done for job in jobs):
+        await asyncio.sleep(0.01)
+
+
+def run_queue(queue, body):
+    async def main():
+        queue.start()
+        try:
+            return await body()
+        finally:
+            await queue.stop()
+    return asyncio.run(main())
+
+
+def test_results_errors_and_fair_order():
+    queue = JobQueue(workers=1, max_queued=10, max_queued_per_owner=10)
+    order = []
+
+    def job(name, outcome=None):
+        async def run(job):
+            order.append(name)
+            if outcome:
+                raise outcome
+            return {"name": name}
+        return run
+
+    async def body():
+        # Submitted before a worker is free: alice's burst must not delay bob
+        jobs = [queue.submit("alice", job(f"alice-{n}")) for n in range(3)]
+        jobs.append(queue.submit("bob", job("bob", JobError(413, "too large"))))
+        jobs.append(queue.submit("bob", job("bob-crash", RuntimeError("boom"))))
+        assert [queue.position(j) for j in jobs] == [0, 2, 4, 1, 3]
+        await drain(queue, *jobs)
+        return jobs
+    jobs = run_queue(queue, body)
+    assert order == ["alice-0", "bob", "alice-1", "bob-crash", "alice-2"]
+    assert jobs[0].status == SUCCEEDED and jobs[0].to_dict()["result"] == {"name": "alice-0"}
+    assert jobs[3].status == FAILED and jobs[3].error == {"status_code": 413, "detail": "too large"}
+    assert jobs[4].error == {"status_code": 500, "detail": "boom"}
+    assert queue.stats()[SUCCEEDED] == 3 and queue.stats()[FAILED] == 2
+
+
+def test_finished_jobs_are_pruned_by_age_and_count(monkeypatch):
+    queue = JobQueue(workers=1, retention_seconds=600, max_retained=2)
+    now = [1_000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    jobs = [queue.submit("alice", None) for _ in range(4)]
+    for n, job in enumerate(jobs):
+        queue.cancel(job.id)
+        job.finished_at = now[0] + n
+    # Over max_retained: the oldest finished jobs go first
+    assert queue.get(jobs[0].id) is None and queue.get(jobs[1].id) is None
+    assert queue.get(jobs[3].id) is jobs[3]
+    now[0] += 602.5
+    assert queue.get(jobs[2].id) is None and queue.get(jobs[3].id) is jobs[3]
+    now[0] += 1
+    assert queue.get(jobs[3].id) is None
+    # Unfinished jobs are never pruned
+    waiting = queue.submit("alice", None)
+    now[0] += 10_000
+    assert queue.get(waiting.id) is waiting and waiting.status == QUEUED
+
+
+def test_queue_limits():
+    queue = JobQueue(workers=1, max_queued=3, max_queued_per_owner=2)
+    queue.submit("alice", None)
+    queue.submit("alice", None)
+    with pytest.raises(QueueFull) as raised:
+        queue.submit("alice", None)
+    assert raised.value.per_owner
+    queue.submit("bob", None)
+    with pytest.raises(QueueFull) as raised:
+        queue.submit("carol", None)
+    assert not raised.value.per_owner
+    assert queue.stats()["rejected"] == 2
+
+
+@pytest.fixture
+def uploads(app_module, fake_db, monkeypatch):
+    queue = JobQueue(workers=1, max_queued=10, max_queued_per_owner=2)
+    monkeypatch.setattr(app_module, "ingest_jobs", queue)
+    conversation_id = str(uuid.uuid4())
+    fake_db.tables["conversations"].append({"id": conversation_id, "user_id": "alice"})
+
+    async def post(http):
+        return await http.post("/upload", data={"conversation_id": conversation_id},
+                               files={"file": ("policy.txt", b"Claims must be filed within thirty days.")})
+
+    def run(body):
+        async def main():
+            transport = httpx.ASGITransport(app=app_module.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                return await body(http)
+        return asyncio.run(main())
+    return SimpleNamespace(queue=queue, post=post, run=run, conversation_id=conversation_id)
+
+
+def test_per_user_queue_full_is_429_with_retry_after(uploads, app_module):
+    # Workers are not started, so accepted uploads stay queued
+    async def body(http):
+        return [await uploads.post(http) for _ in range(3)]
+    accepted, second, rejected = uploads.run(body)
+    assert accepted.status_code == second.status_code == 202
+    assert accepted.headers["Location"] == accepted.json()["status_url"]
+    assert [accepted.json()["queue_position"], second.json()["queue_position"]] == [0, 1]
+    assert rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == str(app_module.INGEST_RETRY_AFTER_SECONDS)
+
+
+def test_status_polls_are_idempotent(uploads, app_module, monkeypatch):
+    async def ingest(job, staged, conversation_id, max_chunks, sim_threshold, echo_text):
+        return {"text": "x" * 50_000, "text_truncated": False, "stored": 3}
+    monkeypatch.setattr(app_module, "ingest_upload", ingest)
+
+    async def body(http):
+        uploads.queue.start()
+        try:
+            job_id = (await uploads.post(http)).json()["job_id"]
+            await drain(uploads.queue, uploads.queue.get(job_id))
+            return [(await http.get(f"/upload/{job_id}")).json() for _ in range(3)]
+        finally:
+            await uploads.queue.stop()
+    polls = uploads.run(body)
+    assert polls[0]["status"] == SUCCEEDED and polls[0]["result"]["text"] == "x" * 50_000
+    assert polls[0] == polls[1] == polls[2]
+
+
+def test_result_text_is_capped_when_the_job_finishes(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "INGEST_RESULT_TEXT_MAX_CHARS", 10)
+    result = SimpleNamespace(text="y" * 50, text_truncated=False)
+    text, truncated = app_module.result_text(result, None)
+    assert (text, truncated) == ("y" * 10, True)
+    assert app_module.result_text(result, 4) == ("y" * 4, True)
+    assert app_module.result_text(result, 0) == (None, True)
+
+
+class CharChunker:
+    variant = "chars"
+
+    @staticmethod
+    def iter_chunks(pieces):
+        return iter_chunks(pieces, max_length=200)
+
+
+def test_cancel_rolls_back_stored_rows(uploads, app_module, fake_db, monkeypatch):
+    def pages(source, ext, executor=None):
+        for number in range(100_000):
+            time.sleep(0.001)
+            yield f"Page {number}: the insurer pays claim {number} within thirty days of notice."
+    monkeypatch.setattr(app_module, "iter_pages", pages)
+    monkeypatch.setattr(app_module, "upload_chunker", lambda: CharChunker())
+    monkeypatch.setattr(app_module, "embed_texts", lambda texts: np.stack(
+        [np.random.default_rng(zlib.crc32(text.encode())).standard_normal(16) for text in texts]).astype(np.float32))
+
+    async def body(http):
+        uploads.queue.start()
+        try:
+            response = await http.post("/upload", data={"conversation_id": uploads.conversation_id, "max_chunks": "0"},
+                                       files={"file": ("policy.txt", b"unused")})
+            job = uploads.queue.get(response.json()["job_id"])
+            while not fake_db.inserted["document_contexts"]:
+                await asyncio.sleep(0.01)
+            cancelled = await http.delete(f"/upload/{job.id}")
+            await drain(uploads.queue, job)
+            again = await http.delete(f"/upload/{job.id}")
+            return cancelled, job, again
+        finally:
+            await uploads.queue.stop()
+    cancelled, job, again = uploads.run(body)
+    assert cancelled.status_code == 202 and cancelled.json()["cancel_requested"]
+    assert job.status == CANCELLED
+    assert fake_db.inserted["document_contexts"] > 0 and fake_db.tables["document_contexts"] == []
+    # Cancelling a finished-as-cancelled job is a no-op; the job stays queryable until pruned
+    assert again.status_code == 202 and again.json()["status"] == CANCELLED
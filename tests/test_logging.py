@@ -0,0 +1,7 @@
+import logging
+
+
+def test_log_lines_are_formatted_once(app_module):
+    record = logging.LogRecord("src.app", logging.INFO, __file__, 1, "hello %s", ("world",), None)
+    line = app_module.log_formatter.format(app_module.queue_handler.prepare(record))
+    assert line.endswith(" - src.app - INFO - hello world")
@@ -0,0 +1,30 @@
+import os
+import asyncio
+
+import httpx
+
+from src import metrics
+from src.metrics import Gauge, Counter
+
+
+def test_disabled_metrics_record_nothing(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", False)
+    gauge, counter = Gauge("depth", "Depth", ("pool",)), Counter("events", "Events")
+    gauge.set(3, pool="parse")
+    gauge.inc(pool="embed")
+    gauge.dec(pool="embed")
+    counter.inc()
+    assert gauge._values == counter._values == {}
+
+
+def test_profile_header_names_the_file_only(app_module, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, "should_profile", lambda request: True)
+    monkeypatch.chdir(tmp_path)  # PROFILE_DIR defaults to a relative "profiles"
+
+    async def get():
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await http.get("/health")
+    name = asyncio.run(get()).headers["X-Profile"]
+    assert os.sep not in name and "profiles" not in name
+    assert os.listdir(tmp_path / "profiles") == [name]
@@ -0,0 +1,33 @@
+import os
+import asyncio
+
+import httpx
+
+SERVICE = {"Authorization": f"Bearer {os.environ['SUPABASE_SERVICE_ROLE_KEY']}"}
+
+
+def post_invalidate(app_module, headers_list):
+    async def send():
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return [await http.post("/users/alice/invalidate", json={}, headers=headers) for headers in headers_list]
+    return asyncio.run(send())
+
+
+def cache_alice(app_module):
+    app_module.profile_cache.put("alice", {"membership_status": "free", "conversation_count": 0, "message_count": 0})
+
+
+def test_only_service_callers_can_invalidate(app_module):
+    app_module.limiter.reset()
+    cache_alice(app_module)
+    anonymous, wrong, service = post_invalidate(app_module, [{}, {"Authorization": "Bearer guess"}, SERVICE])
+    assert anonymous.status_code == wrong.status_code == 401
+    assert service.status_code == 200
+    assert app_module.profile_cache.get("alice") is None
+
+
+def test_invalidate_is_rate_limited(app_module):
+    app_module.limiter.reset()
+    responses = post_invalidate(app_module, [SERVICE] * 11)
+    assert [r.status_code for r in responses] == [200] * 10 + [429]
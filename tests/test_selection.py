@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from src.selection import ChunkSelector
+
+SIM_THRESHOLD = 0.85
+
+
+def legacy_select(chunks, embeddings, max_chunks, sim_threshold=SIM_THRESHOLD):
+    # The length-ordered greedy loop /upload used before ChunkSelector
+    scored = sorted([(len(c), i, c, e) for i, (c, e) in enumerate(zip(chunks, embeddings)) if len(c.strip()) > 50], reverse=True)
+    selected = []
+    selected_embeds = []
+    for _, _, chunk, embed in scored:
+        if len(selected) >= max_chunks:
+            break
+        is_duplicate = False
+        for e2 in selected_embeds:
+            sim = float(np.dot(embed, e2) / (np.linalg.norm(embed) * np.linalg.norm(e2)))
+            if sim > sim_threshold:
+                is_duplicate = True
+                break
+        if not is_duplicate:
+            selected.append(chunk)
+            selected_embeds.append(embed)
+    return selected
+
+
+def select(chunks, embeddings, max_chunks, batch_size):
+    selector = ChunkSelector(max_chunks=max_chunks, sim_threshold=SIM_THRESHOLD)
+    selected = []
+    for start in range(0, len(chunks), batch_size):
+        selected += selector.offer(chunks[start:start + batch_size], embeddings[start:start + batch_size])
+    return [chunk for chunk, _ in selected + selector.finish()]
+
+
+def grouped_document(rng, n):
+    # Near-duplicates come in groups (all alike within a group, unlike across groups); lengths often tie
+    centers = rng.standard_normal((max(1, n // 3), 64)) * 10
+    embeddings = centers[rng.integers(0, len(centers), n)] + rng.standard_normal((n, 64)) * 0.1
+    lengths = rng.integers(51, 60 if rng.random() < 0.5 else 120, n)
+    chunks = [f"{i:03d}" + "x" * (int(length) - 3) for i, length in enumerate(lengths)]
+    return chunks, embeddings.astype(np.float32)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_capped_matches_legacy_selection(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(25):
+        chunks, embeddings = grouped_document(rng, int(rng.integers(1, 40)))
+        max_chunks, batch_size = int(rng.integers(1, 8)), int(rng.integers(1, 10))
+        assert select(chunks, embeddings, max_chunks, batch_size) == legacy_select(chunks, embeddings, max_chunks)
+
+
+def chain(lengths):
+    # Unit vectors 25 degrees apart: neighbours are near-duplicates (cos 0.91), the next but one are not (cos 0.64)
+    angles = np.radians([25 * i for i in range(len(lengths))])
+    embeddings = np.stack([np.cos(angles), np.sin(angles)], axis=1).astype(np.float32)
+    return [f"{i}" + "x" * (length - 1) for i, length in enumerate(lengths)], embeddings
+
+
+def test_equal_lengths_later_chunk_wins_like_legacy():
+    chunks, embeddings = chain([60, 60])
+    assert select(chunks, embeddings, 2, 1) == legacy_select(chunks, embeddings, 2) == [chunks[1]]
+    chunks = ["a" * 60, "b" * 60, "c" * 60]
+    embeddings = np.eye(3, dtype=np.float32)
+    assert select(chunks, embeddings, 2, 1) == legacy_select(chunks, embeddings, 2) == ["c" * 60, "b" * 60]
+
+
+def test_chained_near_duplicates_are_not_reconsidered():
+    # C~B and B~A but not C~A, arriving C, B, A: the stream keeps only A, the legacy pass A and C
+    chunks, embeddings = chain([60, 70, 80])
+    assert select(chunks, embeddings, 3, 1) == [chunks[2]]
+    assert legacy_select(chunks, embeddings, 3) == [chunks[2], chunks[0]]
+
+
+def test_uncapped_keeps_first_near_duplicate_in_document_order():
+    chunks, embeddings = chain([60, 70, 80])
+    assert select(chunks, embeddings, 0, 1) == select(chunks, embeddings, 0, 3) == [chunks[0], chunks[2]]
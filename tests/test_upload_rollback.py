@@ -0,0 +1,77 @@
+import zlib
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from src.ingest import iter_chunks
+from src.jobs import Job, JobError
+from src.parsers import ParseTimeout, ParseError
+
+
+class CharChunker:
+    variant = "chars"
+
+    @staticmethod
+    def iter_chunks(pieces):
+        return iter_chunks(pieces, max_length=200)
+
+
+def embed(texts):
+    # A random vector per distinct text, so selection keeps every chunk
+    return np.stack([np.random.default_rng(zlib.crc32(text.encode())).standard_normal(64) for text in texts]).astype(np.float32)
+
+
+@pytest.fixture
+def pipeline(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "upload_chunker", lambda: CharChunker())
+    monkeypatch.setattr(app_module, "embed_texts", embed)
+
+    def run(pages):
+        monkeypatch.setattr(app_module, "iter_pages", lambda source, ext, executor=None: pages)
+        staged = SimpleNamespace(filename="policy.pdf", ext=".pdf", source=b"", sha256="0" * 64)
+        job = Job("user", run=None)
+        # max_chunks=0 stores every chunk as it goes, so batches are flushed before the failure
+        return asyncio.run(app_module.ingest_upload(job, staged, "conversation", 0, 0.95, None))
+    return run
+
+
+def failing_pages(error, pages=400):
+    for number in range(pages):
+        yield f"Page {number}: the insured must notify the insurer of claim {number} within thirty days."
+    raise error
+
+
+@pytest.mark.parametrize("error, status_code", [
+    (ParseTimeout("parsing took too long"), 408),
+    (ParseError("corrupt page"), 400),
+    # Whatever a parser library raises counts as a parse failure
+    (RuntimeError("parser crashed"), 400),
+])
+def test_failure_mid_stream_leaves_no_rows(pipeline, fake_db, error, status_code):
+    with pytest.raises(JobError) as raised:
+        pipeline(failing_pages(error))
+    assert raised.value.status_code == status_code
+    assert fake_db.inserted["document_contexts"] > 0
+    assert fake_db.tables["document_contexts"] == []
+
+
+def test_success_keeps_rows(pipeline, fake_db):
+    result = pipeline(iter([f"Clause {n}: premiums are due monthly in advance." for n in range(50)]))
+    assert result["stored"] == len(fake_db.tables["document_contexts"]) > 0
+
+
+def test_unexpected_error_mid_stream_leaves_no_rows(pipeline, app_module, fake_db, monkeypatch):
+    calls = []
+
+    def flaky_embed(texts):
+        calls.append(len(texts))
+        if len(calls) > 3:
+            raise RuntimeError("embedding backend crashed")
+        return embed(texts)
+    monkeypatch.setattr(app_module, "embed_texts", flaky_embed)
+    with pytest.raises(RuntimeError):
+        pipeline(f"Clause {n}: the insurer may amend these terms on sixty days notice." for n in range(2000))
+    assert fake_db.inserted["document_contexts"] > 0
+    assert fake_db.tables["document_contexts"] == []